@@ -1,91 +1,217 @@
-import cPickle as pickle
+import os
+import time
 
 from eventlet import monkey_patch
-from flask import Flask, json, jsonify, render_template
-from flask_socketio import SocketIO, emit
+from flask import Flask, abort, json, jsonify, render_template, request
+from flask_socketio import SocketIO
 
 from API_KEYS import mapbox_key
-from static import Edge, PrevStops, Segment, Stop, StopGraph, StopID# noqa: F401
-
+from broadcast import FrameBroadcaster
+from builders import RouteLevelsBuilder, load_build_manifest
 import feed
+from geometry import ShapeStore, StopIndex
+from realtime import FrameBuilder
+from registry import StaticRegistry
+from responses import EncodedResponse
+from tiles import ROUTE_ZOOM_LEVELS, TileStore, get_tolerance_level, \
+    get_zoom_level, simplify_line
+from transit import PrevStops, StopGraph
 
 monkey_patch()
 
 JSON_DIR = "map_files/"
-PICKLE_DIR = ".cache/"
+CACHE_DIR = ".cache/"
+
+# Default and maximum distance in meters, and default and maximum number, of
+# the stations sent by /stops_near
+STOPS_NEAR_RADIUS = 1000
+MAX_STOPS_NEAR_RADIUS = 5000
+STOPS_NEAR_LIMIT = 10
+MAX_STOPS_NEAR_LIMIT = 100
+
+# Maximum number of segment IDs asked for at once from /segments
+MAX_SEGMENT_IDS = 500
+
+# Cache-Control of responses that never change for a given version of their
+# contents
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
 app = Flask(__name__)
 socketio = SocketIO(app)
-feed_event = None
-
-with open(PICKLE_DIR + "graph.pkl", "rb") as graph_f, \
-        open(PICKLE_DIR + "prev_stops.pkl", "rb") as prev_stops_f, \
-        open(JSON_DIR + "shapes.json", "r") as shapes_f, \
-        open(JSON_DIR + "stops.json", "r") as stops_f, \
-        open(JSON_DIR + "routes.json", "r") as routes_f, \
-        open(JSON_DIR + "colors.json", "r") as colors_f:
-    graph = pickle.load(graph_f)
-    prev_stops = pickle.load(prev_stops_f)
-    shapes = json.load(shapes_f)
-    stops = json.load(stops_f)
-    routes = json.load(routes_f)
-    colors = json.load(colors_f)
-
-demos = [
-    [
-        {
-            "path": [[-73.96411, 40.807722], [-73.958372, 40.815581]],
-            "progress": 0.5,
-            "remaining_time": 10
-        },
-        {
-            "path": graph.get_path("118", "119", shapes),
-            "progress": 0.3,
-            "remaining_time": 15
-        }
-    ],
-    [
-        {
-            "path": [[-73.96411, 40.807722], [-73.959874, 40.77362]],
-            "progress": 0.5,
-            "remaining_time": 10
-        },
-        {
-            "path": [[-73.958372, 40.815581], [-73.987691, 40.755477]],
-            "progress": 0.3,
-            "remaining_time": 25
-        },
-    ],
-    [
-        {
-            "path": [[-73.958372, 40.815581], [-73.987691, 40.755477]],
-            "progress": 0.3,
-            "remaining_time": 25
-        },
-        {
-            "path": [[-73.992629, 40.730328], [-73.989951, 40.734673]],
-            "progress": 0.3,
-            "remaining_time": 15
-        }
-    ]
-]
+
+# Frames are encoded once each, and sent as is to every client subscribed to
+# the feed (see FrameBroadcaster and Frame.get_delta)
+broadcaster = FrameBroadcaster(socketio.server, "feed", "feed")
+feed_poller = None
+
+# Static data is only loaded when first used (see StaticRegistry), so that
+# importing the app (as tests and tools do) stays fast. Servers can instead
+# load all of it on startup by setting LIVESUBWAY_WARM_UP=1, so that the
+# first requests are not slowed down, and stale data fails right away.
+static_data = StaticRegistry()
+
+
+@static_data.loader
+def colors():
+    with open(JSON_DIR + "colors.json", "r") as colors_f:
+        return json.load(colors_f)
+
+
+# The static JSON files are served as is, so they are only read (and
+# compressed) once, instead of being parsed and serialized again on every
+# request
+@static_data.loader
+def stops_response():
+    with open(JSON_DIR + "stops.json", "rb") as stops_f:
+        return EncodedResponse(stops_f.read())
+
+
+@static_data.loader
+def routes_response():
+    with open(JSON_DIR + "routes.json", "rb") as routes_f:
+        return EncodedResponse(routes_f.read())
+
+
+@static_data.loader
+def route_level_responses():
+    # Map of zoom level -> encoded response of the simplified version of
+    # routes.json for the zoom level (see RouteLevelsBuilder)
+    responses = {}
+    for zoom in ROUTE_ZOOM_LEVELS:
+        with open(RouteLevelsBuilder.path.format(zoom), "rb") as level_f:
+            responses[zoom] = EncodedResponse(level_f.read())
+
+    return responses
+
+
+# The graph, previous stops and shapes are memory-mapped from packed files,
+# so all server processes share a single copy of them. Opening them raises a
+# StaleCacheError if they do not match the static feed recorded in the build
+# manifest, or were written by an older version of static.py.
+@static_data.loader
+def manifest():
+    return load_build_manifest()
+
+
+@static_data.loader
+def graph():
+    return StopGraph(CACHE_DIR + "graph.bin",
+                     static_data.manifest.get("graph"))
+
+
+@static_data.loader
+def prev_stops():
+    return PrevStops(CACHE_DIR + "prev_stops.bin",
+                     static_data.manifest.get("prev_stops"))
+
+
+@static_data.loader
+def shapes():
+    return ShapeStore(CACHE_DIR + "shapes.bin",
+                      static_data.manifest.get("shapes"))
+
+
+@static_data.loader
+def tiles():
+    return TileStore(CACHE_DIR + "tiles.mbtiles",
+                     static_data.manifest.get("tiles"))
+
+
+@static_data.loader
+def stop_index():
+    return StopIndex(CACHE_DIR + "stop_index.bin",
+                     static_data.manifest.get("stop_index"))
+
+
+# Version of the segment IDs of the graph and their paths, sent along with
+# the paths of the segments and with the frames
+@static_data.loader
+def segments_version():
+    return static_data.graph.get_segments_version(static_data.shapes)
+
+
+# Frames of the trains of the live feeds, remade whenever a feed has a new
+# snapshot, and shared by every client
+@static_data.loader
+def frames():
+    return FrameBuilder(static_data.prev_stops, static_data.graph,
+                        static_data.shapes)
+
+
+if os.environ.get("LIVESUBWAY_WARM_UP") == "1":
+    print "Loaded static data in {:.3f}s.".format(static_data.warm_up())
+
+# Map of (shape ID, zoom level or None) -> encoded response of the shape,
+# encoded on first request
+shape_responses = {}
+
+# Map of (zoom, x, y) -> encoded response of the tile, encoded on first
+# request. Only tiles in the store are kept, and every empty tile shares the
+# same response, so that requests of arbitrary tiles cannot fill the map.
+tile_responses = {}
+# Map of (segment ID, format (whether polyline)) -> JSON of the path of the
+# segment for /segments, encoded on first request. Only IDs of segments of
+# the graph are kept, so the map holds at most two paths per segment.
+segment_paths = {}
+
+# Map of format (whether polylines) -> encoded response of every segment for
+# /segments, encoded on first request
+all_segments_responses = {}
+
+empty_tile_response = EncodedResponse(
+    json.dumps({"type": "FeatureCollection", "features": []}))
+
+
+def get_zoom_level_arg():
+    # Zoom level of the simplified lines asked for, either by zoom (of the
+    # map) or by tolerance (in degrees of longitude), or None for the
+    # original lines
+    try:
+        if "zoom" in request.args:
+            return get_zoom_level(float(request.args["zoom"]))
+        if "tolerance" in request.args:
+            return get_tolerance_level(float(request.args["tolerance"]))
+    except ValueError:
+        abort(400)
+
+    return None
+
 
 @app.route('/')
 def index():
+    # Documentation for colors.json (written by static.py from routes.txt):
+    # route_id: route color
     return render_template("index.html", mapbox_key=mapbox_key,
-                                    subway_routes=shapes.keys(),
-                                    route_colors=colors)
+                           subway_routes=static_data.shapes.shape_ids,
+                           route_colors=static_data.colors)
 
 
 @app.route('/map_json/<route>')
 def map_json(route):
-    # Documentation for shapes.json:
-    # shape_id: {
+    # Shapes are kept in a compact ShapeStore (shapes.bin), and only
+    # converted to JSON here, of the form:
+    # {
     #      sequence: number of points,
+    #      route: route ID,
     #      color: route color,
+    #      length: length of the shape in meters,
     #      points: [[lon, lat],...,]
     # }
-    return jsonify(shapes[route])
+    # zoom or tolerance simplify the points, as with /map_geojson.
+    shapes = static_data.shapes
+    if route not in shapes:
+        abort(404)
+
+    key = (route, get_zoom_level_arg())
+    if key not in shape_responses:
+        shape = shapes.get_shape(route)
+        if key[1] is not None:
+            shape["points"] = simplify_line(shape["points"], key[1])
+
+        shape_responses[key] = EncodedResponse(
+            json.dumps(shape, separators=(",", ":")))
+
+    return shape_responses[key].make_response(request)
 
 
 @app.route('/map_geojson')
@@ -96,7 +222,14 @@ def map_geojson():
     #      color: route color,
     #      points: [[lon, lat],...,]
     # }
-    return jsonify(routes)
+    # zoom (of the map) or tolerance (in degrees of longitude) ask for the
+    # lines simplified for the matching zoom level (see RouteLevelsBuilder),
+    # which are much smaller; the original lines are sent otherwise.
+    zoom = get_zoom_level_arg()
+    if zoom is None:
+        return static_data.routes_response.make_response(request)
+
+    return static_data.route_level_responses[zoom].make_response(request)
 
 
 @app.route('/stops_json')
@@ -109,35 +242,174 @@ def stops_json():
     #      },
     #      name: name
     # }
-    return jsonify(stops)
+    return static_data.stops_response.make_response(request)
+
+
+@app.route('/stops_near')
+def stops_near():
+    # Stations near a point (see StopIndex), nearest first, of the form:
+    # {
+    #      stops: [{
+    #          stop_id: station ID,
+    #          name: name,
+    #          coordinates: [lon, lat],
+    #          distance: distance from the point in meters
+    #      },...,]
+    # }
+    # lat and lon give the point; radius (in meters) and limit bound the
+    # stations sent.
+    try:
+        lat = float(request.args["lat"])
+        lon = float(request.args["lon"])
+        radius = float(request.args.get("radius", STOPS_NEAR_RADIUS))
+        limit = int(request.args.get("limit", STOPS_NEAR_LIMIT))
+    except (KeyError, ValueError):
+        abort(400)
+
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180 and
+            0 <= radius <= MAX_STOPS_NEAR_RADIUS and
+            1 <= limit <= MAX_STOPS_NEAR_LIMIT):
+        abort(400)
+
+    return jsonify(stops=static_data.stop_index.get_stops_near(
+        lon, lat, radius, limit))
+
+
+@app.route('/tiles/<int:zoom>/<int:x>/<int:y>.json')
+def tile_json(zoom, x, y):
+    # Map tiles of the subway lines and stops (see TilesBuilder), each a
+    # GeoJSON FeatureCollection of:
+    # - a MultiLineString of the lines of each route in the tile, with the
+    #   properties of the route in routes.json
+    # - a Point of each stop in the tile, with properties stop_id and name
+    tiles = static_data.tiles
+    if not tiles.min_zoom <= zoom <= tiles.max_zoom or \
+            x >= 1 << zoom or y >= 1 << zoom:
+        abort(404)
+
+    key = (zoom, x, y)
+    if key not in tile_responses:
+        tile = tiles.get_tile(zoom, x, y)
+        if tile is None:
+            return empty_tile_response.make_response(request)
+
+        tile_responses[key] = EncodedResponse.from_gzip(tile)
+
+    return tile_responses[key].make_response(request)
+
+
+def get_segments_body(graph, shapes, version, segment_ids, polyline):
+    # JSON of the paths of segments for /segments, joined from the JSON of
+    # the path of each segment, which is only encoded once; raises a
+    # KeyError if there is no segment with one of the IDs
+    for segment_id in segment_ids:
+        key = (segment_id, polyline)
+        if key not in segment_paths:
+            path = graph.get_segment_path(segment_id, shapes)
+            segment_paths[key] = json.dumps(
+                path.topolyline() if polyline else path.tolist(),
+                separators=(",", ":"))
+
+    return '{{"version":{},"segments":{{{}}}}}'.format(
+        json.dumps(version),
+        ",".join('"{}":{}'.format(segment_id,
+                                  segment_paths[(segment_id, polyline)])
+                 for segment_id in segment_ids))
+
+
+@app.route('/segments')
+def segments_json():
+    # Paths of the segments between stations that the trains of the feed's
+    # frames refer to by ID, of the form:
+    # {
+    #      version: version of the segment IDs,
+    #      segments: {segment ID: [[lon, lat],...,] or encoded polyline}
+    # }
+    # ids is a comma-separated list of at most MAX_SEGMENT_IDS segment IDs
+    # (every segment if not given), and format either json or polyline (see
+    # ShapePath.topolyline). Responses asking for the current version (v)
+    # can be cached for good.
+    graph = static_data.graph
+    shapes = static_data.shapes
+    version = static_data.segments_version
+    polyline = request.args.get("format", "json") == "polyline"
+
+    if "ids" in request.args:
+        if request.args["ids"].count(",") >= MAX_SEGMENT_IDS:
+            abort(400)
+
+        try:
+            segment_ids = sorted(set(int(segment_id) for segment_id in
+                                     request.args["ids"].split(",")))
+        except ValueError:
+            abort(400)
+
+        # Clients ask for many different sets of segments, so responses of
+        # some of the segments are not compressed, as compressing them anew
+        # for every request would cost more than sending them as is
+        try:
+            encoded = EncodedResponse(
+                get_segments_body(graph, shapes, version, segment_ids,
+                                  polyline),
+                compress=False)
+        except KeyError:
+            abort(404)
+    else:
+        # The response of every segment is the same for every request, so
+        # it is only encoded once per format
+        if polyline not in all_segments_responses:
+            all_segments_responses[polyline] = EncodedResponse(
+                get_segments_body(graph, shapes, version,
+                                  xrange(len(graph)), polyline))
+
+        encoded = all_segments_responses[polyline]
+
+    response = encoded.make_response(request)
+    if request.args.get("v") == version:
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+
+    return response
+
+
+@app.route('/feed_stats')
+def feed_stats():
+    # Number of polls of each realtime feed so far, of the form:
+    # feed_id: {
+    #      processed: polls that fetched a new message,
+    #      skipped: polls that found the feed unchanged,
+    #      failed: polls that failed
+    # }
+    if feed_poller is None:
+        abort(404)
+
+    return jsonify(feed_poller.counts)
 
 
 @socketio.on('get_feed')
 def subway_cars():
-    global feed_event
-
-    if feed_event is None:
-        feed_event = socketio.start_background_task(target=subway_cars_timer)
+    broadcaster.subscribe(request.sid)
 
-    print "Emitted."
-    emit('feed', demos[0])
 
+def send_frame(feed_id, feed_message):
+    start = time.time()
+    frames = static_data.frames
+    previous = frames.frame
+    frame = frames.process_feed(feed_id, feed_message)
+    made = time.time()
 
-def subway_cars_timer():
-    counter = 1
-    while True:
-        socketio.sleep(30)
-        demo_emit = demos[counter % len(demos)]
-        print demo_emit
-        print "Emitted."
-        socketio.emit('feed', demo_emit)
-        counter += 1
+    # Subscribers are only sent what changed since the previous frame; new
+    # subscribers get the whole frame
+    subscribers = broadcaster.publish(frame.get_delta(previous),
+                                      frame.get_keyframe)
+    print "Made frame of {} trains in {:.3f}s, sent to {} clients in " \
+        "{:.3f}s.".format(len(frame), made - start, subscribers,
+                          time.time() - made)
 
 
 if __name__ == "__main__":
-    feed_thread = feed.start_timer()
+    feed_poller = feed.start_timer(on_feed=send_frame)
 
     try:
         socketio.run(app, debug=True)
     finally:
-        feed_thread.cancel()
+        feed_poller.stop()
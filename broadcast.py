@@ -0,0 +1,113 @@
+from socketio import packet
+
+
+class FrameBroadcaster:
+    """ FrameBroadcaster class.
+
+    Sends frames to every subscribed client of a Socket.IO server. Each
+    frame is encoded exactly once, into a Socket.IO event packet that is
+    handed as is to the Engine.IO connection of every subscriber, rather
+    than being serialized again for every client (as emit does, even when
+    broadcasting to a room).
+
+    Frames can be published as deltas, along with a snapshot of the whole
+    frame for clients subscribing afterwards. The snapshot is only encoded
+    once a client subscribes, and then kept until the next frame, so that
+    every other client subscribing gets it right away without any
+    recomputation.
+    """
+    def __init__(self, server, event, room, namespace="/"):
+        """ Constructor.
+
+        Arguments
+        ---------
+        server: socketio.Server
+            Socket.IO server of the subscribers
+        event: str
+            Name of the event the frames are sent as
+        room: str
+            Room of the subscribers
+        namespace: str
+            Namespace of the subscribers
+        """
+        self.server = server
+        self.event = event
+        self.room = room
+        self.namespace = namespace
+
+        # Function returning the snapshot of the latest frame, and its
+        # encoded packet, once encoded
+        self._snapshot = None
+        self._snapshot_packet = None
+
+    def encode(self, data):
+        """ Encodes data into a packet of the broadcaster's event.
+
+        Arguments
+        ---------
+        data: JSON-serializable object
+            Data of the event
+
+        Returns
+        -------
+        unicode
+            Encoded Socket.IO packet
+        """
+        # Frames have no binary data, so the packet is always sent as text
+        return packet.Packet(packet.EVENT, namespace=self.namespace,
+                             data=[self.event, data], binary=False).encode()
+
+    def publish(self, data, snapshot=None):
+        """ Sends data to every subscriber, and keeps a snapshot for new
+        ones.
+
+        Arguments
+        ---------
+        data: JSON-serializable object
+            Data of the event (such as a delta of a frame)
+        snapshot: function() -> JSON-serializable object
+            Function returning the data to send to new subscribers instead
+            (such as a keyframe of the frame), or None if it is the same
+
+        Returns
+        -------
+        int
+            Number of subscribers the data was sent to
+        """
+        encoded = self.encode(data)
+        if snapshot is None:
+            self._snapshot = lambda: data
+            self._snapshot_packet = encoded
+        else:
+            self._snapshot = snapshot
+            self._snapshot_packet = None
+
+        subscribers = 0
+        if self.room in self.server.manager.rooms.get(self.namespace, {}):
+            for sid in self.server.manager.get_participants(self.namespace,
+                                                            self.room):
+                self.server.eio.send(sid, encoded, binary=False)
+                subscribers += 1
+
+        return subscribers
+
+    def subscribe(self, sid):
+        """ Subscribes a client, and sends it the latest snapshot, if any.
+
+        Clients already subscribed are sent the latest snapshot again (for
+        instance, to recover from a missed delta).
+
+        Arguments
+        ---------
+        sid: str
+            Session ID of the client
+        """
+        self.server.enter_room(sid, self.room, namespace=self.namespace)
+
+        if self._snapshot is None:
+            return
+
+        if self._snapshot_packet is None:
+            self._snapshot_packet = self.encode(self._snapshot())
+
+        self.server.eio.send(sid, self._snapshot_packet, binary=False)
@@ -0,0 +1,1173 @@
+import multiprocessing
+import os
+
+from array import array
+
+import simplejson as json
+
+from geometry import GridIndex, ShapeStore, StopIndex, \
+    get_haversine_distance
+from packed import StaleCacheError
+from schedule import Interner, build_stage
+from tiles import MAX_TILE_ZOOM, MIN_TILE_ZOOM, ROUTE_ZOOM_LEVELS, TileStore, \
+    get_tile_position, get_zoom_decimals, simplify_line
+from transit import Edge, PrevStops, Segment, Stop, StopGraph
+
+JSON_DIR = "map_files/"
+CACHE_DIR = ".cache/"
+BUILD_MANIFEST = CACHE_DIR + "build_manifest.json"
+
+if not os.path.isdir(JSON_DIR):
+    os.makedirs(JSON_DIR)
+if not os.path.isdir(CACHE_DIR):
+    os.makedirs(CACHE_DIR)
+
+# shapes.txt does not always pass exactly through the stations of stops.txt
+# (York St. is in a hole of its shapes, about 180 m from their nearest point,
+# and South Ferry's stop was moved while its shapes were not), so when forming
+# the edges of the StopGraph, each station is snapped to the nearest point of
+# every shape passing within this many meters of it, rather than matched to
+# points at the exact same coordinates.
+SNAP_DISTANCE = 250
+
+# The script currently skips paths that go along the Second Avenue Subway Line,
+# as these are part of the new N/Q (and soon to be T) lines that open up in
+# January 2017. While this data is provided as part of stops/stop_times, the
+# shapes are not provided in shapes.txt, so we skip these paths until the
+# static information is eventually updated (hopefully the next iteration once
+# the lines begin operation).
+SECOND_AVE_PATHS = set(["N..N63R", "N..N67R", "N..S16R", "Q..N16R", "Q..N19R",
+                        "Q..S16R", "Q..S19R"])
+
+
+class StaticBuilder:
+    """ StaticBuilder class.
+
+    Base class of the builders of the static files. Rather than having each
+    file traverse the static feed on its own, build_static_files makes a
+    single pass over the feed and sends each record to every builder that
+    needs it: first every stop, then every shape, and then every trip, so
+    that builders can rely on the stops and shapes being complete by the
+    time trips are added.
+    """
+    # Static feed tables needed by the builder
+    tables = set()
+
+    # Paths of the files other than the static feed that the builder reads
+    inputs = set()
+
+    # Path of the file written by the builder
+    path = None
+
+    # Class reading the file written by the builder, if it is a packed file
+    reader = None
+
+    def __init__(self, feed, source=None):
+        """ Constructor.
+
+        Arguments
+        ---------
+        feed: StaticFeed
+            Static feed tables
+        source: dict[str -> str]
+            Map of static GTFS file -> hash of the file, for the files the
+            builder's file is built from (recorded in the file, if possible)
+        """
+        self.feed = feed
+        self.source = source
+
+    @classmethod
+    def is_current(cls, source):
+        """ Returns whether the builder's file exists and is usable as is.
+
+        Packed files must also be readable by the current version of their
+        reader, and have been built from the given static feed.
+
+        Arguments
+        ---------
+        source: dict[str -> str]
+            Map of static GTFS file -> hash of the file, for the files the
+            builder's file is built from
+
+        Returns
+        -------
+        bool
+            Whether the builder's file does not need to be rebuilt
+        """
+        if cls.reader is None:
+            return os.path.isfile(cls.path)
+
+        try:
+            cls.reader(cls.path, source)
+        except StaleCacheError:
+            return False
+
+        return True
+
+    def add_stop(self, stop_row):
+        """ Adds a stop to the file being built.
+
+        Arguments
+        ---------
+        stop_row: int
+            Row index of the stop in the StopTable
+        """
+        pass
+
+    def add_shape(self, shape_row):
+        """ Adds a shape to the file being built.
+
+        Arguments
+        ---------
+        shape_row: int
+            Row index of the shape in the ShapeTable
+        """
+        pass
+
+    def add_trip(self, trip_row):
+        """ Adds a trip (and its stop times) to the file being built.
+
+        Arguments
+        ---------
+        trip_row: int
+            Row index of the trip in the TripTable
+        """
+        pass
+
+    def merge(self, builder):
+        """ Merges the shapes added to a copy of this builder into this
+        builder.
+
+        When building with multiple processes, shapes are added in chunks to
+        copies of the builder in worker processes, which are then merged back
+        into the original builder; see build_static_files.
+
+        Arguments
+        ---------
+        builder: StaticBuilder
+            Copy of this builder that shapes were added to
+        """
+        raise NotImplementedError
+
+    def write(self):
+        """ Writes the built file. """
+        raise NotImplementedError
+
+    def __getstate__(self):
+        # The feed is shared with worker processes when they are started, so
+        # it is left out when builders are sent between processes.
+        state = self.__dict__.copy()
+        del state["feed"]
+        return state
+
+
+class ShapesBuilder(StaticBuilder):
+    """ ShapesBuilder class.
+
+    Writes shapes.bin.
+
+    This ShapeStore is used to retrieve sequences of points used to animate
+    the paths of the subway cars along the subway lines, and to serve the
+    points of the subway lines to the client code.
+    """
+    tables = set(["routes", "trips", "shapes"])
+    path = CACHE_DIR + "shapes.bin"
+    reader = ShapeStore
+
+    def __init__(self, feed, source=None):
+        """ Constructor.
+
+        Arguments
+        ---------
+        feed: StaticFeed
+            Static feed tables (routes, trips and shapes are needed)
+        source: dict[str -> str]
+            Map of static GTFS file -> hash of the file, for the files the
+            builder's file is built from
+        """
+        StaticBuilder.__init__(self, feed, source)
+        # Map of shape row -> tuple of (map of shape metadata, coordinates
+        # of the shape's points of the form [lon, lat, lon, lat, ...])
+        self._shapes = {}
+
+    def add_shape(self, shape_row):
+        shapes = self.feed.shapes
+        shape_id = shapes.shape_ids[shape_row]
+        point_rows = shapes.get_range(shape_row)
+
+        shape = {
+            "id": shape_id,
+            "route": self.feed.route_index.get_route(shape_id),
+            "color": self.feed.route_index.get_color(shape_id),
+            "sequence": shapes.sequences[point_rows[-1]]
+        }
+
+        # GTFS stores coordinates as (lat, lon) while Mapbox stores
+        # coordinates as (lon, lat), so we use the latter.
+        coords = array("d")
+        for i in point_rows:
+            coords.append(shapes.lons[i])
+            coords.append(shapes.lats[i])
+
+        self._shapes[shape_row] = (shape, coords)
+
+    def merge(self, builder):
+        self._shapes.update(builder._shapes)
+
+    def write(self):
+        shapes = []
+        offsets = array("i", [0])
+        coords = array("d")
+        distances = array("d")
+
+        for shape_row in sorted(self._shapes):
+            shape, shape_coords = self._shapes[shape_row]
+            shapes.append(shape)
+
+            # Distances are accumulated once here, so that the length of any
+            # part of a shape is the difference of two of them
+            distance = 0.0
+            for i in xrange(0, len(shape_coords), 2):
+                if i > 0:
+                    distance += get_haversine_distance(
+                        shape_coords[i - 2:i], shape_coords[i:i + 2])
+                distances.append(distance)
+
+            coords.extend(shape_coords)
+            offsets.append(len(coords) // 2)
+
+        ShapeStore.write(self.path, shapes, offsets, coords, distances,
+                         self.source)
+        print "shapes.bin written."
+
+
+class ColorsBuilder(StaticBuilder):
+    """ ColorsBuilder class.
+
+    Writes colors.json.
+
+    This JSON file is sent to the client code in order to color the subway
+    lines on the map.
+
+    Writes a JSON file of the following format:
+    {
+        route_id: route color
+    }
+    """
+    tables = set(["routes"])
+    path = JSON_DIR + "colors.json"
+
+    def write(self):
+        with open(self.path, "w") as colors_f:
+            colors_f.write(json.dumps(self.feed.route_index.route_colors))
+            print "colors.json written."
+
+
+class StopsBuilder(StaticBuilder):
+    """ StopsBuilder class.
+
+    Writes stops.json.
+
+    This JSON file is sent to the client code to render the stops on the map.
+
+    Writes a JSON file of the following format:
+    {
+        stop_id: {
+            coordinates: {
+                lat: latitude,
+                lon: longitude
+            },
+            name: name
+        }
+    }
+    """
+    tables = set(["stops"])
+    path = JSON_DIR + "stops.json"
+
+    def __init__(self, feed, source=None):
+        """ Constructor.
+
+        Arguments
+        ---------
+        feed: StaticFeed
+            Static feed tables (stops are needed)
+        source: dict[str -> str]
+            Map of static GTFS file -> hash of the file, for the files the
+            builder's file is built from
+        """
+        StaticBuilder.__init__(self, feed, source)
+        self._stops = {}
+
+    def add_stop(self, stop_row):
+        stops = self.feed.stops
+
+        # Only consider stops that are parent stations to avoid redundancy
+        if stops.location_types[stop_row] == 1:
+            stop = self._stops[stops.stop_ids[stop_row]] = {}
+
+            stop["coordinates"] = [stops.lats[stop_row],
+                                   stops.lons[stop_row]]
+            stop["name"] = stops.names[stop_row]
+
+    def write(self):
+        with open(self.path, "w") as stops_f:
+            stops_f.write(json.dumps(self._stops))
+            print "stops.json written."
+
+
+class StopIndexBuilder(StaticBuilder):
+    """ StopIndexBuilder class.
+
+    Writes stop_index.bin.
+
+    Writes the spatial index of the stations of a StopIndex, which the
+    server uses to find the stations near a point.
+    """
+    tables = set(["stops"])
+    path = CACHE_DIR + "stop_index.bin"
+    reader = StopIndex
+
+    def __init__(self, feed, source=None):
+        """ Constructor.
+
+        Arguments
+        ---------
+        feed: StaticFeed
+            Static feed tables (stops are needed)
+        source: dict[str -> str]
+            Map of static GTFS file -> hash of the file, for the files the
+            builder's file is built from
+        """
+        StaticBuilder.__init__(self, feed, source)
+        self._stations = []
+
+    def add_stop(self, stop_row):
+        # Only consider stops that are parent stations to avoid redundancy
+        if self.feed.stops.location_types[stop_row] == 1:
+            self._stations.append(stop_row)
+
+    def write(self):
+        stops = self.feed.stops
+        StopIndex.write(
+            self.path,
+            [stops.stop_ids[station] for station in self._stations],
+            [stops.names[station] for station in self._stations],
+            array("d", (stops.lons[station] for station in self._stations)),
+            array("d", (stops.lats[station] for station in self._stations)),
+            self.source)
+        print "stop_index.bin written."
+
+
+class RouteLevelsBuilder(StaticBuilder):
+    """ RouteLevelsBuilder class.
+
+    Writes routes_z<zoom>.json for each zoom level of ROUTE_ZOOM_LEVELS.
+
+    These JSON files are simplified versions of routes.json (the lines of
+    every route, as drawn on the map by the client code), which keeps every
+    point of every line at full precision. Each level is of the same format
+    as routes.json, with every line simplified for the zoom of the level
+    (see simplify_line), so that the client code only fetches the points
+    that can be told apart at the zoom it is showing.
+    """
+    inputs = set([JSON_DIR + "routes.json"])
+    path = JSON_DIR + "routes_z{}.json"
+
+    @classmethod
+    def is_current(cls, source):
+        return all(os.path.isfile(cls.path.format(zoom))
+                   for zoom in ROUTE_ZOOM_LEVELS)
+
+    @staticmethod
+    def _simplify_geometry(geometry, zoom):
+        """ Returns a GeoJSON geometry simplified for a zoom level.
+
+        Arguments
+        ---------
+        geometry: dict
+            GeoJSON LineString or MultiLineString geometry
+        zoom: int
+            Zoom level
+
+        Returns
+        -------
+        dict
+            Simplified geometry
+        """
+        if geometry["type"] == "LineString":
+            coordinates = simplify_line(geometry["coordinates"], zoom)
+        else:
+            coordinates = [simplify_line(line, zoom)
+                           for line in geometry["coordinates"]]
+
+        return dict(geometry, coordinates=coordinates)
+
+    def write(self):
+        with open(JSON_DIR + "routes.json", "r") as routes_f:
+            routes = json.load(routes_f)
+
+        simplify_geometry = RouteLevelsBuilder._simplify_geometry
+        for zoom in ROUTE_ZOOM_LEVELS:
+            level = dict(routes, features=[
+                dict(feature,
+                     geometry=simplify_geometry(feature["geometry"], zoom))
+                for feature in routes["features"]
+            ])
+
+            with open(self.path.format(zoom), "w") as level_f:
+                level_f.write(json.dumps(level, separators=(",", ":")))
+                print "{} written.".format(
+                    os.path.basename(self.path.format(zoom)))
+
+
+class TilesBuilder(StopsBuilder):
+    """ TilesBuilder class.
+
+    Writes tiles.mbtiles.
+
+    This TileStore holds the lines of routes.json and the stops of
+    stops.json cut into tiles for every zoom from MIN_TILE_ZOOM to
+    MAX_TILE_ZOOM, which are sent to the client code to draw the part of
+    the map it shows.
+
+    Each tile is a GeoJSON FeatureCollection of the following features:
+    - a MultiLineString of the parts of the lines of each route of
+      routes.json in the tile (with the properties of the route in
+      routes.json), simplified for the zoom of the tile (see
+      simplify_line); every segment of a line that crosses a tile is kept
+      whole in the tile
+    - a Point of each stop (parent station) in the tile, with properties
+      stop_id and name
+    """
+    tables = set(["stops"])
+    inputs = set([JSON_DIR + "routes.json"])
+    path = CACHE_DIR + "tiles.mbtiles"
+    reader = TileStore
+
+    @staticmethod
+    def _cut_lines(routes, zoom, features):
+        """ Adds the lines of the routes in each tile of a zoom.
+
+        Arguments
+        ---------
+        routes: dict
+            GeoJSON FeatureCollection of the LineStrings or MultiLineStrings
+            of every route
+        zoom: int
+            Zoom of the tiles
+        features: dict[tuple[int, int] -> list[dict]]
+            Map of (x, y) -> features of the tile to add to
+        """
+        # Tiles are shown up to the next zoom, except at the highest zoom,
+        # which is shown at any zoom beyond it
+        detail = zoom + 1 if zoom < MAX_TILE_ZOOM else ROUTE_ZOOM_LEVELS[-1]
+
+        for route in routes["features"]:
+            geometry = route["geometry"]
+            lines = [geometry["coordinates"]] \
+                if geometry["type"] == "LineString" \
+                else geometry["coordinates"]
+
+            # Map of (x, y) -> lines of the route in the tile
+            tile_lines = {}
+
+            for line in lines:
+                points = simplify_line(line, detail)
+                positions = [get_tile_position(lon, lat, zoom)
+                             for lon, lat in points]
+
+                # Map of (x, y) -> index of the last point of the part of
+                # the line in the tile so far
+                last_points = {}
+
+                # Each segment is added to every tile its bounding box
+                # touches, continuing the part of the line in the tile if
+                # it ends where the segment starts
+                for i in xrange(len(points) - 1):
+                    (x1, y1), (x2, y2) = positions[i], positions[i + 1]
+                    for x in xrange(int(min(x1, x2)), int(max(x1, x2)) + 1):
+                        for y in xrange(int(min(y1, y2)),
+                                        int(max(y1, y2)) + 1):
+                            parts = tile_lines.setdefault((x, y), [])
+                            if last_points.get((x, y)) == i:
+                                parts[-1].append(points[i + 1])
+                            else:
+                                parts.append(points[i:i + 2])
+                            last_points[(x, y)] = i + 1
+
+            for tile, parts in tile_lines.iteritems():
+                features.setdefault(tile, []).append({
+                    "type": "Feature",
+                    "properties": route["properties"],
+                    "geometry": {
+                        "type": "MultiLineString",
+                        "coordinates": parts
+                    }
+                })
+
+    def _cut_stops(self, zoom, features):
+        """ Adds the stops in each tile of a zoom.
+
+        Arguments
+        ---------
+        zoom: int
+            Zoom of the tiles
+        features: dict[tuple[int, int] -> list[dict]]
+            Map of (x, y) -> features of the tile to add to
+        """
+        decimals = get_zoom_decimals(ROUTE_ZOOM_LEVELS[-1])
+
+        for stop_id, stop in sorted(self._stops.iteritems()):
+            # Coordinates of stops.json are of the form [lat, lon]
+            lat, lon = stop["coordinates"]
+            x, y = get_tile_position(lon, lat, zoom)
+
+            features.setdefault((int(x), int(y)), []).append({
+                "type": "Feature",
+                "properties": {"stop_id": stop_id, "name": stop["name"]},
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [round(lon, decimals),
+                                    round(lat, decimals)]
+                }
+            })
+
+    def write(self):
+        with open(JSON_DIR + "routes.json", "r") as routes_f:
+            routes = json.load(routes_f)
+
+        tiles = {}
+        for zoom in xrange(MIN_TILE_ZOOM, MAX_TILE_ZOOM + 1):
+            # Map of (x, y) -> features of the tile
+            features = {}
+            TilesBuilder._cut_lines(routes, zoom, features)
+            self._cut_stops(zoom, features)
+
+            for (x, y), tile_features in features.iteritems():
+                tiles[(zoom, x, y)] = json.dumps({
+                    "type": "FeatureCollection",
+                    "features": tile_features
+                }, separators=(",", ":"))
+
+        TileStore.write(self.path, tiles, MIN_TILE_ZOOM, MAX_TILE_ZOOM,
+                        self.source)
+        print "tiles.mbtiles written ({} tiles).".format(len(tiles))
+
+
+class StopGraphBuilder(StaticBuilder):
+    """ StopGraphBuilder class.
+
+    Writes graph.bin.
+
+    Writes the edge table of a StopGraph. The StopGraph is used to retrieve
+    sequences of points used to animate the paths of the subway cars along the
+    subway lines.
+    """
+    tables = set(["stops", "routes", "trips", "stop_times", "shapes"])
+    path = CACHE_DIR + "graph.bin"
+    reader = StopGraph
+
+    def __init__(self, feed, source=None):
+        """ Constructor.
+
+        Arguments
+        ---------
+        feed: StaticFeed
+            Static feed tables (stops, routes, trips, stop_times and shapes
+            are needed)
+        source: dict[str -> str]
+            Map of static GTFS file -> hash of the file, for the files the
+            builder's file is built from
+        """
+        StaticBuilder.__init__(self, feed, source)
+
+        # Stations are referred to by their row in the StopTable, and shapes
+        # by their row in the ShapeTable, which are the same in every process
+        # (unlike the order in which stops and shapes are added), so that
+        # copies of the builder can be merged.
+
+        # Rows of the parent stations
+        self._stations = []
+
+        # GridIndex of the parent stations, whose rows are indices in
+        # self._stations, built when the first shape is added (once every
+        # stop is added)
+        self._station_index = None
+
+        # Map of station row -> map of shape row -> tuple of (distance,
+        # index) of the nearest point of the shape to the station, for the
+        # shapes passing within SNAP_DISTANCE of the station.
+        #
+        # This is used for forming the edges between stops, so that each edge
+        # can find the corresponding indices of two stops along a shape and
+        # store these indices as the boundary indices of the edge (then when
+        # sending the GPS coordinates to the client code, we can simply use an
+        # array slice on these indices from the shape's point sequence).
+        self._stop_shapes = {}
+
+        # Set of (route ID, tuple of stop rows) of the stop patterns whose
+        # edges were formed
+        self._patterns = set()
+
+        # Map of start station row * number of stops + end station row ->
+        # Edge(shape row, start index, end index)
+        self._edges = {}
+
+        # Set of start station row * number of stops + end station row of
+        # the adjacent stations with no shape passing near both of them
+        self._missing_edges = set()
+
+    def add_stop(self, stop_row):
+        # Only consider stops that are parent stations to avoid redundancy
+        if self.feed.stops.location_types[stop_row] == 1:
+            self._stations.append(stop_row)
+
+    def add_shape(self, shape_row):
+        stops = self.feed.stops
+        shapes = self.feed.shapes
+
+        if self._station_index is None:
+            self._station_index = GridIndex.from_points(
+                array("d", (stops.lons[station]
+                            for station in self._stations)),
+                array("d", (stops.lats[station]
+                            for station in self._stations)),
+                SNAP_DISTANCE)
+
+        # The stations near every point of the shape are found at once, and
+        # each station keeps the nearest point to it (the first one along
+        # the shape, for ties)
+        point_rows = shapes.get_range(shape_row)
+        matches = self._station_index.within_all(
+            [(shapes.lons[i], shapes.lats[i]) for i in point_rows],
+            SNAP_DISTANCE)
+
+        for index, stations in enumerate(matches):
+            for distance, row in stations:
+                station_shapes = self._stop_shapes.setdefault(
+                    self._stations[row], {})
+                if shape_row not in station_shapes or \
+                        distance < station_shapes[shape_row][0]:
+                    station_shapes[shape_row] = (distance, index)
+
+    def merge(self, builder):
+        # Each copy of the builder is given different shapes
+        for station, station_shapes in builder._stop_shapes.iteritems():
+            self._stop_shapes.setdefault(station, {}).update(station_shapes)
+
+    def __getstate__(self):
+        # The index of the stations is quickly rebuilt by each copy of the
+        # builder, rather than sent between processes
+        state = StaticBuilder.__getstate__(self)
+        state["_station_index"] = None
+        return state
+
+    def _get_stop_edge(self, start_station, end_station, route):
+        """ Return an edge of points between stations.
+
+        The Edge that is constructed contains the row of a shape that passes
+        near both the start and end station, as well as the indices of the
+        nearest points of that shape to those stations.
+
+        Arguments
+        ---------
+        start_station: int
+            Row index of the start station
+        end_station: int
+            Row index of the end station
+        route: str
+            Route ID of the trip the stations are adjacent on
+
+        Returns
+        -------
+        Edge
+            Edge between the two stations, or None if no shape passes near
+            both of them
+        """
+        shape_ids = self.feed.shapes.shape_ids
+        start_shapes = self._stop_shapes.get(start_station, {})
+        end_shapes = self._stop_shapes.get(end_station, {})
+
+        common_shapes = set(start_shapes).intersection(end_shapes)
+        if not common_shapes:
+            stop_ids = self.feed.stops.stop_ids
+            print "Warning: no shape passes within {}m of both {} and {} " \
+                "(route {}); skipping the edge between them.".format(
+                    SNAP_DISTANCE, stop_ids[start_station],
+                    stop_ids[end_station], route)
+            return None
+
+        # We assume that there is a unique path between any two adjacent
+        # stops on the entire map for each trip, or if there isn't, the
+        # paths are very similar in length/shape, which appears to be the
+        # case, so the choice of shape doesn't matter, as long as it passes
+        # near both stations. Still, shapes of the trip's own route are
+        # preferred, then the shapes passing nearest to the stations, and
+        # then the smallest shape ID, so that the choice does not depend on
+        # the order shapes were added in.
+        def get_shape_key(shape_row):
+            return (
+                self.feed.route_index.get_route(shape_ids[shape_row]) !=
+                route,
+                start_shapes[shape_row][0] + end_shapes[shape_row][0],
+                shape_ids[shape_row]
+            )
+
+        shape_row = min(common_shapes, key=get_shape_key)
+
+        return Edge(shape_row, start_shapes[shape_row][1],
+                    end_shapes[shape_row][1])
+
+    def add_trip(self, trip_row):
+        # Edges are mapped by the rows of their endpoints, packed into a
+        # single integer, with the following structure:
+        # {
+        #     start station row * number of stops + end station row: Edge(
+        #         shape_id: row of shape passing near start/end stations,
+        #         start_index: index of start station in shape,
+        #         end_index: index of end station in shape
+        #     )
+        # }
+        stop_times = self.feed.stop_times
+
+        # For an explanation of why trip paths along 2nd Avenue
+        # are currently skipped, see the top of the module.
+        trip_path = self.feed.trips.trip_ids[trip_row].rsplit("_", 1)[1]
+        if trip_path in SECOND_AVE_PATHS:
+            return
+
+        # The edges of a trip only depend on its route and the stops it
+        # makes, which most trips share with many others (every trip of a
+        # trip path usually makes the same stops), so edges are only formed
+        # for the first trip of each stop pattern
+        start = stop_times.offsets[trip_row]
+        end = stop_times.offsets[trip_row + 1]
+        pattern = (self.feed.trips.route_ids[trip_row],
+                   tuple(stop_times.stop_rows[start:end]))
+        if pattern not in self._patterns:
+            self._patterns.add(pattern)
+            self._add_pattern(*pattern)
+
+    def _add_pattern(self, route, stop_rows):
+        """ Adds the edges between the adjacent stations of a stop pattern.
+
+        Arguments
+        ---------
+        route: str
+            Route ID of the trips making the stops
+        stop_rows: tuple[int]
+            Row indices of the stops made, in order
+        """
+        num_stops = len(self.feed.stops)
+        parent_rows = self.feed.stops.parent_rows
+        edges = self._edges
+
+        stations = [parent_rows[stop_row] for stop_row in stop_rows]
+        for start_station, end_station in zip(stations, stations[1:]):
+            # If this edge (up to orientation) has not been seen before,
+            # add to map.
+            keys = (start_station * num_stops + end_station,
+                    end_station * num_stops + start_station)
+            if keys[0] not in edges and keys[1] not in edges and \
+                    keys[0] not in self._missing_edges and \
+                    keys[1] not in self._missing_edges:
+                edge = self._get_stop_edge(start_station, end_station, route)
+                if edge is not None:
+                    edges[keys[0]] = edge
+                else:
+                    self._missing_edges.add(keys[0])
+
+    def write(self):
+        stops = self.feed.stops
+        num_stops = len(stops)
+        shape_ids = self.feed.shapes.shape_ids
+
+        StopGraph.write(self.path, {
+            Segment(stops.stop_ids[key // num_stops],
+                    stops.stop_ids[key % num_stops]):
+            Edge(shape_ids[edge.shape_id], edge.start_index, edge.end_index)
+            for key, edge in self._edges.iteritems()
+        }, {
+            stops.stop_ids[i]: stops.stop_ids[parent_row]
+            for i, parent_row in enumerate(stops.parent_rows)
+            if parent_row != i
+        }, self.source)
+        print "graph.bin written."
+
+
+class PrevStopsBuilder(StaticBuilder):
+    """ PrevStopsBuilder class.
+
+    Writes prev_stops.bin.
+
+    Writes the lookup tables of a PrevStops object. The PrevStops object is
+    used to retrieve the previous stop that a subway car in the live feed is
+    coming from using the given information in the live feed.
+    """
+    tables = set(["stops", "trips", "stop_times"])
+    path = CACHE_DIR + "prev_stops.bin"
+    reader = PrevStops
+
+    def __init__(self, feed, source=None):
+        """ Constructor.
+
+        Arguments
+        ---------
+        feed: StaticFeed
+            Static feed tables (stops, trips and stop_times are needed)
+        source: dict[str -> str]
+            Map of static GTFS file -> hash of the file, for the files the
+            builder's file is built from
+        """
+        StaticBuilder.__init__(self, feed, source)
+
+        # Stops are referred to by their row in the StopTable, routes as
+        # interned by the TripTable (see TripTable.routes), and trip paths
+        # as interned by self._trip_paths. Each StopID is packed into a
+        # single key of route * number of stops + stop row.
+
+        # Map of StopID key -> Stop object for every possible StopID in the
+        # static transit data
+        self._all_prev_stops = {}
+
+        self._trip_paths = Interner()
+
+        # Map of trip path -> list of tuples of (trip row, service code,
+        # origin time) of every trip along the trip path. These are needed
+        # for the ambiguous cases, which are only known once every trip has
+        # been added.
+        self._trip_path_origins = {}
+
+    def add_trip(self, trip_row):
+        trips = self.feed.trips
+        stop_rows = self.feed.stop_times.stop_rows
+        stop_sequences = self.feed.stop_times.stop_sequences
+        service_code = trips.service_ids[trip_row][-3:]
+        route_key = trips.route_indices[trip_row] * len(self.feed.stops)
+        origin_time, trip_path = trips.trip_ids[trip_row].split("_")[1:]
+        trip_path = self._trip_paths.intern(trip_path)
+
+        # No need to duplicate work over trip paths already seen,
+        # since a trip path uniquely defines a sequence of stops
+        if trip_path not in self._trip_path_origins:
+            self._trip_path_origins[trip_path] = []
+
+            stop_time_rows = self.feed.stop_times.get_range(trip_row)
+            for i in stop_time_rows:
+                key = route_key + stop_rows[i]
+
+                if key not in self._all_prev_stops:
+                    self._all_prev_stops[key] = Stop()
+
+                # We ignore the case where the stop is at the beginning,
+                # since clearly there is no previous stop
+                if i > stop_time_rows[0]:
+                    self._all_prev_stops[key].add_prev_stop(
+                        stop_sequences[i], stop_rows[i - 1], trip_path)
+
+        self._trip_path_origins[trip_path].append(
+            (trip_row, service_code, int(origin_time)))
+
+    def _get_ambiguous_stop_sequences(self, ambiguous_trip_paths):
+        """ Returns map of StopID -> map of possible previous
+        stops for that particular StopID over all trips containing the
+        info of the StopID, keyed by service code and sorted by origin time
+        of the corresponding trip.
+
+        This map is only used when there is ambiguity, and the StopID and stop
+        sequence are not enough to determine the previous stop.
+
+        In these cases, an approximate solution is used. We store a list of the
+        possible previous stop possibilities for every trip (including distinct
+        origin times), and these lists are sorted by origin time. Then in order
+        to find the most likely previous stop given a particular StopID,
+        we simply find the corresponding previous stop (for a particular trip)
+        that has the origin time closest to the origin time of the live trip
+        and matching the same service code (i.e. weekday, Saturday, or Sunday).
+
+        Arguments
+        ---------
+        ambiguous_trip_paths: dict[int -> set[tuple[int, int]]]
+            Map of trip path -> set of pairs of StopID key + previous stop
+            possibilities such that the trip path contains the info of the
+            StopID and the previous stop is the preceding stop of the StopID
+            on the trip path
+
+        Returns
+        -------
+        dict[int -> dict[str -> dict[str -> tuple]]]
+            Map of StopID key -> map of service code (i.e. WKD, SAT, SUN) ->
+            map of "origin_times"/"prev_stops" -> sorted origin times/
+            corresponding previous stops
+        """
+        ambiguous_stop_sequences = {}
+
+        # Populate pairs of origin times + corresponding previous stops for
+        # each possible trip path for a given StopID + service code. The trip
+        # row is kept so that ties in origin time stay in trip order.
+        for trip_path, stop_pairs in ambiguous_trip_paths.iteritems():
+            for trip_row, service_code, origin_time in \
+                    self._trip_path_origins[trip_path]:
+                for stop_id, prev_stop in stop_pairs:
+                    if stop_id not in ambiguous_stop_sequences:
+                        ambiguous_stop_sequences[stop_id] = {}
+
+                    if service_code not in \
+                            ambiguous_stop_sequences[stop_id]:
+                        ambiguous_stop_sequences[stop_id][service_code] \
+                            = []
+
+                    ambiguous_stop_sequences[stop_id][service_code] \
+                        .append((origin_time, prev_stop, trip_row))
+
+        # Then sort the populated pairs and split the pairs into individual
+        # lists
+        for prev_stops_by_service_code in ambiguous_stop_sequences.values():
+            for prev_stops in prev_stops_by_service_code.values():
+                # Sort by origin time
+                prev_stops.sort(key=lambda x: (x[0], x[2]))
+
+            for service_code in prev_stops_by_service_code:
+                # Split sorted pairs into sorted lists of origin times and
+                # corresponding previous stop possibilities
+                prev_stops = prev_stops_by_service_code[service_code]
+                sorted_origin_times, sorted_prev_stops, _ = zip(*prev_stops)
+                prev_stops_by_service_code[service_code] = {
+                    "origin_times": sorted_origin_times,
+                    "prev_stops": sorted_prev_stops
+                }
+
+        return ambiguous_stop_sequences
+
+    def write(self):
+        ambiguous_trip_paths = \
+            PrevStops._get_ambiguous_trip_paths(self._all_prev_stops)
+        ambiguous_stop_sequences = \
+            self._get_ambiguous_stop_sequences(ambiguous_trip_paths)
+
+        PrevStops.write(self.path, self.feed.stops.stop_ids,
+                        self.feed.trips.routes.values, self._all_prev_stops,
+                        ambiguous_stop_sequences, self.source)
+        print "prev_stops.bin written."
+
+
+# Static feed shared with worker processes when building with multiple
+# processes; see build_static_files.
+_worker_feed = None
+
+
+def _init_worker(feed):
+    """ Initializes a worker process with the static feed.
+
+    Arguments
+    ---------
+    feed: StaticFeed
+        Static feed tables
+    """
+    global _worker_feed
+    _worker_feed = feed
+
+
+def _add_shapes(builders, shape_rows):
+    """ Adds a chunk of shapes to copies of builders in a worker process.
+
+    Arguments
+    ---------
+    builders: list[StaticBuilder]
+        Copies of the builders that need shapes
+    shape_rows: xrange
+        Range of row indices of the shapes to add
+
+    Returns
+    -------
+    list[StaticBuilder]
+        Builders that the shapes were added to
+    """
+    for builder in builders:
+        builder.feed = _worker_feed
+
+    for shape_row in shape_rows:
+        for builder in builders:
+            builder.add_shape(shape_row)
+
+    return builders
+
+
+def _add_trips_and_write(file, builder):
+    """ Adds the trips to a builder and writes its file in a worker process.
+
+    Arguments
+    ---------
+    file: str
+        Name of the file being built
+    builder: StaticBuilder
+        Builder of the file, with stops and shapes already added
+    """
+    builder.feed = _worker_feed
+
+    if "trips" in builder.tables:
+        with build_stage("Adding trips to {}".format(file)):
+            for trip_row in xrange(len(_worker_feed.trips)):
+                builder.add_trip(trip_row)
+
+    with build_stage("Writing {}".format(file)):
+        builder.write()
+
+
+def build_static_files(feed, builders, jobs=1):
+    """ Builds static files in a single pass over the static feed.
+
+    Every stop, shape and trip of the feed is visited exactly once, and sent
+    to each of the builders that needs it; see StaticBuilder. The wall time
+    and peak memory of each stage is reported.
+
+    With more than one job, the static feed is shared with a pool of worker
+    processes. Stops are still added in this process, as they are few, but
+    shapes are split by shape ID into chunks that are added in the workers
+    and merged back, and then each file has its trips added and is written
+    in a worker of its own.
+
+    Arguments
+    ---------
+    feed: StaticFeed
+        Static feed tables
+    builders: dict[str -> StaticBuilder]
+        Map of file name -> builder of that file
+    jobs: int
+        Number of worker processes to build with
+    """
+    STAGES = [
+        ("stops", "add_stop"),
+        ("shapes", "add_shape"),
+        ("trips", "add_trip")
+    ]
+
+    if jobs > 1:
+        _build_static_files_parallel(feed, builders, jobs)
+        return
+
+    for table, add_method in STAGES:
+        add_functions = [getattr(builder, add_method)
+                         for builder in builders.values()
+                         if table in builder.tables]
+        if not add_functions:
+            continue
+
+        with build_stage("Adding {}".format(table)):
+            for row in xrange(len(getattr(feed, table))):
+                for add_function in add_functions:
+                    add_function(row)
+
+    for file, builder in builders.iteritems():
+        print "Writing {}...".format(file)
+        with build_stage("Writing {}".format(file)):
+            builder.write()
+
+
+def _build_static_files_parallel(feed, builders, jobs):
+    """ Builds static files with a pool of worker processes; see
+    build_static_files.
+
+    Arguments
+    ---------
+    feed: StaticFeed
+        Static feed tables
+    builders: dict[str -> StaticBuilder]
+        Map of file name -> builder of that file
+    jobs: int
+        Number of worker processes to build with
+    """
+    # Number of chunks of shapes per worker, so that workers that are given
+    # chunks of shorter shapes are not left idle
+    SHAPE_CHUNKS_PER_JOB = 4
+
+    pool = multiprocessing.Pool(jobs, _init_worker, (feed,))
+    results = []
+
+    try:
+        if feed.stops is not None:
+            with build_stage("Adding stops"):
+                for stop_row in xrange(len(feed.stops)):
+                    for builder in builders.values():
+                        if "stops" in builder.tables:
+                            builder.add_stop(stop_row)
+
+        # Files that do not need shapes can be finished while the shapes are
+        # being added for the others
+        shape_files = [file for file, builder in builders.iteritems()
+                       if "shapes" in builder.tables]
+        for file, builder in builders.iteritems():
+            if file not in shape_files:
+                results.append(pool.apply_async(_add_trips_and_write,
+                                                (file, builder)))
+
+        if shape_files:
+            with build_stage("Adding shapes"):
+                num_shapes = len(feed.shapes)
+                chunk_size = \
+                    num_shapes // (jobs * SHAPE_CHUNKS_PER_JOB) + 1
+                chunks = [
+                    pool.apply_async(
+                        _add_shapes,
+                        ([builders[file] for file in shape_files],
+                         xrange(start, min(start + chunk_size, num_shapes)))
+                    )
+                    for start in xrange(0, num_shapes, chunk_size)
+                ]
+
+                # Builders are only merged once every chunk is done, as the
+                # builders may still be in the middle of being sent to the
+                # workers until then.
+                chunk_builders = [chunk.get() for chunk in chunks]
+                for chunk in chunk_builders:
+                    for file, chunk_builder in zip(shape_files, chunk):
+                        builders[file].merge(chunk_builder)
+
+            for file in shape_files:
+                results.append(pool.apply_async(_add_trips_and_write,
+                                                (file, builders[file])))
+
+        for result in results:
+            result.get()
+    finally:
+        # Every result has been retrieved at this point unless the build
+        # failed, in which case the remaining work is abandoned.
+        pool.terminate()
+        pool.join()
+
+
+def load_build_manifest():
+    """ Returns the build manifest.
+
+    The build manifest records, for each file built, the hashes of the
+    static GTFS files (and other inputs) it was built from, so that files
+    whose inputs have not changed since do not need to be rebuilt.
+
+    Returns
+    -------
+    dict[str -> dict[str -> str]]
+        Map of file name -> map of GTFS text file name -> hash of the GTFS
+        text file when the file was last built
+    """
+    if not os.path.isfile(BUILD_MANIFEST):
+        return {}
+
+    with open(BUILD_MANIFEST, "r") as manifest_f:
+        return json.load(manifest_f)
+
+
+def write_build_manifest(manifest):
+    """ Writes the build manifest; see load_build_manifest.
+
+    Arguments
+    ---------
+    manifest: dict[str -> dict[str -> str]]
+        Map of file name -> map of GTFS text file name -> hash of the GTFS
+        text file when the file was last built
+    """
+    # Write to a temporary file first, so that an interrupted write does not
+    # leave a corrupt manifest behind
+    with open(BUILD_MANIFEST + ".tmp", "w") as manifest_f:
+        json.dump(manifest, manifest_f, indent=2, sort_keys=True)
+
+    os.rename(BUILD_MANIFEST + ".tmp", BUILD_MANIFEST)
@@ -1,33 +1,364 @@
-from eventlet.greenthread import sleep, spawn
+import hashlib
+import random
+import time
+import traceback
+
+from eventlet import GreenPool, Timeout
+from eventlet.greenthread import sleep
+from google.protobuf.message import DecodeError
 import requests
+from requests.adapters import HTTPAdapter
 
 from API_KEYS import mta_key
 import gtfs_realtime_pb2 as gtfs
 
-MTA_ENDPOINT = "http://datamine.mta.info/mta_esi.php?key={}&feed_id=1" \
-    .format(mta_key)
+MTA_ENDPOINT = "http://datamine.mta.info/mta_esi.php"
+
+# IDs of the MTA's subway feeds (each covering a group of routes); see
+# http://datamine.mta.info/list-of-feeds
+FEED_IDS = [1, 2, 11, 16, 21, 26, 31, 36, 51]
+
+# Seconds between fetches of each feed (the MTA updates the feeds about every
+# 30 seconds), randomized by up to POLL_JITTER seconds either way, so that
+# the feeds are not all fetched at once
+POLL_INTERVAL = 30
+POLL_JITTER = 3
+
+# Seconds to wait to connect, and between bytes of the response, when
+# fetching a feed; and seconds to wait for a whole fetch, since a server
+# trickling bytes never triggers the read timeout
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+FETCH_TIMEOUT = 20
+
+# Tag of the header field of a serialized FeedMessage (field 1, length-
+# delimited), which the MTA's feeds start with
+HEADER_TAG = "\x0a"
+
+# Seconds to wait before retrying a failed fetch, doubled on every
+# consecutive failure of a feed, up to MAX_RETRY_DELAY
+RETRY_DELAY = 2
+MAX_RETRY_DELAY = 120
+
+current_feeds = {}
+
 
-current_feed = None
+def read_timestamp(content):
+    """ Reads the timestamp of a serialized feed message, without parsing
+    the rest of the message.
 
+    Arguments
+    ---------
+    content: str
+        Serialized GTFS realtime FeedMessage
 
-def start_timer():
-    return spawn(feed_timer)
+    Returns
+    -------
+    int
+        POSIX time of the message's header, or None if the message does not
+        start with a header with a timestamp
 
+    Raises
+    ------
+    google.protobuf.message.DecodeError
+        If the header could not be parsed
+    """
+    if content[:1] != HEADER_TAG:
+        return None
 
-def feed_timer():
+    # The tag is followed by the length of the header, as a varint
+    length = shift = 0
+    position = 1
     while True:
-        global current_feed
-        current_feed = spawn(get_feed).wait()
-        sleep(30)
-
-
-def get_feed():
-    print "Retrieving feed..."
-    raw_gtfs = requests.get(MTA_ENDPOINT)
-    new_feed = gtfs.FeedMessage()
-    new_feed.ParseFromString(raw_gtfs.content)
-    print "Retrieved feed."
-    return new_feed
+        if position >= len(content):
+            raise DecodeError("Truncated feed message header")
+
+        byte = ord(content[position])
+        position += 1
+        length |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            break
+
+    header = gtfs.FeedHeader()
+    header.ParseFromString(content[position:position + length])
+    return header.timestamp if header.HasField("timestamp") else None
+
+
+class FeedPoller:
+    """ FeedPoller class.
+
+    Polls every subway feed concurrently, each in its own green thread, so
+    that a slow or failing feed does not hold up the others. Fetches share a
+    single pool of keep-alive connections to the MTA.
+
+    The latest message of each feed is kept in current_feeds, and passed to
+    on_feed (if given) as soon as it is fetched, so that every feed is
+    processed without waiting on the others.
+
+    Feeds are fetched conditionally, and only parsed and processed when they
+    have changed since they were last processed: when the server does not
+    answer 304 Not Modified, the content is compared by digest and by the
+    timestamp of its header (which is read without parsing the rest of the
+    message). The number of polls of each feed processed, skipped as
+    unchanged, and failed are kept in counts.
+    """
+    def __init__(self, feed_ids=FEED_IDS, endpoint=MTA_ENDPOINT,
+                 on_feed=None):
+        """ Constructor.
+
+        Arguments
+        ---------
+        feed_ids: list[int]
+            IDs of the feeds to poll
+        endpoint: str
+            URL of the feeds, fetched with the key and ID of each feed as
+            parameters (e.g. a local stand-in server when testing; see
+            scripts/feed_standin.py)
+        on_feed: function(int, transit_realtime.FeedMessage)
+            Function called with the ID and message of each feed fetched
+        """
+        self.feed_ids = feed_ids
+        self.endpoint = endpoint
+        self.on_feed = on_feed
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=len(feed_ids))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._pool = GreenPool(len(feed_ids))
+        self._threads = []
+
+        # Map of feed ID -> (ETag, Last-Modified) headers of the response of
+        # the last message of the feed processed, if the server sent them
+        self._validators = {}
+
+        # Map of feed ID -> (digest of the content, header timestamp) of the
+        # last message of the feed processed
+        self._last_seen = {}
+
+        # Map of feed ID -> {processed, skipped, failed: number of polls}
+        self.counts = {
+            feed_id: {"processed": 0, "skipped": 0, "failed": 0}
+            for feed_id in feed_ids
+        }
+
+    def start(self):
+        """ Starts polling every feed. """
+        for feed_id in self.feed_ids:
+            self._threads.append(self._pool.spawn(self._poll, feed_id))
+
+    def stop(self):
+        """ Stops polling every feed. """
+        for thread in self._threads:
+            thread.kill()
+
+        self._threads = []
+        self.session.close()
+
+    def get_feed(self, feed_id):
+        """ Fetches and parses a feed.
+
+        Arguments
+        ---------
+        feed_id: int
+            ID of the feed
+
+        Returns
+        -------
+        transit_realtime.FeedMessage
+            GTFS realtime FeedMessage object (protobuf)
+
+        Raises
+        ------
+        requests.RequestException
+            If the feed could not be fetched in time
+        google.protobuf.message.DecodeError
+            If the feed could not be parsed
+        """
+        content = self._fetch(feed_id).content
+
+        new_feed = gtfs.FeedMessage()
+        new_feed.ParseFromString(content)
+        return new_feed
+
+    def get_feed_if_changed(self, feed_id):
+        """ Fetches and parses a feed, unless it has not changed since the
+        last message of the feed processed.
+
+        Arguments
+        ---------
+        feed_id: int
+            ID of the feed
+
+        Returns
+        -------
+        transit_realtime.FeedMessage
+            GTFS realtime FeedMessage object (protobuf), or None if the feed
+            has not changed
+
+        Raises
+        ------
+        requests.RequestException
+            If the feed could not be fetched in time
+        google.protobuf.message.DecodeError
+            If the feed could not be parsed
+        """
+        headers = {}
+        etag, last_modified = self._validators.get(feed_id, (None, None))
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+
+        response = self._fetch(feed_id, headers)
+        if response.status_code == 304:
+            return None
+
+        content = response.content
+        digest = hashlib.sha1(content).digest()
+        timestamp = read_timestamp(content)
+
+        last_digest, last_timestamp = self._last_seen.get(feed_id,
+                                                          (None, None))
+        if digest == last_digest or \
+                (timestamp is not None and timestamp == last_timestamp):
+            return None
+
+        new_feed = gtfs.FeedMessage()
+        new_feed.ParseFromString(content)
+
+        # Only remembered once the message is parsed, so that a corrupt
+        # message is fetched again rather than skipped as unchanged
+        self._validators[feed_id] = (response.headers.get("ETag"),
+                                     response.headers.get("Last-Modified"))
+        self._last_seen[feed_id] = (digest, timestamp)
+        return new_feed
+
+    def _fetch(self, feed_id, headers=None):
+        """ Fetches a feed.
+
+        Arguments
+        ---------
+        feed_id: int
+            ID of the feed
+        headers: dict[str -> str]
+            Extra headers of the request
+
+        Returns
+        -------
+        requests.Response
+            Response of the server (with its content read), successful or
+            304 Not Modified
+
+        Raises
+        ------
+        requests.RequestException
+            If the feed could not be fetched in time
+        """
+        with Timeout(FETCH_TIMEOUT, requests.Timeout(
+                "Feed {} took over {}s".format(feed_id, FETCH_TIMEOUT))):
+            response = self.session.get(
+                self.endpoint, params={"key": mta_key, "feed_id": feed_id},
+                headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+            )
+            response.raise_for_status()
+
+            # The content is read lazily, so read it within the timeout
+            response.content
+
+        return response
+
+    def _poll(self, feed_id):
+        """ Polls a feed until stopped.
+
+        Arguments
+        ---------
+        feed_id: int
+            ID of the feed
+        """
+        failures = 0
+
+        # Spread out the first fetches of the feeds, as well as the later ones
+        sleep(random.uniform(0, POLL_JITTER))
+
+        while True:
+            start = time.time()
+
+            try:
+                new_feed = self.get_feed_if_changed(feed_id)
+                self._process(feed_id, new_feed, time.time() - start)
+            except (requests.RequestException, DecodeError) as e:
+                error = e
+            except (Exception, Timeout) as e:
+                # Any other error (such as a bug processing the feed, or a
+                # stray Timeout) is retried the same way, rather than ending
+                # the polling of the feed for good
+                traceback.print_exc()
+                error = e
+            else:
+                error = None
+
+            if error is None:
+                failures = 0
+                delay = POLL_INTERVAL
+            else:
+                self.counts[feed_id]["failed"] += 1
+                failures += 1
+                delay = min(RETRY_DELAY * 2 ** (failures - 1),
+                            MAX_RETRY_DELAY)
+                print "Failed to poll feed {} ({}); retrying in {:.0f}s." \
+                    .format(feed_id, error, delay)
+
+            sleep(max(0, delay + random.uniform(-POLL_JITTER, POLL_JITTER)))
+
+    def _process(self, feed_id, new_feed, fetch_time):
+        """ Processes the result of a poll of a feed.
+
+        Arguments
+        ---------
+        feed_id: int
+            ID of the feed
+        new_feed: transit_realtime.FeedMessage
+            Message of the feed, or None if the feed has not changed
+        fetch_time: float
+            Seconds taken to fetch the feed
+        """
+        if new_feed is None:
+            self.counts[feed_id]["skipped"] += 1
+            print "Feed {} unchanged.".format(feed_id)
+            return
+
+        self.counts[feed_id]["processed"] += 1
+        print "Retrieved feed {} in {:.2f}s.".format(feed_id, fetch_time)
+
+        current_feeds[feed_id] = new_feed
+        if self.on_feed is not None:
+            # An error processing one message should not stop the feed from
+            # being polled
+            try:
+                self.on_feed(feed_id, new_feed)
+            except Exception:
+                traceback.print_exc()
+
+
+def start_timer(on_feed=None):
+    """ Starts polling every subway feed; see FeedPoller.
+
+    Arguments
+    ---------
+    on_feed: function(int, transit_realtime.FeedMessage)
+        Function called with the ID and message of each feed fetched
+
+    Returns
+    -------
+    FeedPoller
+        Poller of the feeds, to stop when done
+    """
+    poller = FeedPoller(on_feed=on_feed)
+    poller.start()
+    return poller
 
 # testing API usage
 # for entity in feed.entity:
@@ -0,0 +1,932 @@
+import math
+
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from packed import PackedFile, write_packed
+
+# Number of decimals of the coordinates of encoded polylines (see
+# encode_polyline)
+POLYLINE_PRECISION = 6
+
+# Mean radius of the Earth in meters, for haversine distances
+EARTH_RADIUS = 6371008.8
+
+# Length in meters of a degree of latitude (or of longitude, at the equator)
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+
+class Coordinates(namedtuple('Coordinates', ['lon', 'lat'])):
+    def __str__(self):
+        return "({}, {})".format(self.lon, self.lat)
+
+    def array(self):
+        return [self.lon, self.lat]
+
+
+def get_haversine_distance(start, end):
+    """ Returns the great-circle distance between two points.
+
+    Arguments
+    ---------
+    start: tuple[float, float]
+        First point, in the form (lon, lat)
+    end: tuple[float, float]
+        Second point, in the form (lon, lat)
+
+    Returns
+    -------
+    float
+        Distance in meters
+    """
+    start_lat = math.radians(start[1])
+    end_lat = math.radians(end[1])
+    a = math.sin((end_lat - start_lat) / 2) ** 2 + \
+        math.cos(start_lat) * math.cos(end_lat) * \
+        math.sin(math.radians(end[0] - start[0]) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def encode_polyline(points, precision=POLYLINE_PRECISION):
+    """ Encodes points as a polyline, for compact serialization.
+
+    Polylines are encoded as with Google's Encoded Polyline Algorithm
+    Format, with points in the order lat, lon, but with coordinates rounded
+    to the given number of decimals rather than always 5.
+
+    Arguments
+    ---------
+    points: iterable[tuple[float, float]]
+        Points, in the form (lon, lat)
+    precision: int
+        Number of decimals of the coordinates
+
+    Returns
+    -------
+    str
+        Encoded polyline
+    """
+    factor = 10 ** precision
+    chunks = []
+    last_lat = last_lon = 0
+
+    for lon, lat in points:
+        lat = int(round(lat * factor))
+        lon = int(round(lon * factor))
+
+        # Each coordinate is the difference from the last one, as a zigzag
+        # varint of 5-bit chunks offset into printable characters
+        for value in [lat - last_lat, lon - last_lon]:
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+
+        last_lat, last_lon = lat, lon
+
+    return "".join(chunks)
+
+
+class ShapePath:
+    """ ShapePath class.
+
+    Read-only view of a sequence of points of a shape in a ShapeStore.
+    Slicing a ShapePath (including with negative steps) returns another view
+    without copying any coordinates; the points are only copied into lists
+    by tolist, when they need to be serialized.
+
+    Distances along the view are read from the cumulative distances of the
+    ShapeStore (computed once, when the store is built), so finding the
+    length of a view, or the points at given distances along it (see
+    interpolate), never walks the whole view.
+    """
+    def __init__(self, coords, distances, start, step, length):
+        """ Constructor.
+
+        Arguments
+        ---------
+        coords: array[float]
+            Coordinate buffer of the ShapeStore, of the form
+            [lon, lat, lon, lat, ...]
+        distances: array[float]
+            Distance buffer of the ShapeStore, of the distance in meters
+            along its shape of each point of the coordinate buffer
+        start: int
+            Index of the first point of the view in the coordinate buffer
+        step: int
+            Step between consecutive points of the view in the buffer
+        length: int
+            Number of points in the view
+        """
+        self._coords = coords
+        self._distances = distances
+        self._start = start
+        self._step = step
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            return ShapePath(self._coords, self._distances,
+                             self._start + start * self._step,
+                             self._step * step,
+                             len(xrange(start, stop, step)))
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("ShapePath index out of range")
+
+        point = self._start + index * self._step
+        return Coordinates(self._coords[2 * point],
+                           self._coords[2 * point + 1])
+
+    def __iter__(self):
+        for index in xrange(self._length):
+            yield self[index]
+
+    def get_distance(self, index):
+        """ Returns the distance along the view up to one of its points.
+
+        Arguments
+        ---------
+        index: int
+            Index of the point in the view
+
+        Returns
+        -------
+        float
+            Distance in meters along the view from its first point
+        """
+        return abs(self._distances[self._start + index * self._step] -
+                   self._distances[self._start])
+
+    def get_length(self):
+        """ Returns the length of the view.
+
+        Returns
+        -------
+        float
+            Distance in meters along the view from its first point to its
+            last
+        """
+        return self.get_distance(self._length - 1) if self._length else 0.0
+
+    def interpolate(self, distances):
+        """ Returns the points at distances along the view.
+
+        The first distance is found by bisection, and each of the next by
+        walking on from the last, so that finding k distances costs
+        O(log n + k) plus the points walked past, rather than a walk of the
+        view for each.
+
+        Arguments
+        ---------
+        distances: list[float]
+            Distances in meters along the view from its first point, in
+            increasing order (distances beyond either end of the view are
+            taken as that end)
+
+        Returns
+        -------
+        list[Coordinates]
+            Point at each distance, interpolated linearly between the points
+            of the view around it
+        """
+        points = []
+        if self._length == 0:
+            return points
+
+        # Index of the last point of the view at or before the distance
+        index = None
+        last = self._length - 1
+
+        for distance in distances:
+            if index is None:
+                low, high = 0, last
+                while low < high:
+                    middle = (low + high + 1) // 2
+                    if self.get_distance(middle) <= distance:
+                        low = middle
+                    else:
+                        high = middle - 1
+                index = low
+            else:
+                while index < last and \
+                        self.get_distance(index + 1) <= distance:
+                    index += 1
+
+            if index == last:
+                points.append(self[last])
+                continue
+
+            start = self.get_distance(index)
+            end = self.get_distance(index + 1)
+            fraction = min(1.0, max(0.0, (distance - start) / (end - start))) \
+                if end > start else 0.0
+            before, after = self[index], self[index + 1]
+
+            points.append(Coordinates(
+                before.lon + fraction * (after.lon - before.lon),
+                before.lat + fraction * (after.lat - before.lat)
+            ))
+
+        return points
+
+    def tolist(self):
+        """ Returns the points of the view as a list, for serialization.
+
+        Returns
+        -------
+        list[[float, float]]
+            List of coordinates in the form [lon, lat]
+        """
+        if self._length == 0:
+            return []
+
+        # Points next to each other in the buffer are decoded all at once
+        if abs(self._step) == 1:
+            first = min(self._start,
+                        self._start + (self._length - 1) * self._step)
+            coords = self._coords[2 * first:2 * (first + self._length)]
+            points = [[coords[i], coords[i + 1]]
+                      for i in xrange(0, len(coords), 2)]
+            return points if self._step == 1 else points[::-1]
+
+        return [list(point) for point in self]
+
+    def topolyline(self, precision=POLYLINE_PRECISION):
+        """ Returns the points of the view as an encoded polyline, for
+        compact serialization (see encode_polyline).
+
+        Arguments
+        ---------
+        precision: int
+            Number of decimals of the coordinates
+
+        Returns
+        -------
+        str
+            Encoded polyline
+        """
+        return encode_polyline(self.tolist(), precision)
+
+
+class PathChain:
+    """ PathChain class.
+
+    Read-only view of a chain of ShapePaths (such as the paths of the
+    segments between stations that are not adjacent), read as a single
+    path. Where a path ends at the same point the next one starts, the
+    point is only kept once.
+
+    Distances along the chain are the sums of the distances along its paths
+    (paths of different shapes meet near a station rather than at the same
+    point, and the gap between them is not counted).
+    """
+    def __init__(self, paths):
+        """ Constructor.
+
+        Arguments
+        ---------
+        paths: list[ShapePath]
+            Paths of the chain, in order
+        """
+        self._paths = paths
+
+        # Distance along the chain of the start of each path, and of the
+        # end of the last path
+        self._starts = [0.0]
+        for path in paths:
+            self._starts.append(self._starts[-1] + path.get_length())
+
+    def __len__(self):
+        return sum(1 for point in self)
+
+    def __iter__(self):
+        last = None
+        for path in self._paths:
+            for index, point in enumerate(path):
+                if index > 0 or point != last:
+                    yield point
+
+            if len(path):
+                last = path[-1]
+
+    def get_length(self):
+        """ Returns the length of the chain.
+
+        Returns
+        -------
+        float
+            Sum of the lengths of the paths of the chain, in meters
+        """
+        return self._starts[-1]
+
+    def interpolate(self, distances):
+        """ Returns the points at distances along the chain.
+
+        Distances are handed to the path they fall in all at once, so that
+        each path finds them as ShapePath.interpolate does.
+
+        Arguments
+        ---------
+        distances: list[float]
+            Distances in meters along the chain from its first point, in
+            increasing order (distances beyond either end of the chain are
+            taken as that end)
+
+        Returns
+        -------
+        list[Coordinates]
+            Point at each distance
+        """
+        points = []
+        part = 0
+        part_distances = []
+        last = len(self._paths) - 1
+
+        for distance in distances:
+            while part < last and distance > self._starts[part + 1]:
+                points.extend(self._paths[part].interpolate(part_distances))
+                part_distances = []
+                part += 1
+
+            part_distances.append(distance - self._starts[part])
+
+        points.extend(self._paths[part].interpolate(part_distances))
+        return points
+
+    def tolist(self):
+        """ Returns the points of the chain as a list, for serialization.
+
+        Returns
+        -------
+        list[[float, float]]
+            List of coordinates in the form [lon, lat]
+        """
+        return [list(point) for point in self]
+
+    def topolyline(self, precision=POLYLINE_PRECISION):
+        """ Returns the points of the chain as an encoded polyline, for
+        compact serialization (see encode_polyline).
+
+        Arguments
+        ---------
+        precision: int
+            Number of decimals of the coordinates
+
+        Returns
+        -------
+        str
+            Encoded polyline
+        """
+        return encode_polyline(self.tolist(), precision)
+
+
+class ShapeStore:
+    """ ShapeStore class.
+
+    Compact store of the points of every shape: a single contiguous buffer
+    of coordinates, and a table of the offsets of each shape's points in
+    that buffer, along with the route, color and sequence number of each
+    shape.
+
+    The store is kept in a packed file (shapes.bin, built by a
+    ShapesBuilder; see ShapeStore.write for its layout), which is
+    memory-mapped when the object is created, so that every process serving
+    the shapes shares the same copy.
+    """
+    # Version of the format of the packed file; increment it whenever the
+    # meaning of the packed file's contents changes, so that files written by
+    # older versions are rejected instead of being misread
+    VERSION = 2
+
+    # Map of name -> typecode of the sections of the packed file
+    SCHEMA = {"offsets": "i", "coords": "d", "distances": "d"}
+
+    def __init__(self, path, source=None):
+        """ Constructor.
+
+        Arguments
+        ---------
+        path: str
+            Path of the packed file of the store
+        source: dict[str -> str]
+            Expected map of static GTFS file -> hash of the file the packed
+            file was built from (as recorded in the build manifest), or None
+            to accept any source
+
+        Raises
+        ------
+        StaleCacheError
+            If the packed file is missing, was written by another version of
+            its format, or was built from a different static feed
+        """
+        self._packed = PackedFile(path, self.VERSION, self.SCHEMA, source)
+        self._index = None
+
+    @staticmethod
+    def write(path, shapes, offsets, coords, distances, source=None):
+        """ Writes a store to a packed file.
+
+        The packed file has the following metadata and sections:
+
+        metadata: {
+            shapes: [{id: shape ID, route: route ID, color: route color,
+                      sequence: sequence number of last point}, ...]
+        }
+        offsets: offsets of each shape's points, such that the points of
+            shape i are points offsets[i] up to offsets[i + 1]
+        coords: coordinates of the points of every shape, of the form
+            [lon, lat, lon, lat, ...]
+        distances: distance in meters along its shape of each point of
+            coords, from the first point of the shape (cumulative haversine
+            distances between consecutive points)
+
+        Arguments
+        ---------
+        path: str
+            Path of the packed file to write
+        shapes: list[dict[str -> str]]
+            List of maps of "id"/"route"/"color"/"sequence" -> shape ID/route
+            ID/route color/sequence number of last point of each shape
+        offsets: array[int]
+            Offsets of each shape's points in coords
+        coords: array[float]
+            Coordinates of the points of every shape
+        distances: array[float]
+            Distance along its shape of the point of every shape
+        source: dict[str -> str]
+            Map of static GTFS file -> hash of the file, for the files the
+            store was built from
+        """
+        write_packed(path, ShapeStore.VERSION, {"shapes": shapes},
+                     {"offsets": offsets, "coords": coords,
+                      "distances": distances}, source)
+
+    @property
+    def digest(self):
+        """ Hex SHA-1 digest of the packed file of the store, which changes
+        whenever the store is rebuilt with different contents (see
+        PackedFile.digest). """
+        return self._packed.digest
+
+    def _get_index(self):
+        """ Returns map of shape ID -> index of the shape in the store. """
+        if self._index is None:
+            self._index = {
+                shape["id"]: i
+                for i, shape in enumerate(self._packed.metadata["shapes"])
+            }
+
+        return self._index
+
+    @property
+    def shape_ids(self):
+        """ List of the IDs of every shape in the store. """
+        return [shape["id"] for shape in self._packed.metadata["shapes"]]
+
+    def __contains__(self, shape_id):
+        return shape_id in self._get_index()
+
+    def get_points(self, shape_id):
+        """ Returns the points of a shape.
+
+        Arguments
+        ---------
+        shape_id: str
+            Shape ID
+
+        Returns
+        -------
+        ShapePath
+            View of the points of the shape
+        """
+        i = self._get_index()[shape_id]
+        offsets = self._packed.section("offsets")
+        return ShapePath(self._packed.section("coords"),
+                         self._packed.section("distances"), offsets[i], 1,
+                         offsets[i + 1] - offsets[i])
+
+    def get_length(self, shape_id):
+        """ Returns the length of a shape.
+
+        Arguments
+        ---------
+        shape_id: str
+            Shape ID
+
+        Returns
+        -------
+        float
+            Length of the shape in meters
+        """
+        return self.get_points(shape_id).get_length()
+
+    def get_shape(self, shape_id):
+        """ Returns the JSON-serializable form of a shape.
+
+        Arguments
+        ---------
+        shape_id: str
+            Shape ID
+
+        Returns
+        -------
+        dict
+            Map of the form {
+                route: route ID,
+                color: route color,
+                sequence: sequence number of last point,
+                length: length of the shape in meters,
+                points: [[lon, lat], ...]
+            }
+        """
+        shape = self._packed.metadata["shapes"][self._get_index()[shape_id]]
+        return {
+            "route": shape["route"],
+            "color": shape["color"],
+            "sequence": shape["sequence"],
+            "length": self.get_length(shape_id),
+            "points": self.get_points(shape_id).tolist()
+        }
+
+
+class GridIndex:
+    """ GridIndex class.
+
+    Spatial index of points (such as stations, or the points of every
+    shape), answering nearest point and within radius queries.
+
+    Points are bucketed into the cells of a grid of about cell_size meters
+    square, and the points of each cell are stored contiguously, so that a
+    query only measures the distance to the points of the few cells around
+    it. The index is kept in flat arrays (see GridIndex.build), so that it
+    can be stored in a packed file and used from there as is.
+    """
+    def __init__(self, grid, cells, offsets, rows, lons, lats):
+        """ Constructor.
+
+        Arguments
+        ---------
+        grid: dict[str -> float]
+            Layout of the grid (see GridIndex.build)
+        cells: array[int]
+            Keys of the cells that have points, sorted
+        offsets: array[int]
+            Offsets of each cell's points, such that the points of cell i are
+            points offsets[i] up to offsets[i + 1]
+        rows: array[int]
+            Row of each point in the points the index was built from
+        lons: array[float]
+            Longitude of each point
+        lats: array[float]
+            Latitude of each point
+        """
+        self.grid = grid
+        self._cells = cells
+        self._offsets = offsets
+        self._rows = rows
+        self._lons = lons
+        self._lats = lats
+
+    @staticmethod
+    def build(lons, lats, cell_size):
+        """ Builds the arrays of an index of points.
+
+        Cells are cell_size meters tall, and as wide in degrees of longitude
+        as cell_size meters are at the mean latitude of the points. Cell
+        (x, y) spans longitudes x * cell_lon up to (x + 1) * cell_lon and
+        latitudes y * cell_lat up to (y + 1) * cell_lat, and its key is
+        (y - min_y) * width + x - min_x, where min_x, min_y, width and
+        height bound the cells that have points.
+
+        Arguments
+        ---------
+        lons: array[float]
+            Longitude of each point
+        lats: array[float]
+            Latitude of each point
+        cell_size: float
+            Size of the cells in meters
+
+        Returns
+        -------
+        tuple[dict[str -> float], dict[str -> array]]
+            Layout of the grid, of the form {cell_lon: width of a cell in
+            degrees of longitude, cell_lat: height of a cell in degrees of
+            latitude, min_x, min_y, width, height}, and map of name ->
+            array of the index (cells, offsets, rows, lons and lats, the
+            arguments of the constructor)
+        """
+        mean_lat = sum(lats) / len(lats) if lats else 0.0
+        cell_lat = float(cell_size) / METERS_PER_DEGREE
+        cell_lon = cell_lat / math.cos(math.radians(mean_lat))
+
+        xs = [int(math.floor(lon / cell_lon)) for lon in lons]
+        ys = [int(math.floor(lat / cell_lat)) for lat in lats]
+        min_x, min_y = min(xs or [0]), min(ys or [0])
+        width = max(xs) - min_x + 1 if xs else 0
+        height = max(ys) - min_y + 1 if ys else 0
+
+        keys = [(y - min_y) * width + x - min_x for x, y in zip(xs, ys)]
+        order = sorted(xrange(len(keys)), key=keys.__getitem__)
+
+        sections = {
+            "cells": array("i"),
+            "offsets": array("i"),
+            "rows": array("i", order),
+            "lons": array("d", (lons[i] for i in order)),
+            "lats": array("d", (lats[i] for i in order))
+        }
+        for i, row in enumerate(order):
+            if not sections["cells"] or sections["cells"][-1] != keys[row]:
+                sections["cells"].append(keys[row])
+                sections["offsets"].append(i)
+        sections["offsets"].append(len(order))
+
+        return {"cell_lon": cell_lon, "cell_lat": cell_lat, "min_x": min_x,
+                "min_y": min_y, "width": width, "height": height}, sections
+
+    @classmethod
+    def from_points(cls, lons, lats, cell_size):
+        """ Returns an index of points.
+
+        Arguments
+        ---------
+        lons: array[float]
+            Longitude of each point
+        lats: array[float]
+            Latitude of each point
+        cell_size: float
+            Size of the cells in meters
+
+        Returns
+        -------
+        GridIndex
+            Index of the points
+        """
+        grid, sections = cls.build(lons, lats, cell_size)
+        return cls(grid, **sections)
+
+    def within(self, lon, lat, radius):
+        """ Returns the points within a distance of a point.
+
+        Arguments
+        ---------
+        lon: float
+            Longitude of the point
+        lat: float
+            Latitude of the point
+        radius: float
+            Distance in meters
+
+        Returns
+        -------
+        list[tuple[float, int]]
+            List of (distance in meters, row) of the points within the
+            distance, nearest first
+        """
+        grid = self.grid
+        cells = self._cells
+        offsets = self._offsets
+        lons = self._lons
+        lats = self._lats
+
+        # Cells around the point, bounded by the latitude of the bounds
+        # furthest from the equator, where degrees of longitude are shortest
+        delta_lat = radius / METERS_PER_DEGREE
+        max_lat = min(abs(lat) + delta_lat, 89.0)
+        delta_lon = delta_lat / math.cos(math.radians(max_lat))
+
+        min_x = max(int(math.floor((lon - delta_lon) / grid["cell_lon"])) -
+                    grid["min_x"], 0)
+        max_x = min(int(math.floor((lon + delta_lon) / grid["cell_lon"])) -
+                    grid["min_x"], grid["width"] - 1)
+        min_y = max(int(math.floor((lat - delta_lat) / grid["cell_lat"])) -
+                    grid["min_y"], 0)
+        max_y = min(int(math.floor((lat + delta_lat) / grid["cell_lat"])) -
+                    grid["min_y"], grid["height"] - 1)
+
+        points = []
+        for y in xrange(min_y, max_y + 1):
+            # The cells of a row of the grid are contiguous in cells
+            end_key = y * grid["width"] + max_x
+            i = bisect_left(cells, y * grid["width"] + min_x)
+            while i < len(cells) and cells[i] <= end_key:
+                for j in xrange(offsets[i], offsets[i + 1]):
+                    distance = get_haversine_distance((lon, lat),
+                                                      (lons[j], lats[j]))
+                    if distance <= radius:
+                        points.append((distance, self._rows[j]))
+                i += 1
+
+        points.sort()
+        return points
+
+    def nearest(self, lon, lat, max_distance):
+        """ Returns the nearest point to a point.
+
+        Arguments
+        ---------
+        lon: float
+            Longitude of the point
+        lat: float
+            Latitude of the point
+        max_distance: float
+            Distance in meters beyond which points are not considered
+
+        Returns
+        -------
+        tuple[float, int]
+            Tuple of (distance in meters, row) of the nearest point, or None
+            if there is no point within max_distance
+        """
+        # Points within a distance of the point include the nearest point
+        # whenever there are any, so the distance is doubled from the size
+        # of a cell until there are
+        radius = self.grid["cell_lat"] * METERS_PER_DEGREE
+        while True:
+            points = self.within(lon, lat, min(radius, max_distance))
+            if points:
+                return points[0]
+            if radius >= max_distance:
+                return None
+
+            radius *= 2
+
+    def within_all(self, points, radius):
+        """ Returns the points within a distance of each of several points.
+
+        Arguments
+        ---------
+        points: list[tuple[float, float]]
+            Points, in the form (lon, lat)
+        radius: float
+            Distance in meters
+
+        Returns
+        -------
+        list[list[tuple[float, int]]]
+            Points within the distance of each point; see within
+        """
+        return [self.within(lon, lat, radius) for lon, lat in points]
+
+    def nearest_all(self, points, max_distance):
+        """ Returns the nearest point to each of several points.
+
+        Arguments
+        ---------
+        points: list[tuple[float, float]]
+            Points, in the form (lon, lat)
+        max_distance: float
+            Distance in meters beyond which points are not considered
+
+        Returns
+        -------
+        list[tuple[float, int]]
+            Nearest point to each point; see nearest
+        """
+        return [self.nearest(lon, lat, max_distance) for lon, lat in points]
+
+    def __len__(self):
+        return len(self._rows)
+
+
+class StopIndex:
+    """ StopIndex class.
+
+    Spatial index of the stations (parent stations of stops.txt), to find
+    the stations near a point, such as the position of a user.
+
+    The index is kept in a packed file (stop_index.bin, built by a
+    StopIndexBuilder; see StopIndex.write for its layout), which is
+    memory-mapped when the object is created, and queried in place (see
+    GridIndex).
+    """
+    # Version of the format of the packed file; increment it whenever the
+    # meaning of the packed file's contents changes, so that files written by
+    # older versions are rejected instead of being misread
+    VERSION = 1
+
+    # Map of name -> typecode of the sections of the packed file
+    SCHEMA = {
+        "cells": "i",
+        "offsets": "i",
+        "rows": "i",
+        "lons": "d",
+        "lats": "d"
+    }
+
+    # Size in meters of the cells of the grid of the stations
+    CELL_SIZE = 500
+
+    def __init__(self, path, source=None):
+        """ Constructor.
+
+        Arguments
+        ---------
+        path: str
+            Path of the packed file of the index
+        source: dict[str -> str]
+            Expected map of static GTFS file -> hash of the file the packed
+            file was built from (as recorded in the build manifest), or None
+            to accept any source
+
+        Raises
+        ------
+        StaleCacheError
+            If the packed file is missing, was written by another version of
+            its format, or was built from a different static feed
+        """
+        self._packed = PackedFile(path, self.VERSION, self.SCHEMA, source)
+        self._grid = GridIndex(self._packed.metadata["grid"], **{
+            name: self._packed.section(name) for name in self.SCHEMA
+        })
+
+    @staticmethod
+    def write(path, stop_ids, names, lons, lats, source=None):
+        """ Writes the index to a packed file.
+
+        In the packed file, stations are referred to by their index in the
+        lists of the metadata. The packed file has the following metadata
+        and sections:
+
+        metadata: {
+            stop_ids: [station IDs],
+            names: [station names],
+            grid: layout of the grid of the stations (see GridIndex.build)
+        }
+        cells, offsets, rows, lons, lats: arrays of the GridIndex of the
+            stations, which are stored in the order of the grid, so that the
+            rows of the grid are also the indices of the stations in the
+            metadata and in lons and lats
+
+        Arguments
+        ---------
+        path: str
+            Path of the packed file to write
+        stop_ids: list[str]
+            Station ID of each station
+        names: list[str]
+            Name of each station
+        lons: array[float]
+            Longitude of each station
+        lats: array[float]
+            Latitude of each station
+        source: dict[str -> str]
+            Map of static GTFS file -> hash of the file, for the files the
+            index was built from
+        """
+        grid, sections = GridIndex.build(lons, lats, StopIndex.CELL_SIZE)
+        order = sections["rows"]
+        stop_ids = [stop_ids[i] for i in order]
+        names = [names[i] for i in order]
+        sections["rows"] = array("i", xrange(len(order)))
+
+        write_packed(path, StopIndex.VERSION,
+                     {"stop_ids": stop_ids, "names": names, "grid": grid},
+                     sections, source)
+
+    def get_stops_near(self, lon, lat, radius, limit=None):
+        """ Returns the stations near a point.
+
+        Arguments
+        ---------
+        lon: float
+            Longitude of the point
+        lat: float
+            Latitude of the point
+        radius: float
+            Distance in meters within which stations are returned
+        limit: int
+            Maximum number of stations to return, or None for every station
+            within the distance
+
+        Returns
+        -------
+        list[dict]
+            List of the stations, nearest first, of the form {stop_id:
+            station ID, name: name, coordinates: [lon, lat], distance:
+            distance in meters}
+        """
+        metadata = self._packed.metadata
+        points = self._grid.within(lon, lat, radius)
+
+        return [{
+            "stop_id": metadata["stop_ids"][row],
+            "name": metadata["names"][row],
+            "coordinates": [self._packed.section("lons")[row],
+                            self._packed.section("lats")[row]],
+            "distance": distance
+        } for distance, row in points[:limit]]
+
+    def __len__(self):
+        return len(self._grid)
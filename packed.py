@@ -0,0 +1,248 @@
+import ctypes
+import hashlib
+import mmap
+import os
+import struct
+
+from array import array
+
+import simplejson as json
+
+PACKED_MAGIC = "LSPACKED"
+
+# Sections are aligned to this many bytes within a packed file, so that every
+# number in a section is aligned to its size
+ALIGNMENT = 8
+
+# Map of array typecode -> little-endian ctypes type of the numbers of a
+# section with that typecode
+SECTION_TYPES = {
+    "b": ctypes.c_int8.__ctype_le__,
+    "i": ctypes.c_int32.__ctype_le__,
+    "d": ctypes.c_double.__ctype_le__
+}
+
+
+class StaleCacheError(Exception):
+    """ StaleCacheError class.
+
+    Raised when a packed file cannot be used: it is missing, it was written
+    by a different version of its format or with a different layout, or it
+    was built from a different static feed than expected. In every case,
+    the file needs to be rebuilt with static.py.
+    """
+    def __init__(self, path, reason):
+        """ Constructor.
+
+        Arguments
+        ---------
+        path: str
+            Path of the packed file
+        reason: str
+            Why the file cannot be used
+        """
+        Exception.__init__(self, "{} {}; rebuild it with static.py".format(
+            path, reason))
+        self.path = path
+        self.reason = reason
+
+
+class PackedFile:
+    """ PackedFile class.
+
+    Read-only file of named sections of numbers, along with JSON metadata
+    (such as the string IDs that the numbers in the sections refer to).
+
+    The file is memory-mapped and its header checked as soon as it is
+    opened, so that a stale file fails right away rather than on the first
+    lookup, but the numbers themselves are only read from disk (by the OS)
+    when they are accessed.
+
+    Sections are ctypes arrays laid directly over the mapped file, so
+    indexing them (or bisecting them, since they support len and indexing)
+    costs about as much as indexing a list, without copying anything. The
+    file is mapped copy-on-write, as ctypes needs a writable buffer, but
+    sections are never written to, so the pages backing them stay shared
+    through the OS page cache by every process mapping the same file.
+
+    Packed files have the following format (all numbers little-endian):
+
+        magic: 8 bytes (PACKED_MAGIC)
+        header length: uint32
+        header: JSON of the form {
+            version: version of the format of the file's contents,
+            source: map of static GTFS file -> hash of the file, for the
+                files the packed file was built from (or null),
+            metadata: metadata of the file,
+            sections: {
+                name: [typecode, offset of section, number of numbers]
+            }
+        }
+        sections, each aligned to ALIGNMENT bytes
+    """
+    def __init__(self, path, version, schema, source=None):
+        """ Constructor.
+
+        Arguments
+        ---------
+        path: str
+            Path of the packed file
+        version: int
+            Expected version of the format of the file's contents
+        schema: dict[str -> str]
+            Map of name -> typecode of each section the file must have
+        source: dict[str -> str]
+            Expected map of static GTFS file -> hash of the file the packed
+            file was built from, or None to accept any source
+
+        Raises
+        ------
+        StaleCacheError
+            If the file is missing, or does not match the expected version,
+            schema or source
+        """
+        self.path = path
+
+        try:
+            with open(path, "rb") as packed_f:
+                buffer = mmap.mmap(packed_f.fileno(), 0,
+                                   access=mmap.ACCESS_COPY)
+        except (IOError, OSError, ValueError):
+            raise StaleCacheError(path, "could not be opened")
+
+        if buffer[:len(PACKED_MAGIC)] != PACKED_MAGIC:
+            raise StaleCacheError(path, "is not a packed file")
+
+        # A truncated file, or a corrupt header, is as unusable as a stale
+        # one
+        header_start = len(PACKED_MAGIC) + 4
+        try:
+            header_length, = struct.unpack_from("<I", buffer,
+                                                len(PACKED_MAGIC))
+            if header_start + header_length > len(buffer):
+                raise ValueError("header past the end of the file")
+
+            header = json.loads(
+                buffer[header_start:header_start + header_length])
+            sections = header["sections"]
+            metadata = header["metadata"]
+        except (struct.error, ValueError, TypeError, KeyError):
+            raise StaleCacheError(path, "has a corrupt header")
+
+        if header.get("version") != version:
+            raise StaleCacheError(path, "has format version {} (expected {})"
+                                  .format(header.get("version"), version))
+
+        for name, typecode in schema.iteritems():
+            if name not in sections or sections[name][0] != typecode or \
+                    typecode not in SECTION_TYPES:
+                raise StaleCacheError(path, "has no {} section of type {}"
+                                      .format(name, typecode))
+
+        if source is not None and header.get("source") != source:
+            raise StaleCacheError(path, "was built from a different static "
+                                  "feed than the one in the build manifest")
+
+        self.source = header.get("source")
+        self.metadata = metadata
+        try:
+            self._sections = {
+                name: (SECTION_TYPES[typecode] * length).from_buffer(buffer,
+                                                                     offset)
+                for name, (typecode, offset, length) in sections.iteritems()
+                if name in schema
+            }
+        except (TypeError, ValueError):
+            raise StaleCacheError(path, "is truncated")
+        self._buffer = buffer
+        self._digest = None
+
+    @property
+    def digest(self):
+        """ Hex SHA-1 digest of the whole file, which changes whenever the
+        file is rebuilt with different contents (computed once). """
+        if self._digest is None:
+            self._digest = hashlib.sha1(self._buffer).hexdigest()
+
+        return self._digest
+
+    def section(self, name):
+        """ Returns a section of the file.
+
+        Arguments
+        ---------
+        name: str
+            Name of the section
+
+        Returns
+        -------
+        ctypes.Array
+            Numbers of the section (not to be modified)
+        """
+        return self._sections[name]
+
+
+def write_packed(path, version, metadata, sections, source=None):
+    """ Writes a packed file; see PackedFile.
+
+    Arguments
+    ---------
+    path: str
+        Path of the packed file to write
+    version: int
+        Version of the format of the file's contents
+    metadata: dict
+        JSON-serializable metadata of the file
+    sections: dict[str -> array]
+        Map of section name -> numbers of the section
+    source: dict[str -> str]
+        Map of static GTFS file -> hash of the file, for the files the packed
+        file is built from (if known)
+    """
+    names = sorted(sections)
+
+    # The offsets of the sections depend on the length of the header, which
+    # in turn depends on the offsets, so the header is padded to a length
+    # that leaves room for the offsets to grow.
+    header_sections = {
+        name: [sections[name].typecode, 0, len(sections[name])]
+        for name in names
+    }
+    header = {
+        "version": version,
+        "source": source,
+        "metadata": metadata,
+        "sections": header_sections
+    }
+    header_length = len(json.dumps(header, sort_keys=True))
+    header_length += 16 * len(names)
+    offset = len(PACKED_MAGIC) + 4 + header_length
+    offset += -offset % ALIGNMENT
+
+    for name in names:
+        header_sections[name][1] = offset
+        offset += len(sections[name]) * sections[name].itemsize
+        offset += -offset % ALIGNMENT
+
+    # Keys are sorted, so that the same contents always make the same file
+    # (and digest), however the maps were built
+    header = json.dumps(header, sort_keys=True)
+    header += " " * (header_length - len(header))
+
+    # Write to a temporary file first, so that processes that have the file
+    # mapped are not affected (and an interrupted write does not leave a
+    # corrupt file behind)
+    with open(path + ".tmp", "wb") as packed_f:
+        packed_f.write(PACKED_MAGIC)
+        packed_f.write(struct.pack("<I", header_length))
+        packed_f.write(header)
+
+        for name in names:
+            packed_f.write("\0" * (header_sections[name][1] -
+                                   packed_f.tell()))
+            section = array(sections[name].typecode, sections[name])
+            if struct.pack("=i", 1) != struct.pack("<i", 1):
+                section.byteswap()
+            section.tofile(packed_f)
+
+    os.rename(path + ".tmp", path)
@@ -0,0 +1,330 @@
+import time
+
+from collections import namedtuple
+from itertools import chain
+
+import gtfs_realtime_pb2 as gtfs
+
+STOPPED_AT = gtfs.VehiclePosition.STOPPED_AT
+
+
+# Train on its way between two stations. segment_ids are the IDs of the
+# segments of its path in the StopGraph (a single segment between stations
+# adjacent on some trip, or else the chain of segments between them; see
+# StopGraph.find_segments), departure_time the POSIX time the train left the
+# start of the path, and arrival_time the POSIX time it is predicted to
+# arrive at the end of the path (no later than departure_time if it already
+# has, or None if there is no prediction and it is still at the start).
+#
+# Both times are absolute, rather than counted from the snapshot the train
+# is from, so that a train that keeps its path and prediction keeps the
+# same state from one snapshot to the next, and the client code finds its
+# position along the path at any time from these alone.
+Train = namedtuple("Train", ["trip_id", "route_id", "prev_station",
+                             "next_station", "segment_ids", "departure_time",
+                             "arrival_time"])
+
+
+class Frame:
+    """ Frame class.
+
+    Snapshot of every train of the live feeds, shared by every client. A
+    frame is never modified once made; every new snapshot of a feed makes a
+    new frame (see FrameBuilder), numbered one more than the last.
+
+    Frames refer to the path of each train only by segment IDs; the client
+    code fetches the path of each segment once (from /segments) and caches
+    it, so that the size of a frame does not depend on the geometry of the
+    segments. Frames are sent to the client code as deltas from the
+    previous frame (see get_delta), which only hold the trains that were
+    added, changed or removed. Clients that have no previous frame (or
+    missed one) are sent a keyframe instead (see get_keyframe).
+    """
+    def __init__(self, seq, timestamp, trains, segments_version):
+        """ Constructor.
+
+        Arguments
+        ---------
+        seq: int
+            Sequence number of the frame
+        timestamp: int
+            POSIX time of the latest feed snapshot the frame is made from
+        trains: iterable[Train]
+            Trains of the frame
+        segments_version: str
+            Version of the segment IDs of the trains (see
+            StopGraph.get_segments_version)
+        """
+        self.seq = seq
+        self.timestamp = timestamp
+        self.trains = tuple(trains)
+        self.segments_version = segments_version
+
+        # Map of trip ID -> state of the train of the trip, as sent to the
+        # client code
+        self._states = {
+            train.trip_id: {
+                "route": train.route_id,
+                "segments": list(train.segment_ids),
+                "departure": train.departure_time,
+                "arrival": train.arrival_time
+            }
+            for train in self.trains
+        }
+
+    def __len__(self):
+        return len(self.trains)
+
+    def get_keyframe(self):
+        """ Returns the JSON-serializable form of the whole frame.
+
+        Returns
+        -------
+        dict
+            Map of the form {
+                seq: sequence number of the frame,
+                base: null,
+                segments_version: version of the segment IDs,
+                trains: {
+                    trip ID: {
+                        route: route ID of the train,
+                        segments: segment IDs of the train's path,
+                        departure: POSIX time the train left the start of
+                            the path,
+                        arrival: predicted POSIX time of arrival at the end
+                            of the path, or null
+                    }
+                },
+                removed: []
+            }
+        """
+        return {
+            "seq": self.seq,
+            "base": None,
+            "segments_version": self.segments_version,
+            "trains": self._states,
+            "removed": []
+        }
+
+    def get_delta(self, previous):
+        """ Returns the JSON-serializable form of the changes from a
+        previous frame to the frame.
+
+        Arguments
+        ---------
+        previous: Frame
+            Previous frame
+
+        Returns
+        -------
+        dict
+            Map of the same form as a keyframe (see get_keyframe), but with
+            base the sequence number of the previous frame, no segments
+            version, only the trains added since the previous frame or whose
+            path or predicted times changed, and removed the trip IDs of the
+            trains no longer in the frame
+        """
+        trains = {
+            trip_id: state for trip_id, state in self._states.iteritems()
+            if previous._states.get(trip_id) != state
+        }
+
+        return {
+            "seq": self.seq,
+            "base": previous.seq,
+            "trains": trains,
+            "removed": sorted(trip_id for trip_id in previous._states
+                              if trip_id not in self._states)
+        }
+
+
+class FrameBuilder:
+    """ FrameBuilder class.
+
+    Turns snapshots of the live feeds into frames. Every train of a snapshot
+    is placed on the path between its previous stop (see PrevStops) and
+    the stop it is headed to, along with when it left the previous stop and
+    when it is predicted to arrive at the next one, which the client code
+    estimates its position along the path from.
+
+    Each feed covers a different group of routes, so the trains of each
+    feed are kept separately, and a new frame is made from the latest
+    trains of every feed whenever any one feed has a new snapshot.
+    """
+    def __init__(self, prev_stops, graph, shapes):
+        """ Constructor.
+
+        Arguments
+        ---------
+        prev_stops: PrevStops
+            Previous stops of every stop of the static feed
+        graph: StopGraph
+            Graph of the segments between stations
+        shapes: ShapeStore
+            Store of the points of every shape
+        """
+        self.prev_stops = prev_stops
+        self.graph = graph
+        self.shapes = shapes
+
+        # Map of feed ID -> tuple of Trains of the latest snapshot of the
+        # feed
+        self._trains = {}
+
+        # Map of feed ID -> timestamp of the latest snapshot of the feed
+        self._timestamps = {}
+
+        # Map of feed ID -> map of trip ID -> tuple of (stop ID, time) of the
+        # stop each train was last headed to, and the time it was first seen
+        # headed there (taken as the time it left its previous stop)
+        self._departures = {}
+
+        self.segments_version = graph.get_segments_version(shapes)
+        self.frame = Frame(0, 0, [], self.segments_version)
+
+    def process_feed(self, feed_id, feed_message):
+        """ Makes a new frame with a new snapshot of a feed.
+
+        Arguments
+        ---------
+        feed_id: int
+            ID of the feed
+        feed_message: transit_realtime.FeedMessage
+            GTFS realtime FeedMessage object (protobuf)
+
+        Returns
+        -------
+        Frame
+            New frame (also kept in self.frame)
+        """
+        timestamp = feed_message.header.timestamp or int(time.time())
+        departures = {}
+
+        self._trains[feed_id] = tuple(self._get_trains(
+            feed_message, timestamp, self._departures.get(feed_id, {}),
+            departures))
+        self._timestamps[feed_id] = timestamp
+        self._departures[feed_id] = departures
+
+        self.frame = Frame(
+            self.frame.seq + 1, max(self._timestamps.itervalues()),
+            chain.from_iterable(self._trains[i] for i in sorted(self._trains)),
+            self.segments_version
+        )
+        return self.frame
+
+    def _get_segment_ids(self, start, end):
+        """ Returns the IDs of the chain of segments between two stations.
+
+        Trains are usually between stations adjacent on some trip, but
+        trains running express, rerouted, or whose last stops were missed by
+        the feed may be between stations further apart, and are placed on
+        the shortest chain of segments between them instead (see
+        StopGraph.find_segments, which caches the chain of each pair of
+        stations).
+
+        Arguments
+        ---------
+        start: str
+            Station ID of start station
+        end: str
+            Station ID of end station
+
+        Returns
+        -------
+        tuple[int]
+            Segment IDs, or None if no chain of segments joins the stations
+        """
+        try:
+            return self.graph.find_segments(start, end, self.shapes)
+        except KeyError:
+            return None
+
+    @staticmethod
+    def _get_arrival_times(feed_message):
+        """ Returns the predicted arrival times of the trips of a snapshot.
+
+        Arguments
+        ---------
+        feed_message: transit_realtime.FeedMessage
+            GTFS realtime FeedMessage object (protobuf)
+
+        Returns
+        -------
+        dict[str -> dict[str -> int]]
+            Map of trip ID -> map of stop ID -> predicted POSIX time of
+            arrival of the trip at the stop
+        """
+        arrival_times = {}
+        for entity in feed_message.entity:
+            if not entity.HasField("trip_update"):
+                continue
+
+            trip_update = entity.trip_update
+            arrival_times[trip_update.trip.trip_id] = {
+                stop_time_update.stop_id: stop_time_update.arrival.time
+                for stop_time_update in trip_update.stop_time_update
+                if stop_time_update.arrival.time
+            }
+
+        return arrival_times
+
+    def _get_trains(self, feed_message, timestamp, last_departures,
+                    departures):
+        """ Yields the trains of a snapshot of a feed.
+
+        Vehicles whose previous stop is not known (such as at the beginning
+        of their trip), or that are between stations that no chain of
+        segments joins, are left out.
+
+        Arguments
+        ---------
+        feed_message: transit_realtime.FeedMessage
+            GTFS realtime FeedMessage object (protobuf)
+        timestamp: int
+            POSIX time of the snapshot
+        last_departures: dict[str -> tuple[str, int]]
+            Map of trip ID -> (stop ID, departure time) of the trains of the
+            previous snapshot of the feed
+        departures: dict[str -> tuple[str, int]]
+            Map to add the (stop ID, departure time) of each train of the
+            snapshot to
+
+        Returns
+        -------
+        generator[Train]
+            Trains of the snapshot
+        """
+        arrival_times = FrameBuilder._get_arrival_times(feed_message)
+
+        for vehicle, prev_stop in self.prev_stops.resolve_feed(feed_message):
+            if prev_stop is None:
+                continue
+
+            prev_station = self.graph.get_station(prev_stop)
+            next_station = self.graph.get_station(vehicle.stop_id)
+            segment_ids = self._get_segment_ids(prev_station, next_station)
+            if segment_ids is None:
+                continue
+
+            trip_id = vehicle.trip.trip_id
+
+            # A train seen headed to a new stop is taken to have left its
+            # previous stop when it was last updated, or else now
+            departure = last_departures.get(trip_id)
+            if departure is None or departure[0] != vehicle.stop_id:
+                departure = (vehicle.stop_id,
+                             min(vehicle.timestamp or timestamp, timestamp))
+            departures[trip_id] = departure
+
+            arrival_time = arrival_times.get(trip_id, {}).get(
+                vehicle.stop_id)
+
+            # A train stopped at its stop is at the end of its path, and a
+            # train with no predicted arrival at its stop is left where it
+            # was last known to be, at its previous stop
+            if vehicle.current_status == STOPPED_AT:
+                arrival_time = departure[1]
+
+            yield Train(trip_id, vehicle.trip.route_id, prev_station,
+                        next_station, segment_ids, departure[1], arrival_time)
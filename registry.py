@@ -0,0 +1,126 @@
+import threading
+import time
+
+
+class StaticRegistry:
+    """ StaticRegistry class.
+
+    Registry of the static data of the server (such as the graph, shapes and
+    JSON files built by static.py). Each artifact is only loaded the first
+    time it is used, so that importing the server (as tests and tools do)
+    does not load everything, and tools only load the artifacts they use.
+
+    Artifacts are registered with a function loading them, and then read as
+    attributes of the registry (or with get). Each artifact has its own
+    lock, so that greenthreads (or threads) using an artifact at the same
+    time while it loads wait for it to be loaded once, while other
+    artifacts can still be loaded meanwhile. Loaders may use other
+    artifacts of the registry, which are then loaded first.
+
+    The time taken to load each artifact is printed and kept in load_times.
+    Servers that would rather pay for loading everything up front (and fail
+    right away if an artifact is stale) can load every artifact with
+    warm_up.
+    """
+    def __init__(self):
+        """ Constructor. """
+        # Map of name -> function loading the artifact
+        self._loaders = {}
+
+        # Map of name -> lock held while loading the artifact
+        self._locks = {}
+
+        # Map of name -> artifact, once loaded
+        self._artifacts = {}
+
+        # Map of name -> seconds taken to load the artifact (including any
+        # artifacts it uses that were loaded first), once loaded
+        self.load_times = {}
+
+    def loader(self, load):
+        """ Registers a function loading an artifact, named after the
+        function; meant to be used as a decorator.
+
+        Arguments
+        ---------
+        load: function() -> object
+            Function loading the artifact
+
+        Returns
+        -------
+        function() -> object
+            The same function
+        """
+        self._loaders[load.__name__] = load
+        self._locks[load.__name__] = threading.Lock()
+        return load
+
+    def get(self, name):
+        """ Returns an artifact, loading it first if it is not loaded yet.
+
+        Arguments
+        ---------
+        name: str
+            Name of the artifact
+
+        Returns
+        -------
+        object
+            Artifact
+
+        Raises
+        ------
+        KeyError
+            If there is no artifact of that name
+        """
+        # Loaded artifacts are never replaced, so they can be read without
+        # taking the lock
+        if name in self._artifacts:
+            return self._artifacts[name]
+
+        with self._locks[name]:
+            if name not in self._artifacts:
+                start = time.time()
+                artifact = self._loaders[name]()
+                self.load_times[name] = time.time() - start
+                self._artifacts[name] = artifact
+
+                print "Loaded {} in {:.3f}s.".format(name,
+                                                     self.load_times[name])
+
+        return self._artifacts[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name not in self._loaders:
+            raise AttributeError(name)
+
+        return self.get(name)
+
+    def is_loaded(self, name):
+        """ Returns whether an artifact is loaded.
+
+        Arguments
+        ---------
+        name: str
+            Name of the artifact
+
+        Returns
+        -------
+        bool
+            Whether the artifact is loaded
+        """
+        return name in self._artifacts
+
+    def warm_up(self):
+        """ Loads every artifact not loaded yet.
+
+        Returns
+        -------
+        float
+            Seconds taken to load the artifacts
+        """
+        start = time.time()
+        for name in sorted(self._loaders):
+            self.get(name)
+
+        return time.time() - start
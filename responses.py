@@ -0,0 +1,121 @@
+import gzip
+import hashlib
+import zlib
+
+from cStringIO import StringIO
+
+from flask import Response
+
+# Brotli compresses better than gzip, but is optional, since not every
+# client accepts it anyway
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class EncodedResponse:
+    """ EncodedResponse class.
+
+    Response of a resource that does not change while the server runs (such
+    as the static JSON files), encoded once, along with its compressed
+    forms, so that serving it never serializes or compresses anything.
+
+    Each form has its own strong ETag, and requests whose If-None-Match
+    matches any of them are answered with 304 Not Modified.
+    """
+    def __init__(self, body, mimetype="application/json",
+                 cache_control="no-cache", gzip_body=None, compress=True):
+        """ Constructor.
+
+        Arguments
+        ---------
+        body: str
+            Body of the response
+        mimetype: str
+            MIME type of the body
+        cache_control: str
+            Cache-Control header of the response (by default, caches must
+            revalidate the response with its ETag before using it)
+        gzip_body: str
+            Gzip compressed body, if already compressed, or None to compress
+            the body
+        compress: bool
+            Whether to keep compressed forms of the body, which is only
+            worth it for responses served more than once
+        """
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+
+        digest = hashlib.sha1(body).hexdigest()[:20]
+
+        # List of tuples of (content coding, body, ETag) of each form of the
+        # response, in order of preference
+        self.forms = []
+        if compress:
+            if brotli is not None:
+                self.forms.append(("br", brotli.compress(body),
+                                   digest + "-br"))
+
+            if gzip_body is None:
+                buf = StringIO()
+                gzip_f = gzip.GzipFile(fileobj=buf, mode="wb", mtime=0)
+                gzip_f.write(body)
+                gzip_f.close()
+                gzip_body = buf.getvalue()
+
+            self.forms.append(("gzip", gzip_body, digest + "-gzip"))
+
+        self.forms.append(("identity", body, digest))
+
+    @classmethod
+    def from_gzip(cls, gzip_body, **kwargs):
+        """ Returns the response of a gzip compressed body.
+
+        Arguments
+        ---------
+        gzip_body: str
+            Gzip compressed body
+        kwargs: dict
+            Other arguments of the constructor
+
+        Returns
+        -------
+        EncodedResponse
+            Response of the body, reusing its gzip compressed form
+        """
+        return cls(zlib.decompress(gzip_body, 16 + zlib.MAX_WBITS),
+                   gzip_body=gzip_body, **kwargs)
+
+    def make_response(self, request):
+        """ Returns the response to a request.
+
+        Arguments
+        ---------
+        request: flask.Request
+            Request of the resource
+
+        Returns
+        -------
+        flask.Response
+            Response in the most preferred form the request accepts, or 304
+            Not Modified if the request already has a form of the response
+        """
+        for coding, body, etag in self.forms:
+            if coding == "identity" or request.accept_encodings[coding]:
+                break
+
+        headers = {
+            "ETag": '"{}"'.format(etag),
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding"
+        }
+
+        if any(request.if_none_match.contains_weak(form[2])
+               for form in self.forms):
+            return Response(status=304, headers=headers)
+
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+
+        return Response(body, mimetype=self.mimetype, headers=headers)
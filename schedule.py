@@ -0,0 +1,624 @@
+import csv
+import hashlib
+import os
+import resource
+import sys
+import time
+import zipfile
+
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
+
+UTF8_BOM = "\xef\xbb\xbf"
+
+
+@contextmanager
+def build_stage(name):
+    """ Context manager reporting wall time and peak memory of a build stage.
+
+    Peak memory is the peak resident set size of the whole process so far,
+    so a stage that does not raise it simply reports the previous peak.
+
+    Arguments
+    ---------
+    name: str
+        Name of the stage, used in the printed report
+    """
+    start = time.time()
+    yield
+    print "{}: {:.2f}s, peak memory {:.1f} MB".format(
+        name, time.time() - start, get_peak_memory())
+
+
+def get_peak_memory():
+    """ Returns the peak resident set size of the process in megabytes. """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on OS X, but in kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak / (1024.0 * 1024.0)
+    else:
+        return peak / 1024.0
+
+
+def hash_file(file_obj):
+    """ Returns a hash of the contents of a file.
+
+    Arguments
+    ---------
+    file_obj: file
+        File object to read, from its current position to its end
+
+    Returns
+    -------
+    str
+        SHA-1 hex digest of the contents of the file
+    """
+    # Size of the blocks the file is read in, so that large files such as
+    # stop_times.txt are not read into memory all at once
+    BLOCK_SIZE = 1 << 20
+
+    file_hash = hashlib.sha1()
+    for block in iter(lambda: file_obj.read(BLOCK_SIZE), ""):
+        file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+class GTFSSource:
+    """ GTFSSource class.
+
+    Reads the static GTFS text files row by row, either from a directory of
+    extracted files (such as transit_files/) or directly from the zip file
+    published by the MTA (google_transit.zip), without extracting it.
+    """
+    def __init__(self, path):
+        """ Constructor.
+
+        Arguments
+        ---------
+        path: str
+            Path to a directory of GTFS text files or to a GTFS zip file
+        """
+        self.path = path
+        self.is_zip = os.path.isfile(path) and zipfile.is_zipfile(path)
+
+    def _open(self, filename):
+        """ Returns a file object for a GTFS text file.
+
+        Arguments
+        ---------
+        filename: str
+            Name of the GTFS text file (e.g. stops.txt)
+
+        Returns
+        -------
+        file
+            File object containing the lines of the text file
+        """
+        if not self.is_zip:
+            return open(os.path.join(self.path, filename), "rb")
+
+        archive = zipfile.ZipFile(self.path)
+        # Some feeds nest the text files in a directory inside the archive
+        for name in archive.namelist():
+            if os.path.basename(name) == filename:
+                return archive.open(name)
+
+        raise IOError("{} not found in {}".format(filename, self.path))
+
+    def get_hash(self, filename):
+        """ Returns a hash of the contents of a GTFS text file.
+
+        Arguments
+        ---------
+        filename: str
+            Name of the GTFS text file (e.g. stops.txt)
+
+        Returns
+        -------
+        str
+            SHA-1 hex digest of the contents of the file
+        """
+        gtfs_f = self._open(filename)
+        try:
+            return hash_file(gtfs_f)
+        finally:
+            gtfs_f.close()
+
+    def rows(self, filename, columns):
+        """ Yields the requested columns of each row of a GTFS text file.
+
+        Arguments
+        ---------
+        filename: str
+            Name of the GTFS text file (e.g. stops.txt)
+        columns: list[str]
+            Names of the columns to retrieve; columns missing from the file
+            are returned as empty strings
+
+        Returns
+        -------
+        generator[tuple[str]]
+            Tuples of the requested column values for each row
+        """
+        gtfs_f = self._open(filename)
+        try:
+            reader = csv.reader(gtfs_f)
+            header = [name.strip() for name in next(reader)]
+            if header and header[0].startswith(UTF8_BOM):
+                header[0] = header[0][len(UTF8_BOM):]
+
+            indices = [header.index(column) if column in header else None
+                       for column in columns]
+
+            for row in reader:
+                # Skip blank lines, which some feeds end with
+                if not row:
+                    continue
+
+                yield tuple(row[index].strip()
+                            if index is not None and index < len(row) else ""
+                            for index in indices)
+        finally:
+            gtfs_f.close()
+
+
+def _group_rows(groups, sequences, columns, num_groups):
+    """ Sorts rows of a columnar table by group and sequence, in place.
+
+    Rows of stop_times.txt and shapes.txt are almost always already grouped
+    by trip/shape and sorted by sequence, so rows are first moved into their
+    groups with a (linear) counting sort only if needed, and then only the
+    groups that are out of sequence order are sorted.
+
+    Arguments
+    ---------
+    groups: array[int]
+        Group (i.e. trip or shape) index of each row
+    sequences: array[int]
+        Sequence number of each row within its group
+    columns: list[array]
+        Other columns of the table, to be sorted along with the groups
+        and sequences
+    num_groups: int
+        Number of groups
+
+    Returns
+    -------
+    array[int]
+        Offsets of each group's rows, such that the rows of group i are in
+        the range [offsets[i], offsets[i + 1]); groups without any rows
+        are given empty ranges
+    """
+    all_columns = [groups, sequences] + columns
+
+    offsets = array("i", [0] * (num_groups + 1))
+    for group in groups:
+        offsets[group + 1] += 1
+    for i in xrange(num_groups):
+        offsets[i + 1] += offsets[i]
+
+    if any(groups[i - 1] > groups[i] for i in xrange(1, len(groups))):
+        positions = offsets[:-1]
+        order = array("i", [0] * len(groups))
+        for i, group in enumerate(groups):
+            order[positions[group]] = i
+            positions[group] += 1
+
+        for column in all_columns:
+            column[:] = array(column.typecode, (column[i] for i in order))
+
+    for group in xrange(num_groups):
+        start, end = offsets[group], offsets[group + 1]
+        if any(sequences[i - 1] > sequences[i]
+               for i in xrange(start + 1, end)):
+            order = sorted(xrange(start, end), key=sequences.__getitem__)
+            for column in all_columns:
+                column[start:end] = array(column.typecode,
+                                          (column[i] for i in order))
+
+    return offsets
+
+
+class Interner:
+    """ Interner class.
+
+    Maps string IDs to dense integers (0, 1, 2, ... in order of first
+    appearance), so that tables and builders can key their structures by
+    small integers rather than by strings or tuples of strings, and only map
+    them back to strings when writing files.
+    """
+    def __init__(self, values=()):
+        """ Constructor.
+
+        Arguments
+        ---------
+        values: iterable[str]
+            Values to intern right away
+        """
+        # List of interned values, such that values[i] is interned as i
+        self.values = []
+        # Map of value -> integer the value is interned as
+        self.index = {}
+
+        for value in values:
+            self.intern(value)
+
+    def intern(self, value):
+        """ Returns the integer a value is interned as, interning it if
+        needed.
+
+        Arguments
+        ---------
+        value: str
+            Value to intern
+
+        Returns
+        -------
+        int
+            Integer the value is interned as
+        """
+        if value not in self.index:
+            self.index[value] = len(self.values)
+            self.values.append(value)
+
+        return self.index[value]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class StopTable:
+    """ StopTable class.
+
+    Columnar table of the rows of stops.txt. Stops are referred to by their
+    row index in the other tables.
+    """
+    def __init__(self, source):
+        """ Constructor.
+
+        Arguments
+        ---------
+        source: GTFSSource
+            GTFS source to read stops.txt from
+        """
+        self.stop_ids = []
+        self.names = []
+        self.parent_stations = []
+        self.lons = array("d")
+        self.lats = array("d")
+        self.location_types = array("b")
+
+        columns = ["stop_id", "stop_name", "stop_lat", "stop_lon",
+                   "location_type", "parent_station"]
+        for stop_id, name, lat, lon, location_type, parent_station in \
+                source.rows("stops.txt", columns):
+            self.stop_ids.append(stop_id)
+            self.names.append(name)
+            self.lats.append(float(lat))
+            self.lons.append(float(lon))
+            self.location_types.append(int(location_type or 0))
+            self.parent_stations.append(parent_station)
+
+        self.index = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+
+        # Row of the parent station of each stop (stops without a parent
+        # station are their own station)
+        self.parent_rows = array("i", (
+            self.index.get(parent_station, i)
+            for i, parent_station in enumerate(self.parent_stations)
+        ))
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+
+class RouteTable:
+    """ RouteTable class.
+
+    Columnar table of the rows of routes.txt.
+    """
+    def __init__(self, source):
+        """ Constructor.
+
+        Arguments
+        ---------
+        source: GTFSSource
+            GTFS source to read routes.txt from
+        """
+        self.route_ids = []
+        self.colors = []
+
+        for route_id, color in source.rows("routes.txt",
+                                           ["route_id", "route_color"]):
+            self.route_ids.append(route_id)
+            self.colors.append(color)
+
+    def __len__(self):
+        return len(self.route_ids)
+
+
+class TripTable:
+    """ TripTable class.
+
+    Columnar table of the rows of trips.txt. Trips are referred to by their
+    row index in the other tables.
+    """
+    def __init__(self, source):
+        """ Constructor.
+
+        Arguments
+        ---------
+        source: GTFSSource
+            GTFS source to read trips.txt from
+        """
+        self.trip_ids = []
+        self.route_ids = []
+        self.service_ids = []
+        self.shape_ids = []
+
+        # Route IDs of the trips, interned, and the interned route of each
+        # trip
+        self.routes = Interner()
+        self.route_indices = array("i")
+
+        columns = ["trip_id", "route_id", "service_id", "shape_id"]
+        for trip_id, route_id, service_id, shape_id in \
+                source.rows("trips.txt", columns):
+            self.trip_ids.append(trip_id)
+            self.route_ids.append(route_id)
+            self.service_ids.append(service_id)
+            self.shape_ids.append(shape_id)
+            self.route_indices.append(self.routes.intern(route_id))
+
+        self.index = {trip_id: i for i, trip_id in enumerate(self.trip_ids)}
+
+    def __len__(self):
+        return len(self.trip_ids)
+
+
+class StopTimeTable:
+    """ StopTimeTable class.
+
+    Columnar table of the rows of stop_times.txt, sorted by trip and stop
+    sequence. Trips and stops are stored as row indices of the TripTable and
+    StopTable respectively, so that each row only takes up a few integers.
+    """
+    def __init__(self, source, trips, stops):
+        """ Constructor.
+
+        Arguments
+        ---------
+        source: GTFSSource
+            GTFS source to read stop_times.txt from
+        trips: TripTable
+            Table of trips referred to by stop_times.txt
+        stops: StopTable
+            Table of stops referred to by stop_times.txt
+        """
+        self.trip_rows = array("i")
+        self.stop_rows = array("i")
+        self.stop_sequences = array("i")
+
+        columns = ["trip_id", "stop_id", "stop_sequence"]
+        for trip_id, stop_id, stop_sequence in \
+                source.rows("stop_times.txt", columns):
+            self.trip_rows.append(trips.index[trip_id])
+            self.stop_rows.append(stops.index[stop_id])
+            self.stop_sequences.append(int(stop_sequence))
+
+        self.offsets = _group_rows(self.trip_rows, self.stop_sequences,
+                                   [self.stop_rows], len(trips))
+
+    def get_range(self, trip_row):
+        """ Returns the range of rows of the stop times of a trip.
+
+        Arguments
+        ---------
+        trip_row: int
+            Row index of the trip in the TripTable
+
+        Returns
+        -------
+        xrange
+            Range of rows of the stop times of the trip, in stop sequence
+            order
+        """
+        return xrange(self.offsets[trip_row], self.offsets[trip_row + 1])
+
+    def __len__(self):
+        return len(self.trip_rows)
+
+
+class ShapeTable:
+    """ ShapeTable class.
+
+    Columnar table of the rows of shapes.txt, sorted by shape and point
+    sequence.
+    """
+    def __init__(self, source):
+        """ Constructor.
+
+        Arguments
+        ---------
+        source: GTFSSource
+            GTFS source to read shapes.txt from
+        """
+        self.shape_ids = []
+        self.index = {}
+
+        shape_rows = array("i")
+        self.sequences = array("i")
+        self.lons = array("d")
+        self.lats = array("d")
+
+        columns = ["shape_id", "shape_pt_lat", "shape_pt_lon",
+                   "shape_pt_sequence"]
+        for shape_id, lat, lon, sequence in source.rows("shapes.txt",
+                                                        columns):
+            if shape_id not in self.index:
+                self.index[shape_id] = len(self.shape_ids)
+                self.shape_ids.append(shape_id)
+
+            shape_rows.append(self.index[shape_id])
+            self.lats.append(float(lat))
+            self.lons.append(float(lon))
+            self.sequences.append(int(sequence))
+
+        self.offsets = _group_rows(shape_rows, self.sequences,
+                                   [self.lats, self.lons],
+                                   len(self.shape_ids))
+
+    def get_range(self, shape_row):
+        """ Returns the range of rows of the points of a shape.
+
+        Arguments
+        ---------
+        shape_row: int
+            Row index of the shape
+
+        Returns
+        -------
+        xrange
+            Range of rows of the points of the shape, in sequence order
+        """
+        return xrange(self.offsets[shape_row], self.offsets[shape_row + 1])
+
+    def __len__(self):
+        return len(self.shape_ids)
+
+
+class RouteIndex:
+    """ RouteIndex class.
+
+    Lookup table of the route of each shape and the color of each route.
+    Shapes are matched to the route of the trips that run along them in
+    trips.txt, rather than by their IDs, so that shapes are matched
+    correctly even when routes share a first character (such as the G and
+    the GS shuttle).
+    """
+    def __init__(self, routes, trips=None):
+        """ Constructor.
+
+        Arguments
+        ---------
+        routes: RouteTable
+            Table of routes
+        trips: TripTable
+            Table of trips; if not given, only route colors are looked up
+        """
+        self.route_colors = {
+            route_id: "#" + color
+            for route_id, color in zip(routes.route_ids, routes.colors)
+        }
+
+        # Map of shape ID -> map of route ID -> number of trips of the route
+        # along the shape
+        route_counts = {}
+        if trips is not None:
+            for shape_id, route_id in zip(trips.shape_ids, trips.route_ids):
+                if shape_id:
+                    counts = route_counts.setdefault(shape_id, {})
+                    counts[route_id] = counts.get(route_id, 0) + 1
+
+        # A shape may occasionally be used by trips of another route (for
+        # instance due to a reroute), so each shape is matched to the route
+        # with the most trips along it, and ties go to the smallest route ID.
+        self.shape_routes = {
+            shape_id: min(counts.iteritems(),
+                          key=lambda route_count: (-route_count[1],
+                                                   route_count[0]))[0]
+            for shape_id, counts in route_counts.iteritems()
+        }
+
+    def get_route(self, shape_id):
+        """ Returns the route of a shape.
+
+        Shapes that no trip runs along are matched to the route named by the
+        prefix of their shape ID (e.g. 1..N03R and GS.S01R), if any.
+
+        Arguments
+        ---------
+        shape_id: str
+            Shape ID
+
+        Returns
+        -------
+        str
+            Route ID of the shape, or None if no route was found
+        """
+        if shape_id in self.shape_routes:
+            return self.shape_routes[shape_id]
+
+        route_id = shape_id.split(".", 1)[0]
+        return route_id if route_id in self.route_colors else None
+
+    def get_color(self, shape_id):
+        """ Returns the color of the route of a shape.
+
+        Arguments
+        ---------
+        shape_id: str
+            Shape ID
+
+        Returns
+        -------
+        str
+            Color of the route of the shape (e.g. #EE352E), or an empty
+            string if no route was found
+        """
+        return self.route_colors.get(self.get_route(shape_id), "")
+
+
+# Tables loaded from the static GTFS files, along with the route index built
+# from the routes (and trips, if loaded); tables that are not needed for a
+# particular build are left as None.
+StaticFeed = namedtuple('StaticFeed',
+                        ['stops', 'routes', 'trips', 'stop_times', 'shapes',
+                         'route_index'])
+
+
+def load_static_feed(source, tables):
+    """ Loads the requested tables of a static GTFS feed.
+
+    Each file is streamed row by row into its columnar table, and the wall
+    time and peak memory of loading each table is reported.
+
+    Arguments
+    ---------
+    source: GTFSSource
+        GTFS source to read from
+    tables: set[str]
+        Names of the tables to load (fields of StaticFeed, other than
+        route_index, which is built whenever routes are loaded); tables
+        that others depend on (e.g. stops and trips for stop_times) are
+        loaded as needed
+
+    Returns
+    -------
+    StaticFeed
+        Loaded tables
+    """
+    if "stop_times" in tables:
+        tables = tables | set(["stops", "trips"])
+
+    loaded = dict.fromkeys(StaticFeed._fields)
+
+    for table, table_class in [("stops", StopTable), ("routes", RouteTable),
+                               ("trips", TripTable), ("shapes", ShapeTable)]:
+        if table in tables:
+            with build_stage("Loading {}.txt".format(table)):
+                loaded[table] = table_class(source)
+
+    if "stop_times" in tables:
+        with build_stage("Loading stop_times.txt"):
+            loaded["stop_times"] = StopTimeTable(source, loaded["trips"],
+                                                 loaded["stops"])
+
+    if "routes" in tables:
+        with build_stage("Indexing routes"):
+            loaded["route_index"] = RouteIndex(loaded["routes"],
+                                               loaded["trips"])
+
+    return StaticFeed(**loaded)
@@ -0,0 +1,155 @@
+""" Benchmarks making frames of the live feeds from recorded snapshots.
+
+Replays snapshots of every feed through a FrameBuilder, as the feed poller
+would hand them over, round by round (the first snapshot of every feed,
+then the second, and so on), and prints the median time taken by each
+round and by the slowest feed of the round. The first round includes
+finding the chain of segments between the stations of every train, which
+later rounds reuse.
+
+Every new frame is also encoded to JSON both as a delta from the previous
+frame, as sent to subscribed clients, and as a keyframe, as sent to new
+subscribers; the total size and median encoding time of each are printed
+per round.
+
+Snapshots are read from files named N.pb or N-*.pb for feed ID N, as
+recorded for scripts/feed_standin.py. The static files are read from the
+cache directory, as built by static.py.
+
+Usage (from the repository root):
+
+    python scripts/bench_frames.py recorded/ [-c .cache/] [-r 10]
+"""
+import glob
+import os
+import sys
+import time
+
+from argparse import ArgumentParser
+
+import simplejson as json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import gtfs_realtime_pb2 as gtfs  # noqa: E402
+from geometry import ShapeStore  # noqa: E402
+from realtime import FrameBuilder  # noqa: E402
+from transit import PrevStops, StopGraph  # noqa: E402
+
+
+def load_snapshots(payload_dir):
+    """ Returns the recorded snapshots of every feed.
+
+    Arguments
+    ---------
+    payload_dir: str
+        Directory of the recorded snapshots
+
+    Returns
+    -------
+    dict[int -> list[transit_realtime.FeedMessage]]
+        Map of feed ID -> snapshots of the feed, in name order
+    """
+    snapshots = {}
+    for path in sorted(glob.glob(os.path.join(payload_dir, "*.pb"))):
+        feed_id = int(os.path.basename(path).split(".")[0].split("-")[0])
+        with open(path, "rb") as payload_f:
+            feed_message = gtfs.FeedMessage()
+            feed_message.ParseFromString(payload_f.read())
+
+        snapshots.setdefault(feed_id, []).append(feed_message)
+
+    return snapshots
+
+
+def replay(builder, snapshots):
+    """ Replays snapshots through a frame builder, round by round.
+
+    Arguments
+    ---------
+    builder: FrameBuilder
+        Frame builder
+    snapshots: dict[int -> list[transit_realtime.FeedMessage]]
+        Map of feed ID -> snapshots of the feed
+
+    Returns
+    -------
+    list[tuple]
+        Number of trains of the last frame, time taken, time taken by the
+        slowest feed, time taken to encode the deltas of the frames, and
+        to encode the keyframes of the frames, then size of the deltas, and
+        of the keyframes, of each round
+    """
+    rounds = []
+    for i in xrange(max(len(messages) for messages in snapshots.values())):
+        feed_times = []
+        encode_times = [0, 0]
+        sizes = [0, 0]
+        for feed_id in sorted(snapshots):
+            if i < len(snapshots[feed_id]):
+                previous = builder.frame
+                start = time.time()
+                frame = builder.process_feed(feed_id, snapshots[feed_id][i])
+                feed_times.append(time.time() - start)
+
+                for j, encode in enumerate([
+                        lambda: frame.get_delta(previous),
+                        frame.get_keyframe]):
+                    start = time.time()
+                    sizes[j] += len(json.dumps(encode(),
+                                               separators=(",", ":")))
+                    encode_times[j] += time.time() - start
+
+        rounds.append(tuple([len(frame), sum(feed_times), max(feed_times)] +
+                            encode_times + sizes))
+
+    return rounds
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("payload_dir",
+                        help="Directory of the recorded snapshots")
+    parser.add_argument("-c", "--cache", default=".cache/",
+                        help="Directory of the static files")
+    parser.add_argument("-r", "--repeat", type=int, default=10,
+                        help="Number of times to replay the snapshots")
+    args = parser.parse_args()
+
+    snapshots = load_snapshots(args.payload_dir)
+    if not snapshots:
+        parser.error("no snapshots in " + args.payload_dir)
+
+    prev_stops = PrevStops(os.path.join(args.cache, "prev_stops.bin"))
+    graph = StopGraph(os.path.join(args.cache, "graph.bin"))
+    shapes = ShapeStore(os.path.join(args.cache, "shapes.bin"))
+
+    # Every replay starts from a new builder, so that the first round
+    # always looks up the paths of the segments anew
+    replays = [replay(FrameBuilder(prev_stops, graph, shapes), snapshots)
+               for _ in xrange(args.repeat)]
+
+    vehicles = [
+        sum(1 for entity in messages[i].entity if entity.HasField("vehicle"))
+        for messages in snapshots.values() for i in xrange(len(messages))
+    ]
+    print "{} feeds, {} snapshots, {:.0f} vehicles per round".format(
+        len(snapshots), len(vehicles),
+        float(sum(vehicles)) / len(replays[0]))
+
+    print
+    print "{:<8}{:>8}{:>10}{:>12}{:>10}{:>10}{:>10}{:>10}".format(
+        "round", "trains", "total ms", "slowest ms", "delta ms", "key ms",
+        "delta KB", "key KB")
+    for i in xrange(len(replays[0])):
+        results = zip(*[rounds[i] for rounds in replays])[1:5]
+        medians = [sorted(times)[len(times) // 2] * 1000
+                   for times in results]
+        sizes = [size / 1024.0 for size in replays[0][i][5:]]
+        print "{:<8}{:>8}{:>10.2f}{:>12.2f}{:>10.2f}{:>10.2f}{:>10.1f}" \
+            "{:>10.1f}".format(i, replays[0][i][0], *(medians + sizes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+""" Benchmarks loading the graph and previous stops from their packed files
+against loading the same data from pickles, as static.py used to write them.
+
+Builds both from a static feed into a temporary directory, then times each
+load (in a fresh state, but with the files in the OS page cache) a number of
+times and prints the median. The packed files are also timed with a lookup
+of every edge of the graph, since their contents are only read on access.
+
+Usage (from the repository root):
+
+    python scripts/bench_static_load.py [-s transit_files/] [-r 10]
+"""
+import cPickle as pickle
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from builders import PrevStopsBuilder, StopGraphBuilder  # noqa: E402
+from builders import build_static_files  # noqa: E402
+from schedule import GTFSSource, load_static_feed  # noqa: E402
+from transit import PrevStops, StopGraph  # noqa: E402
+
+
+def time_load(load, repeat):
+    """ Returns the median time taken by a load function.
+
+    Arguments
+    ---------
+    load: function
+        Function loading a file
+    repeat: int
+        Number of times to time the function
+
+    Returns
+    -------
+    float
+        Median time, in seconds
+    """
+    times = []
+    for _ in xrange(repeat):
+        start = time.time()
+        load()
+        times.append(time.time() - start)
+
+    return sorted(times)[len(times) // 2]
+
+
+def load_pickle(path):
+    with open(path, "rb") as pickle_f:
+        return pickle.load(pickle_f)
+
+
+def lookup_edges(graph):
+    keys = graph._packed.section("keys")
+    stations = graph._packed.metadata["stations"]
+    for key in keys:
+        graph._find_edge(stations[key // len(stations)],
+                         stations[key % len(stations)])
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-s", "--source", default="transit_files/",
+                        help="Static GTFS directory or zip file")
+    parser.add_argument("-r", "--repeat", type=int, default=10,
+                        help="Number of times to time each load")
+    args = parser.parse_args()
+
+    tables = StopGraphBuilder.tables | PrevStopsBuilder.tables
+    feed = load_static_feed(GTFSSource(args.source), tables)
+
+    bench_dir = tempfile.mkdtemp()
+    try:
+        graph_builder = StopGraphBuilder(feed)
+        graph_builder.path = os.path.join(bench_dir, "graph.bin")
+        prev_stops_builder = PrevStopsBuilder(feed)
+        prev_stops_builder.path = os.path.join(bench_dir, "prev_stops.bin")
+        build_static_files(feed, {"graph": graph_builder,
+                                  "prev_stops": prev_stops_builder})
+
+        # The pickles hold the tables static.py used to pickle: the edges of
+        # the graph, and the Stop objects and ambiguous stop sequences of the
+        # previous stops (although now keyed by interned integers rather
+        # than by strings, which only makes them faster to unpickle)
+        all_prev_stops = prev_stops_builder._all_prev_stops
+        ambiguous_stop_sequences = \
+            prev_stops_builder._get_ambiguous_stop_sequences(
+                PrevStops._get_ambiguous_trip_paths(all_prev_stops))
+        pickles = {
+            "graph": graph_builder._edges,
+            "prev_stops": (all_prev_stops, ambiguous_stop_sequences)
+        }
+        for name, data in pickles.iteritems():
+            with open(os.path.join(bench_dir, name + ".pkl"), "wb") as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+
+        results = [
+            ("graph.pkl", lambda: load_pickle(
+                os.path.join(bench_dir, "graph.pkl"))),
+            ("graph.bin", lambda: StopGraph(graph_builder.path)),
+            ("graph.bin + every edge", lambda: lookup_edges(
+                StopGraph(graph_builder.path))),
+            ("prev_stops.pkl", lambda: load_pickle(
+                os.path.join(bench_dir, "prev_stops.pkl"))),
+            ("prev_stops.bin", lambda: PrevStops(prev_stops_builder.path)),
+        ]
+
+        print
+        for name, load in results:
+            path = os.path.join(bench_dir, name.split(" ")[0])
+            print "{:<24}{:>10.1f} KB{:>12.2f} ms".format(
+                name, os.path.getsize(path) / 1024.0,
+                time_load(load, args.repeat) * 1000)
+    finally:
+        shutil.rmtree(bench_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+""" Local stand-in for the MTA's realtime feed server, for testing the feed
+poller without an MTA key or network access.
+
+Serves recorded protobuf payloads from a directory: a request for feed_id N
+is answered with the files named N.pb or N-*.pb (in name order, cycling
+through them on every request, so that a sequence of recordings plays back
+as a live feed would). Payloads can be recorded with e.g.
+
+    curl "http://datamine.mta.info/mta_esi.php?key=KEY&feed_id=1" > 1-00.pb
+
+Responses have an ETag and a Last-Modified header (unless --no-validators is
+given, to test a server without them), and conditional requests of a
+payload that has not changed are answered with 304 Not Modified. Responses
+of some feeds can be delayed, or answered with an error, to test how the
+poller handles slow and failing feeds.
+
+Usage (from the repository root):
+
+    python scripts/feed_standin.py recorded/ [-p 8000] [-d 16:15] [-e 2] [-n]
+
+then poll http://localhost:8000/mta_esi.php instead of MTA_ENDPOINT (see
+feed.FeedPoller).
+"""
+import glob
+import hashlib
+import os
+import time
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from argparse import ArgumentParser
+from email.utils import formatdate
+from urlparse import parse_qs, urlparse
+
+
+class StandinServer(ThreadingMixIn, HTTPServer):
+    """ StandinServer class.
+
+    Threaded HTTP server of recorded feed payloads (so that a delayed feed
+    does not hold up the others, as with the real server).
+    """
+    daemon_threads = True
+
+    def __init__(self, address, payload_dir, delays, errors,
+                 validators=True):
+        """ Constructor.
+
+        Arguments
+        ---------
+        address: tuple[str, int]
+            Host and port to serve on
+        payload_dir: str
+            Directory of the recorded payloads
+        delays: dict[str -> float]
+            Map of feed ID -> seconds to delay each response of the feed by
+        errors: set[str]
+            IDs of the feeds to answer with an error
+        validators: bool
+            Whether to send ETag and Last-Modified headers
+        """
+        HTTPServer.__init__(self, address, StandinHandler)
+        self.payload_dir = payload_dir
+        self.delays = delays
+        self.errors = errors
+        self.validators = validators
+
+        # Map of feed ID -> number of requests of the feed so far
+        self.requests = {}
+
+    def get_payload(self, feed_id):
+        """ Returns the next recorded payload of a feed.
+
+        Arguments
+        ---------
+        feed_id: str
+            Feed ID
+
+        Returns
+        -------
+        tuple[str, str]
+            Path and contents of the payload, or None if none was recorded
+            for the feed
+        """
+        paths = sorted(
+            glob.glob(os.path.join(self.payload_dir, feed_id + ".pb")) +
+            glob.glob(os.path.join(self.payload_dir, feed_id + "-*.pb"))
+        )
+        if not paths:
+            return None
+
+        count = self.requests.get(feed_id, 0)
+        self.requests[feed_id] = count + 1
+
+        path = paths[count % len(paths)]
+        with open(path, "rb") as payload_f:
+            return path, payload_f.read()
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """ StandinHandler class.
+
+    Answers GET requests of the form /mta_esi.php?key=...&feed_id=...
+    """
+    def do_GET(self):
+        feed_id = parse_qs(urlparse(self.path).query).get("feed_id", [""])[0]
+        time.sleep(self.server.delays.get(feed_id, 0))
+
+        payload = self.server.get_payload(feed_id)
+        if feed_id in self.server.errors or payload is None:
+            self.send_error(503 if payload is not None else 404)
+            return
+
+        path, payload = payload
+        etag = '"{}"'.format(hashlib.sha1(payload).hexdigest())
+        last_modified = formatdate(os.path.getmtime(path), usegmt=True)
+
+        # As in RFC 7232, If-Modified-Since is ignored given If-None-Match
+        if "If-None-Match" in self.headers:
+            not_modified = self.headers["If-None-Match"] == etag
+        else:
+            not_modified = \
+                self.headers.get("If-Modified-Since") == last_modified
+
+        if self.server.validators and not_modified:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(payload)))
+        if self.server.validators:
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("payload_dir",
+                        help="Directory of the recorded payloads")
+    parser.add_argument("-p", "--port", type=int, default=8000,
+                        help="Port to serve on")
+    parser.add_argument("-d", "--delay", action="append", default=[],
+                        metavar="FEED_ID:SECONDS",
+                        help="Delay each response of a feed")
+    parser.add_argument("-e", "--error", action="append", default=[],
+                        metavar="FEED_ID",
+                        help="Answer every request of a feed with an error")
+    parser.add_argument("-n", "--no-validators", action="store_true",
+                        help="Send no ETag or Last-Modified headers")
+    args = parser.parse_args()
+
+    delays = {}
+    for delay in args.delay:
+        feed_id, seconds = delay.split(":")
+        delays[feed_id] = float(seconds)
+
+    server = StandinServer(("localhost", args.port), args.payload_dir,
+                           delays, set(args.error), not args.no_validators)
+    print "Serving {} on port {}...".format(args.payload_dir, args.port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,20 @@
 "use strict";
 
-const SPEED = 60;
-const DURATION = 30;
-const TOTAL_FRAMERATE = SPEED * DURATION;
-const INTERVAL = 1000 / SPEED;
 const SAMPLE_POINTS = 20;
 
+// Number of decimals of the coordinates of the polylines of the segments
+const POLYLINE_PRECISION = 6;
+
+// Maximum number of segment IDs asked for at once from /segments (see
+// MAX_SEGMENT_IDS in app.py)
+const MAX_SEGMENT_IDS = 500;
+
+// Zooms the map tiles of the lines and stops are cut at, and their width in
+// pixels (see MIN_TILE_ZOOM, MAX_TILE_ZOOM and TILE_SIZE in tiles.py)
+const MIN_TILE_ZOOM = 12;
+const MAX_TILE_ZOOM = 16;
+const TILE_SIZE = 256;
+
 const DB_NAME = "LIVESUBWAY_DB";
 const DB_ROUTES_STORE = "ROUTES_STORE";
 const DB_STOPS_STORE = "STOPS_STORE";
@@ -32,93 +41,271 @@ const MAPBOX = {
   zoom: 10.84,
 };
 
-const LAYER = {
-  id: "subwayCars",
-  type: "circle",
-  source: "subwayCars",
-  paint: {
-    "circle-radius": 4,
-    "circle-color": "#000000",
-  },
+// Style of the markers of the trains, which are filled with the color of
+// their route
+const TRAIN_STYLE = {
+  radius: 4,
+  weight: 1,
+  color: "#000000",
+  fillOpacity: 1,
 };
 
-const animateTrains = (map, subwayCars) => {
-  const lineTuple = subwayCars.map(subwayCar => {
-    const line = {
-      type: "Feature",
-      geometry: {
-        type: "LineString",
-        coordinates: subwayCar.path,
-      },
-    };
+// Returns a path of points in the form [lon, lat], along with the distance
+// of each point from the start of the path. Distances are in degrees of
+// latitude, with longitudes scaled at the latitude of each line, which is
+// close enough at the scale of a city to place trains along their paths.
+const getPath = points => {
+  const distances = [0];
+  for (let i = 1; i < points.length; i++) {
+    const [before, after] = [points[i - 1], points[i]];
+    const scale = Math.cos((before[1] + after[1]) / 2 * Math.PI / 180);
+    distances.push(distances[i - 1] + Math.hypot(
+      (after[0] - before[0]) * scale, after[1] - before[1]));
+  }
+
+  return {points, distances};
+};
 
-    const distance = turf.lineDistance(line, "miles");
-    const distanceTraveled = subwayCar.progress * distance;
+// Returns the point at a distance along a chain of paths, interpolated
+// linearly between the points around it
+const getPointAlong = (paths, distance) => {
+  for (let i = 0; i < paths.length; i++) {
+    const {points, distances} = paths[i];
+    const length = distances[distances.length - 1];
+    if (distance > length && i < paths.length - 1) {
+      distance -= length;
+      continue;
+    }
 
-    return [line, distance, distanceTraveled, subwayCar.remaining_time];
-  });
+    const j = distances.findIndex(pointDistance => pointDistance > distance);
+    if (j === -1) {
+      return points[points.length - 1];
+    }
+    if (j === 0) {
+      return points[0];
+    }
 
-  const points = lineTuple.map(x => {
-    return turf.along(x[0], x[2], "miles");
-  });
+    const fraction = (distance - distances[j - 1]) /
+      (distances[j] - distances[j - 1]);
+    const [before, after] = [points[j - 1], points[j]];
 
-  const allAnimSteps = lineTuple.map(x => {
-    const [line, d, dT, rT] = x;
-    const remainingDistance = d - dT;
-    const animSpeed = SPEED * rT;
-    const animFrames = SPEED * Math.min(DURATION, rT);
+    return [
+      before[0] + fraction * (after[0] - before[0]),
+      before[1] + fraction * (after[1] - before[1]),
+    ];
+  }
+};
+
+// Returns the fraction of its path a train has covered at a POSIX time in
+// seconds (such as Date.now() / 1000). Trains are taken to cover their path
+// at a constant speed from when they left its start until they are
+// predicted to arrive at its end (see Train in realtime.py); trains with no
+// prediction stay at the start.
+const getFraction = (subwayCar, now) => {
+  const {departure, arrival} = subwayCar;
+  if (arrival === null) {
+    return 0;
+  }
+  if (arrival <= departure) {
+    return 1;
+  }
+
+  return Math.min(1, Math.max(0, (now - departure) / (arrival - departure)));
+};
 
-    return [...Array(TOTAL_FRAMERATE).keys()].map((x, i) => {
-      const distance = i < animFrames ? dT + (i / animSpeed) * remainingDistance : d;
+// Returns the position of a train at a POSIX time in seconds
+const getPositionAt = (subwayCar, now) => {
+  const {paths} = subwayCar;
+  const length = paths.reduce(
+    (total, path) => total + path.distances[path.distances.length - 1], 0);
 
-      const segment = turf.along(line, distance, "miles");
+  return getPointAlong(paths, getFraction(subwayCar, now) * length);
+};
 
-      return segment.geometry.coordinates;
+// Adds the layer of the trains to the map, and animates it: on every
+// animation frame (as often as the browser repaints, and not at all while
+// the page is hidden), each train is moved to its position along its path
+// at the time. Returns the function to call with the trains to show (as
+// getSubwayCars returns them) whenever they change; markers are kept by trip
+// ID, so that trains still shown are moved rather than drawn anew.
+const animateTrains = map => {
+  const renderer = L.canvas();
+  const layer = L.layerGroup().addTo(map);
+  let markers = {};
+  let subwayCars = [];
+
+  const moveTrains = now => {
+    subwayCars.forEach(subwayCar => {
+      const [lon, lat] = getPositionAt(subwayCar, now);
+      const marker = markers[subwayCar.tripId];
+      const latLng = marker.getLatLng();
+
+      // Trains that are waiting to leave, or have arrived, stay put
+      if (latLng.lat !== lat || latLng.lng !== lon) {
+        marker.setLatLng([lat, lon]);
+      }
     });
-  });
+  };
 
-  const source = {
-    type: "geojson",
-    data: {
-      type: "FeatureCollection",
-      features: points,
-    },
+  const animate = () => {
+    moveTrains(Date.now() / 1000);
+    requestAnimationFrame(animate);
   };
 
-  // const start = Date.now();
+  requestAnimationFrame(animate);
 
-  // let then = start;
-  // let counter = 0;
+  return newSubwayCars => {
+    const newMarkers = {};
+    newSubwayCars.forEach(subwayCar => {
+      const {tripId, route} = subwayCar;
+      if (tripId in markers) {
+        newMarkers[tripId] = markers[tripId];
+        delete markers[tripId];
+      } else {
+        const [lon, lat] = getPositionAt(subwayCar, Date.now() / 1000);
+        newMarkers[tripId] = L.circleMarker([lat, lon], Object.assign({
+          renderer,
+          fillColor: SUBWAY_COLORS[route],
+        }, TRAIN_STYLE)).addTo(layer);
+      }
+    });
+
+    Object.values(markers).forEach(marker => {
+      layer.removeLayer(marker);
+    });
+
+    markers = newMarkers;
+    subwayCars = newSubwayCars;
+    moveTrains(Date.now() / 1000);
+  };
+};
+
+// Applies a frame sent by the server (a keyframe, or a delta from the
+// previous frame) to the trains received so far. Returns false if the frame
+// is a delta from a frame that was not received.
+const applyFrame = (feed, frame) => {
+  if (frame.base !== null && frame.base !== feed.seq) {
+    return false;
+  }
 
-  // const animate = () => {
-  //   if (counter / INTERVAL < (SPEED * DURATION) - 1) {
-  //     const now = Date.now();
-  //     const elapsed = now - then;
+  if (frame.base === null) {
+    feed.trains = {};
+  }
 
-  //     then = now;
+  Object.assign(feed.trains, frame.trains);
+  frame.removed.forEach(tripId => {
+    delete feed.trains[tripId];
+  });
 
-  //     points.forEach((point, i) => {
-  //       const animSteps = allAnimSteps[i];
+  feed.seq = frame.seq;
 
-  //       point.geometry.coordinates = animSteps[Math.round(elapsed / INTERVAL)];
-  //     });
+  return true;
+};
 
-  //     map.getSource("subwayCars").setData({
-  //       type: "FeatureCollection",
-  //       features: points,
-  //     });
+// Decodes a polyline encoded by encode_polyline (in geometry.py) into a list of
+// coordinates in the form [lon, lat]
+const decodePolyline = encoded => {
+  const factor = Math.pow(10, POLYLINE_PRECISION);
+  const points = [];
+  const coords = [0, 0];
+  let index = 0;
+
+  while (index < encoded.length) {
+    for (let i = 0; i < 2; i++) {
+      let value = 0;
+      let shift = 0;
+      let chunk;
+
+      do {
+        chunk = encoded.charCodeAt(index++) - 63;
+        value |= (chunk & 0x1f) << shift;
+        shift += 5;
+      } while (chunk >= 0x20);
+
+      coords[i] += value & 1 ? ~(value >> 1) : value >> 1;
+    }
 
-  //     counter += elapsed;
+    points.push([coords[1] / factor, coords[0] / factor]);
+  }
 
-  //     requestAnimationFrame(animate);
-  //   } else {
-  //     const animTime = ((Date.now() - start) / 1000).toString();
+  return points;
+};
 
-  //     console.log(`Time elapsed for animation: ${animTime}`);
-  //   }
-  // };
+// Returns the trains of the feed whose segments have all been fetched, in
+// the form the function returned by animateTrains takes
+const getSubwayCars = (feed, segments) => {
+  return Object.keys(feed.trains).filter(tripId => {
+    return feed.trains[tripId].segments.every(segmentId => {
+      return segmentId in segments.paths;
+    });
+  }).map(tripId => {
+    const train = feed.trains[tripId];
+
+    return {
+      tripId,
+      route: train.route,
+      paths: train.segments.map(segmentId => segments.paths[segmentId]),
+      departure: train.departure,
+      arrival: train.arrival,
+    };
+  });
+};
 
-  // animate();
+// Forgets the paths of the segments fetched so far if the segment IDs of
+// the frames have changed (the graph or the shapes were rebuilt)
+const setSegmentsVersion = (segments, version) => {
+  if (segments.version !== version) {
+    segments.version = version;
+    segments.paths = {};
+    segments.pending = {};
+  }
+};
+
+// Fetches the paths of the segments not fetched yet (or being fetched)
+// among some segment IDs, at most MAX_SEGMENT_IDS at a time, and calls done
+// once they have all arrived (if any were missing). Responses of the current
+// version can be cached by the browser for good, as segment IDs are stable
+// within a version.
+const fetchSegments = (fetcher, segments, segmentIds, done) => {
+  const missing = Array.from(new Set(segmentIds)).filter(segmentId => {
+    return !(segmentId in segments.paths) && !(segmentId in segments.pending);
+  });
+  if (missing.length === 0) {
+    return;
+  }
+
+  const fetches = [];
+  for (let i = 0; i < missing.length; i += MAX_SEGMENT_IDS) {
+    const batch = missing.slice(i, i + MAX_SEGMENT_IDS);
+    const version = segments.version;
+    batch.forEach(segmentId => {
+      segments.pending[segmentId] = true;
+    });
+
+    fetches.push(new Promise((resolve) => {
+      fetcher(`/segments?ids=${batch.join(",")}&v=${version}&format=polyline`, (data) => {
+        // Paths of another version are of no use (and the pending segments
+        // were already forgotten)
+        if (data.version === segments.version) {
+          Object.keys(data.segments).forEach(segmentId => {
+            segments.paths[segmentId] = getPath(
+              decodePolyline(data.segments[segmentId]));
+            delete segments.pending[segmentId];
+          });
+        }
+        resolve();
+      }, () => {
+        if (version === segments.version) {
+          batch.forEach(segmentId => {
+            delete segments.pending[segmentId];
+          });
+        }
+        resolve();
+      });
+    }));
+  }
+
+  Promise.all(fetches).then(done);
 };
 
 const getJSON = (path, success, fail) => {
@@ -138,66 +325,100 @@ const getJSON = (path, success, fail) => {
   xmlhttp.send();
 };
 
-const fetchMap = (fetcher, map, routes, finish) => {
-  const renderRoutes = (routesData, cb) => {
-    const linesLayer = new L.geoJson(routesData).addTo(map);
+const getTileZoom = (zoom) => {
+  return Math.min(MAX_TILE_ZOOM, Math.max(MIN_TILE_ZOOM, Math.floor(zoom)));
+};
 
-    linesLayer.setStyle((feature) => {
+const renderTile = (tileData) => {
+  return L.geoJson(tileData, {
+    filter: (feature) => {
+      return feature.geometry.type !== "Point" ||
+        feature.properties.name.toLowerCase().indexOf("2 av") === -1;
+    },
+    style: (feature) => {
       return {
         "weight": 3,
         "opacity": 1,
         "color": SUBWAY_COLORS[feature.properties.route_id]
       };
-    });
-
-    cb();
-  };
-
-  const routePromise = new Promise((resolve, reject) => {
-    fetcher("/map_geojson", (stopData) => {
-      renderRoutes(stopData, resolve);
-    }, reject);
+    },
+    pointToLayer: (feature, latlng) => {
+      return L.marker(latlng, {
+        icon: L.divIcon({
+          html: SUBWAY_ICON
+        })
+      });
+    },
+    onEachFeature: (feature, layer) => {
+      if (feature.geometry.type === "Point") {
+        layer.bindPopup(`<strong>${feature.properties.name}</strong>`);
+        layer.on("mouseover", e => {
+          layer.openPopup();
+        });
+      }
+    },
   });
+};
 
-  const renderStops = (stopData, cb) => {
-    const stops = Object.entries(stopData).filter(([_, stopVal]) => {
-      return stopVal.name.toLowerCase().indexOf("2 av") === -1;
-    }).map(([_, stopVal]) => stopVal);
-
-    const stopNames = stops.map(stopVal => stopVal.name);
-
-    const subwayMarkers = stops.map(stopVal => {
-      const stopMarker = L.divIcon({
-        html: SUBWAY_ICON
-      });
+const fetchTiles = (fetcher, map, finish) => {
+  // Layer of the tiles of each zoom, and the tiles fetched (or being
+  // fetched) so far, by "x/y"
+  const tileZooms = {};
+  let shownZoom = null;
+
+  const fetchVisibleTiles = (done) => {
+    const zoom = getTileZoom(map.getZoom());
+    if (!(zoom in tileZooms)) {
+      tileZooms[zoom] = {
+        layer: L.layerGroup(),
+        tiles: {},
+      };
+    }
 
-      return L.marker(stopVal.coordinates, {
-        icon: stopMarker
-      });
-    });
+    const tileZoom = tileZooms[zoom];
+    if (shownZoom !== zoom) {
+      if (shownZoom !== null) {
+        map.removeLayer(tileZooms[shownZoom].layer);
+      }
 
-    L.layerGroup(subwayMarkers).addTo(map);
+      tileZoom.layer.addTo(map);
+      shownZoom = zoom;
+    }
 
-    subwayMarkers.forEach((marker, index) => {
-      marker.bindPopup(`<strong>${stopNames[index]}</strong>`);
-      marker.on("mouseover", e => {
-        marker.openPopup();
-      });
-    });
+    // Tiles are TILE_SIZE pixels wide at their own zoom
+    const bounds = map.getPixelBounds();
+    const scale = Math.pow(2, zoom - map.getZoom()) / TILE_SIZE;
+
+    const fetches = [];
+    for (let x = Math.floor(bounds.min.x * scale); x <= Math.floor(bounds.max.x * scale); x++) {
+      for (let y = Math.floor(bounds.min.y * scale); y <= Math.floor(bounds.max.y * scale); y++) {
+        const key = `${x}/${y}`;
+        if (key in tileZoom.tiles) {
+          continue;
+        }
+
+        tileZoom.tiles[key] = true;
+        fetches.push(new Promise((resolve) => {
+          fetcher(`/tiles/${zoom}/${key}.json`, (tileData) => {
+            renderTile(tileData).addTo(tileZoom.layer);
+            resolve();
+          }, () => {
+            delete tileZoom.tiles[key];
+            resolve();
+          });
+        }));
+      }
+    }
 
-    cb();
+    Promise.all(fetches).then(done);
   };
 
-  const stopPromise = new Promise((resolve, reject) => {
-    fetcher("/stops_json", (stopData) => {
-      renderStops(stopData, resolve);
-    }, reject);
+  // Zooming also ends with a moveend
+  map.on("moveend", () => {
+    fetchVisibleTiles(() => {});
   });
 
-  Promise.all([routePromise, stopPromise])
-    .then(() => {
-      finish();
-    }).catch(() => {});
+  fetchVisibleTiles(finish);
 };
 
 class MapDB {
@@ -258,7 +479,7 @@ document.addEventListener("DOMContentLoaded", () => {
   const socket = io.connect("localhost:5000");
 
   // if (!indexedDB) {
-  fetchMap(getJSON, map, SUBWAY_ROUTES, () => {
+  fetchTiles(getJSON, map, () => {
     socket.emit("get_feed");
   });
   // } else {
@@ -267,7 +488,53 @@ document.addEventListener("DOMContentLoaded", () => {
 
   socket.emit("get_feed");
 
-  socket.on("feed", subwayCars => {
-    animateTrains(map, subwayCars);
+  // Trains of the latest frame received, by trip ID
+  const feed = {
+    seq: null,
+    trains: {},
+    resyncing: false,
+  };
+
+  // Paths of the segments the trains are on, by segment ID, and the
+  // segments being fetched
+  const segments = {
+    version: null,
+    paths: {},
+    pending: {},
+  };
+
+  const showTrains = animateTrains(map);
+
+  socket.on("feed", frame => {
+    if (!applyFrame(feed, frame)) {
+      // A frame was missed, so ask for the whole frame again (once, until
+      // it arrives)
+      if (!feed.resyncing) {
+        feed.resyncing = true;
+        socket.emit("get_feed");
+      }
+
+      return;
+    }
+
+    feed.resyncing = false;
+    if (frame.base === null) {
+      setSegmentsVersion(segments, frame.segments_version);
+    }
+
+    // Trains on segments that have not been fetched yet are shown once
+    // their segments arrive
+    const segmentIds = [].concat(...Object.values(frame.trains).map(train => {
+      return train.segments;
+    }));
+    fetchSegments(getJSON, segments, segmentIds, () => {
+      showTrains(getSubwayCars(feed, segments));
+    });
+    showTrains(getSubwayCars(feed, segments));
+  });
+
+  // Subscriptions do not outlast a connection
+  socket.on("reconnect", () => {
+    socket.emit("get_feed");
   });
 });
\ No newline at end of file
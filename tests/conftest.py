@@ -0,0 +1,146 @@
+""" Fixtures shared by the tests: the static files built from a tiny GTFS
+feed, written out by write_gtfs.
+
+The feed has five stations, 101 to 105, 800 m apart from south to north on
+a straight line, each with a northbound (N) and a southbound (S) stop, and
+a sixth station, 106, that no trip stops at:
+
+    route 1 (local, weekdays): 101-102-103-104-105 both ways
+    route 2 (express, weekdays): 101-103-105 northbound
+    route 1 (Saturdays): 101-102-104-105 (1..N02R, at 04:00) and
+        101-103-104-105 (1..N03R, at 08:00) northbound, so that the
+        previous stop of 104N at stop sequence 3 depends on the trip
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+LON = -73.96
+
+# List of tuples of (station ID, latitude) of the stations of the feed
+STATIONS = [("101", 40.800), ("102", 40.807), ("103", 40.814),
+            ("104", 40.821), ("105", 40.828), ("106", 40.900)]
+
+# List of tuples of (route ID, service ID, trip ID, shape ID, stations) of
+# the trips of the feed
+TRIPS = [
+    ("1", "A20161106WKD", "A20161106WKD_036000_1..N01R", "1..N01R",
+     ["101", "102", "103", "104", "105"]),
+    ("1", "A20161106WKD", "A20161106WKD_048000_1..N01R", "1..N01R",
+     ["101", "102", "103", "104", "105"]),
+    ("1", "A20161106WKD", "A20161106WKD_036100_1..S01R", "1..S01R",
+     ["105", "104", "103", "102", "101"]),
+    ("2", "A20161106WKD", "A20161106WKD_036000_2..N01R", "2..N01R",
+     ["101", "103", "105"]),
+    ("1", "A20161106SAT", "A20161106SAT_024000_1..N02R", "1..N01R",
+     ["101", "102", "104", "105"]),
+    ("1", "A20161106SAT", "A20161106SAT_048000_1..N03R", "1..N01R",
+     ["101", "103", "104", "105"])
+]
+
+
+def write_gtfs(directory):
+    """ Writes the text files of the tiny GTFS feed.
+
+    Arguments
+    ---------
+    directory: py.path.local
+        Directory to write the files to
+    """
+    stops = ["stop_id,stop_name,stop_lat,stop_lon,location_type,"
+             "parent_station"]
+    for station_id, lat in STATIONS:
+        stops.append("{0},St {0},{1},{2},1,".format(station_id, lat, LON))
+        for direction in "NS":
+            stops.append("{0}{3},St {0},{1},{2},,{0}".format(
+                station_id, lat, LON, direction))
+
+    routes = ["route_id,route_short_name,route_color",
+              "1,1,EE352E", "2,2,00933C"]
+
+    # Shape points every 100 m or so from station 101 to station 105, the
+    # express shape just east of the local one
+    lats = [round(40.8 + 0.0007 * i, 6) for i in xrange(41)]
+    shapes = ["shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence"]
+    for shape_id, shape_lats, lon in [("1..N01R", lats, LON),
+                                      ("1..S01R", lats[::-1], LON),
+                                      ("2..N01R", lats, LON + 0.00001)]:
+        shapes.extend("{},{},{},{}".format(shape_id, lat, lon, i)
+                      for i, lat in enumerate(shape_lats))
+
+    trips = ["route_id,service_id,trip_id,shape_id"]
+    stop_times = ["trip_id,arrival_time,departure_time,stop_id,"
+                  "stop_sequence"]
+    for route_id, service_id, trip_id, shape_id, stations in TRIPS:
+        trips.append(",".join([route_id, service_id, trip_id, shape_id]))
+        direction = shape_id[3]
+        stop_times.extend(
+            "{},10:00:00,10:00:00,{}{},{}".format(trip_id, station_id,
+                                                  direction, i + 1)
+            for i, station_id in enumerate(stations))
+
+    for name, lines in [("stops", stops), ("routes", routes),
+                        ("shapes", shapes), ("trips", trips),
+                        ("stop_times", stop_times)]:
+        directory.join(name + ".txt").write("\n".join(lines) + "\n")
+
+
+@pytest.fixture(scope="session")
+def static_dir(tmpdir_factory):
+    """ Directory of the static files built from the tiny GTFS feed. """
+    directory = tmpdir_factory.mktemp("static")
+    gtfs_dir = directory.mkdir("gtfs")
+    write_gtfs(gtfs_dir)
+
+    # builders makes its output directories in the working directory as
+    # soon as it is imported, so it is only imported from the tmp directory
+    old_dir = directory.chdir()
+    try:
+        from builders import PrevStopsBuilder, ShapesBuilder, \
+            StopGraphBuilder, build_static_files
+        from schedule import GTFSSource, load_static_feed
+
+        builders = {
+            "shapes": ShapesBuilder,
+            "graph": StopGraphBuilder,
+            "prev_stops": PrevStopsBuilder
+        }
+        tables = set()
+        for builder_class in builders.values():
+            tables |= builder_class.tables
+
+        feed = load_static_feed(GTFSSource(str(gtfs_dir)), tables)
+        build_static_files(feed, {
+            file: builder_class(feed)
+            for file, builder_class in builders.items()
+        })
+    finally:
+        old_dir.chdir()
+
+    return directory.join(".cache")
+
+
+@pytest.fixture(scope="session")
+def shapes(static_dir):
+    """ ShapeStore of the tiny GTFS feed. """
+    from geometry import ShapeStore
+    return ShapeStore(str(static_dir.join("shapes.bin")))
+
+
+@pytest.fixture
+def graph(static_dir):
+    """ StopGraph of the tiny GTFS feed (new for every test, so that no
+    chains of segments are cached). """
+    from transit import StopGraph
+    return StopGraph(str(static_dir.join("graph.bin")))
+
+
+@pytest.fixture(scope="session")
+def prev_stops(static_dir):
+    """ PrevStops of the tiny GTFS feed. """
+    from transit import PrevStops
+    return PrevStops(str(static_dir.join("prev_stops.bin")))
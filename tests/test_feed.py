@@ -0,0 +1,201 @@
+import os
+import sys
+import threading
+
+import pytest
+
+gtfs = pytest.importorskip("gtfs_realtime_pb2")
+pytest.importorskip("API_KEYS")
+
+from google.protobuf.message import DecodeError  # noqa: E402
+import requests  # noqa: E402
+
+import feed  # noqa: E402
+from feed import FeedPoller, read_timestamp  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "scripts"))
+
+from feed_standin import StandinServer  # noqa: E402
+
+# POSIX time of the first snapshot of the tests
+T = 1478534400
+
+
+def make_feed(timestamp=None, trip_ids=(), version="1.0"):
+    """ Returns a serialized snapshot of a live feed.
+
+    Arguments
+    ---------
+    timestamp: int
+        POSIX time of the snapshot, or None for no timestamp
+    trip_ids: list[str]
+        Trip IDs of the vehicles of the snapshot
+    version: str
+        GTFS realtime version of the snapshot
+
+    Returns
+    -------
+    str
+        Serialized GTFS realtime FeedMessage
+    """
+    feed_message = gtfs.FeedMessage()
+    feed_message.header.gtfs_realtime_version = version
+    if timestamp is not None:
+        feed_message.header.timestamp = timestamp
+
+    for trip_id in trip_ids:
+        feed_message.entity.add(id=trip_id).vehicle.trip.trip_id = trip_id
+
+    return feed_message.SerializeToString()
+
+
+@pytest.mark.parametrize("content, timestamp", [
+    (make_feed(T), T),
+    (make_feed(T, ["036000_1..N01R"]), T),
+    # Header longer than 127 bytes, so that its length takes two bytes
+    (make_feed(T, version="1" * 200), T),
+    (make_feed(), None),
+    ("", None),
+    ("\x12\x00", None)
+])
+def test_read_timestamp(content, timestamp):
+    assert read_timestamp(content) == timestamp
+
+
+@pytest.mark.parametrize("content", [
+    "\x0a", "\x0a\x80", make_feed(T, version="1" * 200)[:2]
+])
+def test_read_timestamp_truncated(content):
+    with pytest.raises(DecodeError):
+        read_timestamp(content)
+
+
+@pytest.fixture(params=[True, False], ids=["validators", "no validators"])
+def server(request, tmpdir):
+    """ Stand-in feed server of the payloads in a tmp directory, with or
+    without ETag and Last-Modified headers. Feed 2 is answered with an
+    error. """
+    server = StandinServer(("localhost", 0), str(tmpdir), {}, set(["2"]),
+                           request.param)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def poller(server):
+    """ FeedPoller of feeds 1 to 3 of the stand-in feed server, which
+    records the status code of every response in statuses. """
+    poller = FeedPoller([1, 2, 3], "http://localhost:{}/mta_esi.php".format(
+        server.server_address[1]))
+    poller.statuses = []
+
+    get = poller.session.get
+
+    def get_and_record(*args, **kwargs):
+        response = get(*args, **kwargs)
+        poller.statuses.append(response.status_code)
+        return response
+
+    poller.session.get = get_and_record
+
+    yield poller
+
+    poller.stop()
+
+
+def write_payload(server, name, content):
+    """ Writes a payload for the stand-in feed server to serve. """
+    with open(os.path.join(server.payload_dir, name), "wb") as payload_f:
+        payload_f.write(content)
+
+
+def test_get_feed(server, poller):
+    write_payload(server, "1.pb", make_feed(T, ["036000_1..N01R"]))
+
+    for _ in xrange(2):
+        feed_message = poller.get_feed(1)
+        assert feed_message.header.timestamp == T
+        assert feed_message.entity[0].vehicle.trip.trip_id == \
+            "036000_1..N01R"
+
+    # Unconditional fetches are never answered with 304
+    assert poller.statuses == [200, 200]
+
+
+def test_get_feed_if_changed(server, poller):
+    write_payload(server, "1.pb", make_feed(T, ["036000_1..N01R"]))
+    assert poller.get_feed_if_changed(1).header.timestamp == T
+
+    # Unchanged: not modified, or the same content
+    assert poller.get_feed_if_changed(1) is None
+    assert poller.statuses == [200, 304 if server.validators else 200]
+
+    # Changed content, but the same header timestamp
+    write_payload(server, "1.pb", make_feed(T, ["036000_2..N01R"]))
+    assert poller.get_feed_if_changed(1) is None
+    assert poller.statuses[-1] == 200
+
+    # New snapshot
+    write_payload(server, "1.pb", make_feed(T + 30, ["036000_2..N01R"]))
+    feed_message = poller.get_feed_if_changed(1)
+    assert feed_message.header.timestamp == T + 30
+    assert feed_message.entity[0].vehicle.trip.trip_id == "036000_2..N01R"
+
+
+def test_get_feed_if_changed_cycle(server, poller):
+    write_payload(server, "1-00.pb", make_feed(T))
+    write_payload(server, "1-01.pb", make_feed(T + 30))
+
+    # Each request is answered with the next payload, so the feed changes
+    # every time
+    timestamps = [poller.get_feed_if_changed(1).header.timestamp
+                  for _ in xrange(3)]
+    assert timestamps == [T, T + 30, T]
+    assert server.requests == {"1": 3}
+
+
+def test_corrupt_feed(server, poller):
+    write_payload(server, "1.pb", make_feed(T)[:-1])
+    with pytest.raises(DecodeError):
+        poller.get_feed_if_changed(1)
+
+    # A corrupt message is not remembered as the last one processed
+    write_payload(server, "1.pb", make_feed(T))
+    assert poller.get_feed_if_changed(1).header.timestamp == T
+
+
+@pytest.mark.parametrize("feed_id, status", [(2, 503), (3, 404)])
+def test_failed_feed(server, poller, feed_id, status):
+    write_payload(server, "2.pb", make_feed(T))
+
+    with pytest.raises(requests.RequestException):
+        poller.get_feed_if_changed(feed_id)
+    assert poller.statuses == [status]
+
+
+def test_process(poller, monkeypatch):
+    monkeypatch.setattr("feed.current_feeds", {})
+    processed = []
+
+    def on_feed(feed_id, feed_message):
+        processed.append((feed_id, feed_message.header.timestamp))
+        raise ValueError("processing error")
+
+    poller.on_feed = on_feed
+    feed_message = gtfs.FeedMessage()
+    feed_message.ParseFromString(make_feed(T))
+
+    # Errors processing a message do not stop the feed from being polled
+    poller._process(1, feed_message, 0.5)
+    poller._process(1, None, 0.5)
+
+    assert processed == [(1, T)]
+    assert feed.current_feeds[1] is feed_message
+    assert poller.counts[1] == {"processed": 1, "skipped": 1, "failed": 0}
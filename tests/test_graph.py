@@ -0,0 +1,69 @@
+import pytest
+
+from conftest import LON, STATIONS
+from geometry import get_haversine_distance
+
+COORDS = {station_id: (LON, lat) for station_id, lat in STATIONS}
+
+
+def assert_joins(path, start, end):
+    """ Asserts that a path runs from one station to another. """
+    points = path.tolist()
+    assert get_haversine_distance(points[0], COORDS[start]) < 1
+    assert get_haversine_distance(points[-1], COORDS[end]) < 1
+    assert path.get_length() == pytest.approx(
+        get_haversine_distance(COORDS[start], COORDS[end]), abs=5)
+
+
+@pytest.mark.parametrize("start, end", [
+    ("101", "102"), ("102", "101"), ("101", "103"), ("105", "104")
+])
+def test_adjacent(graph, shapes, start, end):
+    segment_ids = graph.find_segments(start, end, shapes)
+
+    assert segment_ids == (graph.get_segment_id(start, end),)
+    assert_joins(graph.get_chain_path(segment_ids, shapes), start, end)
+
+
+def test_directions(graph, shapes):
+    forward, = graph.find_segments("102", "103", shapes)
+    backward, = graph.find_segments("103", "102", shapes)
+
+    # Both directions are the same edge
+    assert forward // 2 == backward // 2
+    assert forward != backward
+    assert graph.get_segment_path(forward, shapes).tolist() == \
+        graph.get_segment_path(backward, shapes).tolist()[::-1]
+
+
+@pytest.mark.parametrize("start, end", [
+    ("101", "104"), ("104", "101"), ("102", "105")
+])
+def test_chain(graph, shapes, start, end):
+    with pytest.raises(KeyError):
+        graph.get_segment_id(start, end)
+
+    segment_ids = graph.find_segments(start, end, shapes)
+
+    assert len(segment_ids) == 2
+    assert_joins(graph.get_chain_path(segment_ids, shapes), start, end)
+    for segment_id, next_segment_id in zip(segment_ids, segment_ids[1:]):
+        assert get_haversine_distance(
+            graph.get_segment_path(segment_id, shapes)[-1],
+            graph.get_segment_path(next_segment_id, shapes)[0]) < 1
+
+
+def test_chain_cached(graph, shapes):
+    segment_ids = graph.find_segments("101", "105", shapes)
+
+    assert graph.find_segments("101", "105", shapes) is segment_ids
+
+
+@pytest.mark.parametrize("start, end", [
+    ("101", "106"), ("106", "101"), ("101", "999"), ("101", "101")
+])
+def test_no_chain(graph, shapes, start, end):
+    # Twice, so that the cached result raises as well
+    for _ in xrange(2):
+        with pytest.raises(KeyError):
+            graph.find_segments(start, end, shapes)
@@ -0,0 +1,103 @@
+from array import array
+
+import pytest
+
+from packed import PACKED_MAGIC, PackedFile, StaleCacheError, write_packed
+
+SCHEMA = {"ids": "i", "lengths": "d"}
+SOURCE = {"stops.txt": "abc"}
+
+
+@pytest.fixture
+def packed_path(tmpdir):
+    """ Path of a packed file with two sections. """
+    path = str(tmpdir.join("test.bin"))
+    write_packed(path, 2, {"names": ["a", "b", "c"]}, {
+        "ids": array("i", [3, -1, 7]),
+        "lengths": array("d", [0.5, 1.25]),
+        "flags": array("b", [1])
+    }, SOURCE)
+    return path
+
+
+def test_round_trip(packed_path):
+    packed = PackedFile(packed_path, 2, SCHEMA, SOURCE)
+
+    assert packed.metadata == {"names": ["a", "b", "c"]}
+    assert packed.source == SOURCE
+    assert list(packed.section("ids")) == [3, -1, 7]
+    assert list(packed.section("lengths")) == [0.5, 1.25]
+
+    # Sections not in the schema are not read
+    with pytest.raises(KeyError):
+        packed.section("flags")
+
+
+def test_any_source(packed_path):
+    assert PackedFile(packed_path, 2, SCHEMA).source == SOURCE
+
+
+def test_same_contents_same_digest(packed_path, tmpdir):
+    path = str(tmpdir.join("copy.bin"))
+    write_packed(path, 2, {"names": ["a", "b", "c"]}, {
+        "flags": array("b", [1]),
+        "lengths": array("d", [0.5, 1.25]),
+        "ids": array("i", [3, -1, 7])
+    }, SOURCE)
+
+    assert PackedFile(path, 2, SCHEMA).digest == \
+        PackedFile(packed_path, 2, SCHEMA).digest
+
+
+def test_missing(tmpdir):
+    path = str(tmpdir.join("missing.bin"))
+    with pytest.raises(StaleCacheError) as excinfo:
+        PackedFile(path, 2, SCHEMA)
+
+    assert excinfo.value.path == path
+    assert excinfo.value.reason == "could not be opened"
+
+
+@pytest.mark.parametrize("version, schema, source, reason", [
+    (3, SCHEMA, None, "has format version 2 (expected 3)"),
+    (2, {"ids": "d"}, None, "has no ids section of type d"),
+    (2, {"names": "i"}, None, "has no names section of type i"),
+    (2, SCHEMA, {"stops.txt": "def"}, "was built from a different static "
+     "feed than the one in the build manifest")
+])
+def test_stale(packed_path, version, schema, source, reason):
+    with pytest.raises(StaleCacheError) as excinfo:
+        PackedFile(packed_path, version, schema, source)
+
+    assert excinfo.value.reason == reason
+    assert "rebuild it with static.py" in str(excinfo.value)
+
+
+@pytest.mark.parametrize("size, reason", [
+    (0, "could not be opened"),
+    (len(PACKED_MAGIC) - 1, "is not a packed file"),
+    (len(PACKED_MAGIC) + 2, "has a corrupt header"),
+    (len(PACKED_MAGIC) + 20, "has a corrupt header"),
+    (-4, "is truncated")
+])
+def test_truncated(packed_path, size, reason):
+    with open(packed_path, "rb") as packed_f:
+        contents = packed_f.read()
+    with open(packed_path, "wb") as packed_f:
+        packed_f.write(contents[:size])
+
+    with pytest.raises(StaleCacheError) as excinfo:
+        PackedFile(packed_path, 2, SCHEMA)
+
+    assert excinfo.value.reason == reason
+
+
+def test_corrupt_header(packed_path):
+    with open(packed_path, "r+b") as packed_f:
+        packed_f.seek(len(PACKED_MAGIC) + 4)
+        packed_f.write("}")
+
+    with pytest.raises(StaleCacheError) as excinfo:
+        PackedFile(packed_path, 2, SCHEMA)
+
+    assert excinfo.value.reason == "has a corrupt header"
@@ -0,0 +1,99 @@
+import pytest
+
+gtfs = pytest.importorskip("gtfs_realtime_pb2")
+
+MONDAY = "20161107"
+SATURDAY = "20161112"
+SUNDAY = "20161113"
+
+
+def make_vehicle(trip_id, stop_id, stop_sequence, start_date=MONDAY):
+    """ Returns a vehicle of the live feed.
+
+    Arguments
+    ---------
+    trip_id: str
+        Trip ID, of the form origin time_route..path
+    stop_id: str
+        Stop ID of the stop the vehicle is headed to or at
+    stop_sequence: int
+        Stop sequence of the stop on the trip
+    start_date: str
+        Start date of the trip, as YYYYMMDD
+
+    Returns
+    -------
+    transit_realtime.VehiclePosition
+        GTFS realtime VehiclePosition object (protobuf)
+    """
+    vehicle = gtfs.VehiclePosition()
+    vehicle.trip.trip_id = trip_id
+    vehicle.trip.start_date = start_date
+    vehicle.stop_id = stop_id
+    vehicle.current_stop_sequence = stop_sequence
+    return vehicle
+
+
+@pytest.mark.parametrize("vehicle, prev_stop", [
+    # Unique previous stop
+    (make_vehicle("036000_1..N01R", "102N", 2), "101N"),
+    (make_vehicle("036000_1..S01R", "104S", 2), "105S"),
+    (make_vehicle("036000_2..N01R", "103N", 2), "101N"),
+    # Unique previous stop given the stop sequence
+    (make_vehicle("036000_1..N01R", "103N", 3), "102N"),
+    (make_vehicle("048000_1..N03R", "103N", 2, SATURDAY), "101N"),
+    (make_vehicle("036000_1..N01R", "104N", 4), "103N"),
+    # Previous stop of the trip with the closest origin time on the same
+    # service day
+    (make_vehicle("030000_1..N02R", "104N", 3, SATURDAY), "102N"),
+    (make_vehicle("050000_1..N03R", "104N", 3, SATURDAY), "103N"),
+    # Route of the same group, as when a train switches routes
+    (make_vehicle("036000_3..N01R", "102N", 2), "101N")
+])
+def test_prev_stop(prev_stops, vehicle, prev_stop):
+    assert prev_stops.get_prev_stop(vehicle) == prev_stop
+
+
+@pytest.mark.parametrize("vehicle", [
+    # Beginning of the trip
+    make_vehicle("036000_1..N01R", "101N", 1),
+    # Unknown stop
+    make_vehicle("036000_1..N01R", "999N", 2),
+    # Malformed trip ID
+    make_vehicle("1..N01R", "102N", 2),
+    # Ambiguous, with no trips on the service day or origin time
+    make_vehicle("030000_1..N02R", "104N", 3, SUNDAY),
+    make_vehicle("030000_1..N02R", "104N", 3, "2016"),
+    make_vehicle("XX_1..N02R", "104N", 3, SATURDAY)
+])
+def test_no_prev_stop(prev_stops, vehicle):
+    assert prev_stops.get_prev_stop(vehicle) is None
+
+
+def test_resolve_vehicles(prev_stops):
+    vehicles = [
+        make_vehicle("030000_1..N02R", "104N", 3, SATURDAY),
+        make_vehicle("036000_1..N01R", "101N", 1),
+        make_vehicle("050000_1..N03R", "104N", 3, SATURDAY),
+        make_vehicle("036000_1..N01R", "102N", 2),
+        make_vehicle("026000_1..N02R", "104N", 3, SATURDAY)
+    ]
+
+    assert prev_stops.resolve_vehicles(vehicles) == \
+        ["102N", None, "103N", "101N", "102N"]
+    assert prev_stops.resolve_vehicles(vehicles) == \
+        [prev_stops.get_prev_stop(vehicle) for vehicle in vehicles]
+
+
+def test_resolve_feed(prev_stops):
+    feed_message = gtfs.FeedMessage()
+    feed_message.header.gtfs_realtime_version = "1.0"
+    for i, vehicle in enumerate([make_vehicle("036000_1..N01R", "103N", 3),
+                                 make_vehicle("036000_1..N01R", "101N", 1)]):
+        trip_update = feed_message.entity.add(id="{}a".format(i)).trip_update
+        trip_update.trip.CopyFrom(vehicle.trip)
+        feed_message.entity.add(id="{}b".format(i)).vehicle.CopyFrom(vehicle)
+
+    assert [(vehicle.stop_id, prev_stop) for vehicle, prev_stop in
+            prev_stops.resolve_feed(feed_message)] == \
+        [("103N", "102N"), ("101N", None)]
@@ -0,0 +1,200 @@
+import pytest
+
+gtfs = pytest.importorskip("gtfs_realtime_pb2")
+
+from realtime import Frame, FrameBuilder, Train  # noqa: E402
+
+IN_TRANSIT_TO = gtfs.VehiclePosition.IN_TRANSIT_TO
+STOPPED_AT = gtfs.VehiclePosition.STOPPED_AT
+
+# POSIX time of the first snapshot of the tests
+T = 1478534400
+
+
+def make_feed(timestamp, vehicles):
+    """ Returns a snapshot of a live feed.
+
+    Arguments
+    ---------
+    timestamp: int
+        POSIX time of the snapshot
+    vehicles: list[tuple]
+        Trip ID, stop ID the vehicle is headed to or at, stop sequence of
+        the stop, status, POSIX time the vehicle was updated (or None), and
+        predicted POSIX time of arrival at the stop (or None) of each
+        vehicle of the snapshot
+
+    Returns
+    -------
+    transit_realtime.FeedMessage
+        GTFS realtime FeedMessage object (protobuf)
+    """
+    feed_message = gtfs.FeedMessage()
+    feed_message.header.gtfs_realtime_version = "1.0"
+    feed_message.header.timestamp = timestamp
+
+    for trip_id, stop_id, stop_sequence, status, updated, arrival in \
+            vehicles:
+        trip = gtfs.TripDescriptor(trip_id=trip_id, start_date="20161107",
+                                   route_id=trip_id.split("_")[1][0])
+
+        if arrival is not None:
+            trip_update = feed_message.entity.add(id=trip_id + "u") \
+                .trip_update
+            trip_update.trip.CopyFrom(trip)
+            trip_update.stop_time_update.add(stop_id=stop_id).arrival.time = \
+                arrival
+
+        vehicle = feed_message.entity.add(id=trip_id + "v").vehicle
+        vehicle.trip.CopyFrom(trip)
+        vehicle.stop_id = stop_id
+        vehicle.current_stop_sequence = stop_sequence
+        vehicle.current_status = status
+        if updated is not None:
+            vehicle.timestamp = updated
+
+    return feed_message
+
+
+@pytest.fixture
+def builder(prev_stops, graph, shapes):
+    """ FrameBuilder of the tiny GTFS feed. """
+    return FrameBuilder(prev_stops, graph, shapes)
+
+
+def test_process_feed(builder, graph):
+    frame = builder.process_feed(1, make_feed(T, [
+        ("036000_1..N01R", "103N", 3, IN_TRANSIT_TO, T - 10, T + 60),
+        ("036000_2..N01R", "105N", 3, STOPPED_AT, T - 5, None),
+        ("036100_1..S01R", "101S", 5, IN_TRANSIT_TO, None, None),
+        ("048000_1..N01R", "101N", 1, STOPPED_AT, T, None)
+    ]))
+
+    assert builder.frame is frame
+    assert frame.seq == 1
+    assert frame.timestamp == T
+    assert frame.segments_version == builder.segments_version
+    assert frame.trains == (
+        Train("036000_1..N01R", "1", "102", "103",
+              (graph.get_segment_id("102", "103"),), T - 10, T + 60),
+        # Stopped at the end of its path
+        Train("036000_2..N01R", "2", "103", "105",
+              (graph.get_segment_id("103", "105"),), T - 5, T - 5),
+        # No prediction, and no update time
+        Train("036100_1..S01R", "1", "102", "101",
+              (graph.get_segment_id("102", "101"),), T, None)
+    )
+
+
+def test_departure_kept(builder):
+    builder.process_feed(1, make_feed(T, [
+        ("036000_1..N01R", "103N", 3, IN_TRANSIT_TO, T - 10, T + 60)
+    ]))
+
+    # Still headed to the same stop, with a new prediction
+    train, = builder.process_feed(1, make_feed(T + 30, [
+        ("036000_1..N01R", "103N", 3, IN_TRANSIT_TO, T + 20, T + 50)
+    ])).trains
+    assert (train.departure_time, train.arrival_time) == (T - 10, T + 50)
+
+    # Arrived at the stop
+    train, = builder.process_feed(1, make_feed(T + 60, [
+        ("036000_1..N01R", "103N", 3, STOPPED_AT, T + 55, None)
+    ])).trains
+    assert (train.departure_time, train.arrival_time) == (T - 10, T - 10)
+
+    # Headed to the next stop, updated after the snapshot
+    train, = builder.process_feed(1, make_feed(T + 90, [
+        ("036000_1..N01R", "104N", 4, IN_TRANSIT_TO, T + 95, T + 150)
+    ])).trains
+    assert (train.prev_station, train.next_station) == ("103", "104")
+    assert (train.departure_time, train.arrival_time) == (T + 90, T + 150)
+
+
+def test_feeds(builder):
+    builder.process_feed(2, make_feed(T + 5, [
+        ("036000_2..N01R", "103N", 2, IN_TRANSIT_TO, T, T + 60)
+    ]))
+    frame = builder.process_feed(1, make_feed(T, [
+        ("036000_1..N01R", "103N", 3, IN_TRANSIT_TO, T - 10, T + 60)
+    ]))
+
+    # Trains are in order of feed ID
+    assert frame.seq == 2
+    assert frame.timestamp == T + 5
+    assert [train.trip_id for train in frame.trains] == \
+        ["036000_1..N01R", "036000_2..N01R"]
+
+    # A new snapshot of a feed only replaces the trains of that feed
+    frame = builder.process_feed(1, make_feed(T + 30, []))
+    assert frame.seq == 3
+    assert [train.trip_id for train in frame.trains] == ["036000_2..N01R"]
+
+
+def test_unchanged_delta(builder):
+    previous = builder.process_feed(1, make_feed(T, [
+        ("036000_1..N01R", "103N", 3, IN_TRANSIT_TO, T - 10, T + 60),
+        ("036000_2..N01R", "105N", 3, IN_TRANSIT_TO, T - 5, T + 90)
+    ]))
+    frame = builder.process_feed(1, make_feed(T + 30, [
+        ("036000_1..N01R", "103N", 3, IN_TRANSIT_TO, T + 20, T + 60),
+        ("036000_2..N01R", "105N", 3, IN_TRANSIT_TO, T + 25, T + 80)
+    ]))
+
+    assert frame.get_delta(previous) == {
+        "seq": 2,
+        "base": 1,
+        "trains": {
+            "036000_2..N01R": frame.get_keyframe()["trains"]["036000_2..N01R"]
+        },
+        "removed": []
+    }
+
+
+def make_train(trip_id, arrival_time=T + 60):
+    """ Returns a train headed from station 102 to station 103. """
+    return Train(trip_id, "1", "102", "103", (2,), T, arrival_time)
+
+
+def test_keyframe():
+    frame = Frame(4, T, [make_train("a"), make_train("b", None)], "v1")
+
+    assert frame.get_keyframe() == {
+        "seq": 4,
+        "base": None,
+        "segments_version": "v1",
+        "trains": {
+            "a": {"route": "1", "segments": [2], "departure": T,
+                  "arrival": T + 60},
+            "b": {"route": "1", "segments": [2], "departure": T,
+                  "arrival": None}
+        },
+        "removed": []
+    }
+
+
+def test_delta():
+    previous = Frame(4, T, [make_train("a"), make_train("b"), make_train("c"),
+                            make_train("d")], "v1")
+    frame = Frame(5, T + 30, [make_train("a"), make_train("b", T + 90),
+                              make_train("e")], "v1")
+
+    # Only added and changed trains are sent, along with the removed ones
+    assert frame.get_delta(previous) == {
+        "seq": 5,
+        "base": 4,
+        "trains": {
+            "b": {"route": "1", "segments": [2], "departure": T,
+                  "arrival": T + 90},
+            "e": {"route": "1", "segments": [2], "departure": T,
+                  "arrival": T + 60}
+        },
+        "removed": ["c", "d"]
+    }
+
+    assert frame.get_delta(frame) == {
+        "seq": 5,
+        "base": 5,
+        "trains": {},
+        "removed": []
+    }
@@ -0,0 +1,138 @@
+import zlib
+
+import flask
+import pytest
+
+import responses
+from responses import EncodedResponse
+
+BODY = '{"segments": [' + ", ".join(['"abc"'] * 100) + ']}'
+
+
+@pytest.fixture
+def app():
+    """ Flask app to make the requests in. """
+    return flask.Flask(__name__)
+
+
+def get(app, response, headers=None):
+    """ Returns the response to a GET request with the given headers. """
+    with app.test_request_context(headers=headers):
+        return response.make_response(flask.request)
+
+
+def get_etag(app, response, accept_encoding):
+    """ Returns the ETag of the form of a response a request accepting the
+    given encodings gets. """
+    return get(app, response, {"Accept-Encoding": accept_encoding}) \
+        .headers["ETag"]
+
+
+@pytest.fixture(params=[True, False], ids=["brotli", "no brotli"])
+def brotli(request, monkeypatch):
+    """ Whether brotli is installed, for the responses made in the test. """
+    if request.param:
+        brotli = pytest.importorskip("brotli")
+    else:
+        brotli = None
+
+    monkeypatch.setattr(responses, "brotli", brotli)
+    return brotli
+
+
+def test_forms(app, brotli):
+    response = EncodedResponse(BODY, cache_control="max-age=60")
+
+    identity = get(app, response)
+    assert identity.status_code == 200
+    assert identity.get_data() == BODY
+    assert identity.mimetype == "application/json"
+    assert identity.headers["Cache-Control"] == "max-age=60"
+    assert identity.headers["Vary"] == "Accept-Encoding"
+    assert "Content-Encoding" not in identity.headers
+
+    gzipped = get(app, response, {"Accept-Encoding": "gzip"})
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert zlib.decompress(gzipped.get_data(), 16 + zlib.MAX_WBITS) == BODY
+
+    # Brotli is preferred, if installed and accepted
+    preferred = get(app, response, {"Accept-Encoding": "gzip, br"})
+    if brotli is not None:
+        assert preferred.headers["Content-Encoding"] == "br"
+        assert brotli.decompress(preferred.get_data()) == BODY
+    else:
+        assert preferred.headers["Content-Encoding"] == "gzip"
+
+    # Every form has its own ETag
+    etags = set(get_etag(app, response, accept_encoding)
+                for accept_encoding in ["identity", "gzip", "gzip, br"])
+    assert len(etags) == (3 if brotli is not None else 2)
+
+
+def test_from_gzip(app):
+    gzipped = get(app, EncodedResponse(BODY), {"Accept-Encoding": "gzip"})
+    response = EncodedResponse.from_gzip(gzipped.get_data())
+
+    assert get(app, response).get_data() == BODY
+    assert get(app, response, {"Accept-Encoding": "gzip"}).get_data() == \
+        gzipped.get_data()
+
+
+def test_uncompressed(app, brotli):
+    response = EncodedResponse(BODY, compress=False)
+
+    assert [form[0] for form in response.forms] == ["identity"]
+    uncompressed = get(app, response, {"Accept-Encoding": "gzip, br"})
+    assert uncompressed.get_data() == BODY
+    assert "Content-Encoding" not in uncompressed.headers
+
+
+@pytest.mark.parametrize("accept_encoding", ["identity", "gzip"])
+@pytest.mark.parametrize("weak", [False, True], ids=["strong", "weak"])
+def test_not_modified(app, accept_encoding, weak):
+    response = EncodedResponse(BODY)
+    etag = get_etag(app, response, accept_encoding)
+
+    # Proxies that compress or decompress responses pass the ETag on as
+    # weak, and a client may have any form of the response
+    if weak:
+        etag = "W/" + etag
+
+    for request_encoding in ["identity", "gzip"]:
+        not_modified = get(app, response, {
+            "Accept-Encoding": request_encoding,
+            "If-None-Match": '"other", ' + etag
+        })
+        assert not_modified.status_code == 304
+        assert not_modified.get_data() == ""
+        assert not_modified.headers["ETag"] == \
+            get_etag(app, response, request_encoding)
+
+
+@pytest.mark.parametrize("if_none_match", [
+    '"other"', 'W/"other"', '"{}"'.format("0" * 20)
+])
+def test_modified(app, if_none_match):
+    response = get(app, EncodedResponse(BODY),
+                   {"If-None-Match": if_none_match})
+
+    assert response.status_code == 200
+    assert response.get_data() == BODY
+
+
+def test_body_changed(app):
+    etag = get_etag(app, EncodedResponse(BODY), "gzip")
+    response = get(app, EncodedResponse(BODY + " "),
+                   {"Accept-Encoding": "gzip", "If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert zlib.decompress(response.get_data(), 16 + zlib.MAX_WBITS) == \
+        BODY + " "
+
+
+def test_gzip_deterministic():
+    # The gzip form has no timestamp, so it is the same on every server
+    first = EncodedResponse(BODY).forms[-2][1]
+    second = EncodedResponse(BODY).forms[-2][1]
+
+    assert first == second
@@ -0,0 +1,402 @@
+import gzip
+import math
+import os
+import sqlite3
+
+from cStringIO import StringIO
+
+import simplejson as json
+
+from packed import StaleCacheError
+
+# Zoom levels that simplified versions of routes.json are written for (see
+# RouteLevelsBuilder); each level is served for every zoom up to its own
+ROUTE_ZOOM_LEVELS = [12, 14, 16, 18]
+
+# Maximum number of decimals of the coordinates of simplified lines (the
+# coordinates of routes.json and shapes.txt are given to 6 decimals, which
+# is about 0.1 m)
+MAX_COORD_DECIMALS = 6
+
+# Width of a map tile in pixels, which sets the size of a pixel at each zoom
+TILE_SIZE = 256
+
+# Zooms that the map tiles of the subway lines and stops are cut at (see
+# TilesBuilder); maps zoomed in further use the tiles of the highest zoom
+MIN_TILE_ZOOM = 12
+MAX_TILE_ZOOM = 16
+
+
+def get_zoom_level(zoom):
+    """ Returns the zoom level of the simplified lines to show at a zoom.
+
+    Arguments
+    ---------
+    zoom: float
+        Zoom of the map
+
+    Returns
+    -------
+    int
+        Lowest level of ROUTE_ZOOM_LEVELS at or above the zoom (or the
+        highest level, for zooms beyond it)
+    """
+    for level in ROUTE_ZOOM_LEVELS:
+        if level >= zoom:
+            return level
+
+    return ROUTE_ZOOM_LEVELS[-1]
+
+
+def get_tolerance_level(tolerance):
+    """ Returns the zoom level of the simplified lines within a tolerance.
+
+    Arguments
+    ---------
+    tolerance: float
+        Largest distance allowed between the simplified and original lines,
+        in degrees of longitude
+
+    Returns
+    -------
+    int
+        Lowest level of ROUTE_ZOOM_LEVELS whose tolerance is within the
+        given one (or the highest level, if none is)
+    """
+    for level in ROUTE_ZOOM_LEVELS:
+        if get_zoom_tolerance(level) <= tolerance:
+            return level
+
+    return ROUTE_ZOOM_LEVELS[-1]
+
+
+def get_zoom_tolerance(zoom):
+    """ Returns the tolerance of the simplified lines of a zoom level.
+
+    Lines are simplified to within half a pixel at the zoom of their level,
+    so that they look the same as the original lines at that zoom.
+
+    Arguments
+    ---------
+    zoom: int
+        Zoom level
+
+    Returns
+    -------
+    float
+        Tolerance, in degrees of longitude
+    """
+    return 360.0 / (TILE_SIZE << zoom) / 2
+
+
+def simplify_points(points, tolerance):
+    """ Simplifies a line with the Douglas-Peucker algorithm.
+
+    Distances are measured as on a Web Mercator map, on which a degree of
+    latitude is longer than a degree of longitude by 1 / cos(latitude)
+    (taken as constant along the line, which is accurate enough at the
+    scale of a city).
+
+    Arguments
+    ---------
+    points: list[[float, float]]
+        Points of the line, in the form [lon, lat]
+    tolerance: float
+        Largest distance allowed between the simplified and original line,
+        in degrees of longitude
+
+    Returns
+    -------
+    list[[float, float]]
+        Points of the simplified line, a subset of the original points that
+        always includes the first and last one
+    """
+    if len(points) < 3:
+        return list(points)
+
+    scale = 1 / math.cos(math.radians(points[0][1]))
+    tolerance_sq = tolerance * tolerance
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+
+    # Ranges of points still to simplify, kept on a stack rather than
+    # recursed into, as lines can have thousands of points
+    ranges = [(0, len(points) - 1)]
+    while ranges:
+        first, last = ranges.pop()
+        start_x, start_y = points[first][0], points[first][1] * scale
+        dx = points[last][0] - start_x
+        dy = points[last][1] * scale - start_y
+        length_sq = dx * dx + dy * dy
+
+        # Point of the range farthest from the segment between its ends
+        farthest = None
+        farthest_sq = tolerance_sq
+        for i in xrange(first + 1, last):
+            x = points[i][0] - start_x
+            y = points[i][1] * scale - start_y
+            if length_sq > 0:
+                t = min(1.0, max(0.0, (x * dx + y * dy) / length_sq))
+                x -= t * dx
+                y -= t * dy
+
+            if x * x + y * y > farthest_sq:
+                farthest = i
+                farthest_sq = x * x + y * y
+
+        if farthest is not None:
+            keep[farthest] = True
+            ranges.append((first, farthest))
+            ranges.append((farthest, last))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def quantize_points(points, decimals):
+    """ Rounds the coordinates of the points of a line.
+
+    Points that round to the same coordinates as the point before them are
+    dropped, but the line is always left with at least two points.
+
+    Arguments
+    ---------
+    points: list[[float, float]]
+        Points of the line, in the form [lon, lat]
+    decimals: int
+        Number of decimals to round the coordinates to
+
+    Returns
+    -------
+    list[[float, float]]
+        Rounded points of the line
+    """
+    quantized = []
+    for lon, lat in points:
+        point = [round(lon, decimals), round(lat, decimals)]
+        if not quantized or point != quantized[-1]:
+            quantized.append(point)
+
+    if len(quantized) == 1 and len(points) > 1:
+        quantized.append(quantized[0])
+
+    return quantized
+
+
+def simplify_line(points, zoom):
+    """ Returns the version of a line to show at a zoom level.
+
+    The line is simplified to within the tolerance of the zoom level (see
+    get_zoom_tolerance), and its coordinates are rounded to the decimals of
+    the zoom level (see get_zoom_decimals).
+
+    Arguments
+    ---------
+    points: list[[float, float]]
+        Points of the line, in the form [lon, lat]
+    zoom: int
+        Zoom level
+
+    Returns
+    -------
+    list[[float, float]]
+        Points of the simplified line
+    """
+    return quantize_points(simplify_points(points, get_zoom_tolerance(zoom)),
+                           get_zoom_decimals(zoom))
+
+
+def get_zoom_decimals(zoom):
+    """ Returns the number of decimals of the coordinates of a zoom level.
+
+    Arguments
+    ---------
+    zoom: int
+        Zoom level
+
+    Returns
+    -------
+    int
+        Fewest decimals (up to MAX_COORD_DECIMALS) that keep the rounding
+        error of coordinates within a tenth of the tolerance of the zoom
+        level (see get_zoom_tolerance)
+    """
+    tolerance = get_zoom_tolerance(zoom)
+
+    decimals = 0
+    while decimals < MAX_COORD_DECIMALS and \
+            0.5 * 10 ** -decimals > tolerance / 10:
+        decimals += 1
+
+    return decimals
+
+
+def get_tile_position(lon, lat, zoom):
+    """ Returns the position of a point on the Web Mercator tiles of a zoom.
+
+    Arguments
+    ---------
+    lon: float
+        Longitude of the point
+    lat: float
+        Latitude of the point
+    zoom: int
+        Zoom of the tiles
+
+    Returns
+    -------
+    tuple[float, float]
+        Position (x, y) of the point, in tiles from the top left corner of
+        the map, such that the point is in tile (int(x), int(y))
+    """
+    lat = math.radians(lat)
+    tiles = 1 << zoom
+    return ((lon + 180) / 360 * tiles,
+            (1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 *
+            tiles)
+
+
+class TileStore:
+    """ TileStore class.
+
+    Store of the map tiles of the subway lines and stops (built by a
+    TilesBuilder), so that the client code only fetches the parts of the
+    map it shows, rather than every line and stop up front.
+
+    Tiles are kept in an SQLite database in the MBTiles layout (a tiles
+    table of tile_data by zoom_level, tile_column and tile_row, where rows
+    are numbered from the bottom of the map, and a metadata table of name,
+    value pairs). Each tile is a GeoJSON FeatureCollection, stored gzip
+    compressed (as MBTiles stores vector tiles), so that it can be sent as
+    is to clients accepting gzip.
+    """
+    # Version of the format of the tiles; increment it whenever the meaning
+    # of the tiles changes, so that stores written by older versions are
+    # rejected instead of being misread
+    VERSION = 1
+
+    def __init__(self, path, source=None):
+        """ Constructor.
+
+        Arguments
+        ---------
+        path: str
+            Path of the SQLite database of the store
+        source: dict[str -> str]
+            Expected map of input file -> hash of the file the store was
+            built from (as recorded in the build manifest), or None to
+            accept any source
+
+        Raises
+        ------
+        StaleCacheError
+            If the database is missing, was written by another version of
+            the format of the tiles, or was built from different files
+        """
+        # Connecting would create a missing database
+        if not os.path.isfile(path):
+            raise StaleCacheError(path, "could not be opened")
+
+        # Tiles are only ever read, so the connection can be shared by the
+        # greenthreads of the server
+        try:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            metadata = dict(self._db.execute(
+                "SELECT name, value FROM metadata"))
+        except sqlite3.Error:
+            raise StaleCacheError(path, "is not a tile store")
+
+        version = int(metadata.get("version", 0))
+        if version != self.VERSION:
+            raise StaleCacheError(path, "has format version {} (expected {})"
+                                  .format(version, self.VERSION))
+
+        if source is not None and \
+                json.loads(metadata.get("source", "null")) != source:
+            raise StaleCacheError(path, "was built from different files "
+                                  "than the ones in the build manifest")
+
+        self.min_zoom = int(metadata["minzoom"])
+        self.max_zoom = int(metadata["maxzoom"])
+
+    @staticmethod
+    def write(path, tiles, min_zoom, max_zoom, source=None):
+        """ Writes a store to an SQLite database.
+
+        The database is written to a temporary file first, so that an
+        interrupted build does not leave a partial store behind.
+
+        Arguments
+        ---------
+        path: str
+            Path of the SQLite database to write
+        tiles: dict[tuple[int, int, int] -> str]
+            Map of (zoom, x, y) -> GeoJSON of the tile, with y counted from
+            the top of the map
+        min_zoom: int
+            Lowest zoom of the tiles
+        max_zoom: int
+            Highest zoom of the tiles
+        source: dict[str -> str]
+            Map of input file -> hash of the file, for the files the store
+            was built from
+        """
+        if os.path.isfile(path + ".tmp"):
+            os.remove(path + ".tmp")
+
+        db = sqlite3.connect(path + ".tmp")
+        db.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+        db.execute("CREATE TABLE tiles (zoom_level INTEGER, "
+                   "tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+        db.execute("CREATE UNIQUE INDEX tile_index ON tiles "
+                   "(zoom_level, tile_column, tile_row)")
+
+        db.executemany("INSERT INTO metadata VALUES (?, ?)", [
+            ("name", "livesubway"),
+            ("format", "json"),
+            ("minzoom", str(min_zoom)),
+            ("maxzoom", str(max_zoom)),
+            ("version", str(TileStore.VERSION)),
+            ("source", json.dumps(source, sort_keys=True))
+        ])
+
+        def get_rows():
+            for (zoom, x, y), tile in sorted(tiles.iteritems()):
+                buf = StringIO()
+                gzip_f = gzip.GzipFile(fileobj=buf, mode="wb", mtime=0)
+                gzip_f.write(tile)
+                gzip_f.close()
+
+                yield (zoom, x, (1 << zoom) - 1 - y,
+                       sqlite3.Binary(buf.getvalue()))
+
+        db.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", get_rows())
+        db.commit()
+        db.close()
+
+        os.rename(path + ".tmp", path)
+
+    def get_tile(self, zoom, x, y):
+        """ Returns a tile, gzip compressed.
+
+        Arguments
+        ---------
+        zoom: int
+            Zoom of the tile
+        x: int
+            Column of the tile
+        y: int
+            Row of the tile, counted from the top of the map
+
+        Returns
+        -------
+        str
+            Gzip compressed GeoJSON of the tile, or None if there is nothing
+            in the tile
+        """
+        row = self._db.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND "
+            "tile_column = ? AND tile_row = ?",
+            (zoom, x, (1 << zoom) - 1 - y)).fetchone()
+
+        return None if row is None else str(row[0])
@@ -0,0 +1,1253 @@
+import hashlib
+
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from datetime import date
+from heapq import heappop, heappush
+
+from geometry import PathChain
+from packed import PackedFile, write_packed
+
+Segment = namedtuple('Segment', ['start', 'end'])
+Edge = namedtuple('Edge', ['shape_id', 'start_index', 'end_index'])
+StopID = namedtuple('StopID',
+                    ['route', 'stop_id'])
+
+WEEKDAY_SERVICE_CODE = "WKD"
+SAT_SERVICE_CODE = "SAT"
+SUN_SERVICE_CODE = "SUN"
+
+# We group routes by their "color" designation into sets; the reason for this
+# is that routes in a particular route group have overlap and cover overlapping
+# stops, at least in Manhattan. Thus, often times for maintenace or other
+# purposes, a train on one of these routes may be routed to another route in
+# the same group, such as a 3 train running local, which would mean it would
+# run a similar set of stops as a normal 1 train. However, this type of
+# situation is currently not covered in the static data, so we group these
+# routes up when looking at the live feed and determining what the previous
+# stop of a subway car may be from the static data.
+ROUTE_GROUPS = [
+    set(["1", "2", "3"]),
+    set(["4", "5", "6"]),
+    set(["A", "C", "E"]),
+    set(["B", "D", "F", "M"]),
+    set(["J", "Z"]),
+    set(["N", "Q", "R", "W"])
+]
+
+ROUTE_GROUP_MAPPING = {
+    route: route_group
+    for route_group in ROUTE_GROUPS
+    for route in route_group
+}
+
+
+class LRUCache:
+    """ LRUCache class.
+
+    Map that only keeps its most recently used items, up to a number of
+    them, so that caches of results that could be asked for with any of a
+    great many keys (such as pairs of stations) stay bounded.
+    """
+    def __init__(self, size):
+        """ Constructor.
+
+        Arguments
+        ---------
+        size: int
+            Maximum number of items
+        """
+        self.size = size
+        self._items = OrderedDict()
+
+    def __getitem__(self, key):
+        # Items are kept in order of use, so a used item is moved to the end
+        value = self._items.pop(key)
+        self._items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        if len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class Stop:
+    """ Stop class.
+
+    Used primarily to store information concerning stops that may
+    precede a particular stop, and the trip paths that correspond
+    to a pair of this stop and a previous stop possibility. Stops and trip
+    paths are interned (see PrevStopsBuilder).
+    """
+    def __init__(self):
+        """ Constructor. """
+        self.trip_paths_by_prev_stop = {}
+        self.prev_stops_by_stop_sequence = {}
+        self.prev_stops = set()
+
+    def add_prev_stop(self, stop_sequence, prev_stop, trip_path):
+        """ Adds a previous stop possibility along a trip path.
+
+        Arguments
+        ---------
+        stop_sequence: int
+            Stop sequence of stop along a trip path
+        prev_stop: int
+            Row of preceding stop along a trip path
+        trip_path: int
+            Interned trip path ID containing stop
+        """
+        if prev_stop not in self.trip_paths_by_prev_stop:
+            self.prev_stops.add(prev_stop)
+            self.trip_paths_by_prev_stop[prev_stop] = set([trip_path])
+        else:
+            self.trip_paths_by_prev_stop[prev_stop].add(trip_path)
+
+        if stop_sequence not in self.prev_stops_by_stop_sequence:
+            self.prev_stops_by_stop_sequence[stop_sequence] = set([prev_stop])
+        else:
+            self.prev_stops_by_stop_sequence[stop_sequence].add(prev_stop)
+
+
+class PrevStops:
+    """ PrevStops class.
+
+    Used primarily to store static information concerning stops
+    in order to retrieve the preceding stop for a given subway car.
+    This information is needed in order to render the duration of the path
+    of the subway car.
+
+    The lookup tables are stored in a packed file (prev_stops.bin, built by
+    a PrevStopsBuilder; see PrevStops.write for its layout), which is
+    memory-mapped when the object is created, so that every process serving
+    the live feed shares the same copy.
+    """
+    # Version of the format of the packed file; increment it whenever the
+    # meaning of the packed file's contents changes, so that files written by
+    # older versions are rejected instead of being misread
+    VERSION = 3
+
+    # Map of name -> typecode of the sections of the packed file
+    SCHEMA = {
+        "rows": "i",
+        "fallback_rows": "i",
+        "prev_stops": "i",
+        "sequence_offsets": "i",
+        "sequences": "i",
+        "sequence_prev_stops": "i",
+        "ambiguous_keys": "i",
+        "ambiguous_offsets": "i",
+        "origin_times": "i",
+        "origin_prev_stops": "i"
+    }
+
+    def __init__(self, path, source=None):
+        """ Constructor.
+
+        Arguments
+        ---------
+        path: str
+            Path of the packed file of the lookup tables
+        source: dict[str -> str]
+            Expected map of static GTFS file -> hash of the file the packed
+            file was built from (as recorded in the build manifest), or None
+            to accept any source
+
+        Raises
+        ------
+        StaleCacheError
+            If the packed file is missing, was written by another version of
+            its format, or was built from a different static feed
+        """
+        self._packed = PackedFile(path, self.VERSION, self.SCHEMA, source)
+
+        metadata = self._packed.metadata
+        self._stop_index = {stop: i for i, stop in
+                            enumerate(metadata["stops"])}
+        self._route_index = {route: i for i, route in
+                             enumerate(metadata["routes"])}
+
+        self._rows = self._packed.section("rows")
+        self._fallback_rows = self._packed.section("fallback_rows")
+
+        # Map of route ID -> indices of the other routes in its route group
+        # (see ROUTE_GROUPS)
+        self._group_route_indices = {
+            route: [self._route_index[group_route]
+                    for group_route in group_routes
+                    if group_route in self._route_index]
+            for route, group_routes in ROUTE_GROUP_MAPPING.iteritems()
+        }
+
+    @staticmethod
+    def write(path, stop_ids, route_ids, all_prev_stops,
+              ambiguous_stop_sequences, source=None):
+        """ Writes the lookup tables to a packed file.
+
+        The lookup tables are given with stops and routes interned (as their
+        index in stop_ids and route_ids), and each StopID packed into a
+        single key of route * number of stops + stop.
+
+        In the packed file, stops, routes and service codes are referred to
+        by their index in the lists of the metadata, and each StopID by its
+        row, i.e. the rank of its key (route index * number of stops + stop
+        index) among the StopIDs. The packed file has the following metadata
+        and sections:
+
+        metadata: {
+            stops: [stop IDs],
+            routes: [route IDs],
+            service_codes: [service codes]
+        }
+        rows: row of each StopID by key, or -1 for keys of no StopID (so
+            that a StopID is found with a single read)
+        fallback_rows: row of the first StopID of each stop, over the routes
+            of ROUTE_GROUPS in order, or -1 if there is none
+        prev_stops: index of the previous stop of each StopID if it is
+            unique, otherwise -1
+        sequence_offsets: offsets of the range of each StopID's stop
+            sequences in the following two sections
+        sequences: sorted stop sequences of each StopID
+        sequence_prev_stops: index of the previous stop of the StopID at
+            each stop sequence if it is unique, otherwise -1
+        ambiguous_keys: StopID row * number of service codes + service code
+            index of each StopID with an ambiguous previous stop, sorted
+        ambiguous_offsets: offsets of the range of each ambiguous key's
+            origin times in the following two sections
+        origin_times: sorted origin times (as numbers, as given in trip IDs)
+        origin_prev_stops: index of the previous stop of the trip with each
+            origin time
+
+        Arguments
+        ---------
+        path: str
+            Path of the packed file to write
+        stop_ids: list[str]
+            Stop IDs, by interned stop
+        route_ids: list[str]
+            Route IDs, by interned route
+        all_prev_stops: dict[int -> Stop]
+            Map of StopID key -> Stop object
+        ambiguous_stop_sequences: dict[int -> dict[str -> dict]]
+            Map of StopID key -> map of service code -> sorted origin times
+            and corresponding previous stops, for StopIDs with ambiguous
+            previous stops
+        source: dict[str -> str]
+            Map of static GTFS file -> hash of the file, for the files the
+            lookup tables were built from
+        """
+        num_stop_ids = len(stop_ids)
+        stops = set()
+        routes = set()
+        service_codes = set()
+
+        for key, stop in all_prev_stops.iteritems():
+            routes.add(key // num_stop_ids)
+            stops.add(key % num_stop_ids)
+            stops.update(stop.prev_stops)
+        for prev_stops_by_service_code in ambiguous_stop_sequences.values():
+            service_codes.update(prev_stops_by_service_code)
+
+        # Stops and routes are renumbered in order of their IDs, so that the
+        # file only depends on the static feed and not on the build
+        stops = sorted(stops, key=stop_ids.__getitem__)
+        routes = sorted(routes, key=route_ids.__getitem__)
+        service_codes = sorted(service_codes)
+        stop_index = {stop: i for i, stop in enumerate(stops)}
+        route_index = {route: i for i, route in enumerate(routes)}
+
+        def get_key(key):
+            return route_index[key // num_stop_ids] * len(stops) + \
+                stop_index[key % num_stop_ids]
+
+        def get_unique_stop(prev_stops):
+            return stop_index[next(iter(prev_stops))] \
+                if len(prev_stops) == 1 else -1
+
+        sections = {
+            name: array("i") for name in [
+                "prev_stops", "sequence_offsets", "sequences",
+                "sequence_prev_stops", "ambiguous_keys", "ambiguous_offsets",
+                "origin_times", "origin_prev_stops"
+            ]
+        }
+        sections["rows"] = array("i", [-1]) * (len(routes) * len(stops))
+        sections["sequence_offsets"].append(0)
+        sections["ambiguous_offsets"].append(0)
+
+        for row, key in enumerate(sorted(all_prev_stops, key=get_key)):
+            stop = all_prev_stops[key]
+            sections["rows"][get_key(key)] = row
+            sections["prev_stops"].append(get_unique_stop(stop.prev_stops))
+
+            for stop_sequence in sorted(stop.prev_stops_by_stop_sequence):
+                sections["sequences"].append(stop_sequence)
+                sections["sequence_prev_stops"].append(get_unique_stop(
+                    stop.prev_stops_by_stop_sequence[stop_sequence]))
+            sections["sequence_offsets"].append(len(sections["sequences"]))
+
+            prev_stops_by_service_code = \
+                ambiguous_stop_sequences.get(key, {})
+            for i, service_code in enumerate(service_codes):
+                if service_code not in prev_stops_by_service_code:
+                    continue
+
+                prev_stops = prev_stops_by_service_code[service_code]
+                sections["ambiguous_keys"].append(
+                    row * len(service_codes) + i)
+                sections["origin_times"].extend(prev_stops["origin_times"])
+                sections["origin_prev_stops"].extend(
+                    stop_index[prev_stop]
+                    for prev_stop in prev_stops["prev_stops"])
+                sections["ambiguous_offsets"].append(
+                    len(sections["origin_times"]))
+
+        # Row of the first StopID of each stop over the routes of
+        # ROUTE_GROUPS in order, searched when neither the route of a vehicle
+        # nor its route group stops at its stop (see PrevStops._find_stop)
+        sections["fallback_rows"] = array("i", [-1]) * len(stops)
+        route_id_index = {route_ids[route]: i
+                          for i, route in enumerate(routes)}
+        for route_group in ROUTE_GROUPS:
+            for route in route_group:
+                if route not in route_id_index:
+                    continue
+
+                first_key = route_id_index[route] * len(stops)
+                for i in xrange(len(stops)):
+                    if sections["fallback_rows"][i] < 0:
+                        sections["fallback_rows"][i] = \
+                            sections["rows"][first_key + i]
+
+        write_packed(path, PrevStops.VERSION, {
+            "stops": [stop_ids[i] for i in stops],
+            "routes": [route_ids[route] for route in routes],
+            "service_codes": service_codes
+        }, sections, source)
+
+    def _find_stop(self, route, stop):
+        """ Returns the row of the StopID of a vehicle in the lookup tables.
+
+        Arguments
+        ---------
+        route: str
+            Route ID of the vehicle's trip
+        stop: int
+            Index of the vehicle's stop in the lookup tables
+
+        Returns
+        -------
+        int
+            Row of the StopID, or -1 if the stop is not on any route
+        """
+        rows = self._rows
+        num_stops = len(self._stop_index)
+
+        if route in self._route_index:
+            row = rows[self._route_index[route] * num_stops + stop]
+            if row >= 0:
+                return row
+
+        # If the StopID is not present, perhaps the car has switched
+        # to another route; see the comments for the ROUTE_GROUPS constant
+        # at the top. Unfortunately this isn't a perfect method, since it
+        # does not necessarily correctly determine what the actual route it
+        # switched to, but this information is not necessarily known just
+        # from the vehicle itself (one needs to look either at live trip
+        # updates on the feed or for live service alerts). Thus we simply
+        # find the first match.
+        for route_index in self._group_route_indices.get(route, ()):
+            row = rows[route_index * num_stops + stop]
+            if row >= 0:
+                return row
+
+        # If a StopID is still not found, we search all possible routes;
+        # this may happen in case of service changes due to maintenance
+        # or other problems in the subway. Unfortunately, similarly to
+        # above, this is not a perfect method, since we simply take the
+        # first match, which is precomputed for every stop.
+        return self._fallback_rows[stop]
+
+    @staticmethod
+    def _get_service_code(trip):
+        """ Returns corresponding service code of a trip.
+
+        Arguments
+        ---------
+        trip: transit_realtime.TripDescriptor
+            GTFS realtime TripDescriptor object (protobuf)
+
+        Returns
+        -------
+        str
+            service code of trip
+        """
+        start_date = trip.start_date
+        year, month, day = int(start_date[:4]), int(start_date[4:6]), \
+            int(start_date[6:])
+        day_of_week = date(year, month, day).isoweekday()
+
+        if day_of_week <= 5:
+            service_code = WEEKDAY_SERVICE_CODE
+        elif day_of_week == 6:
+            service_code = SAT_SERVICE_CODE
+        else:
+            service_code = SUN_SERVICE_CODE
+
+        return service_code
+
+    @staticmethod
+    def _get_ambiguous_trip_paths(all_prev_stops):
+        """ Returns map of trip path -> set of pairs of StopID + previous
+        stops that are ambiguous and contained in that trip path; i.e. have
+        multiple trip paths that contain the info of that StopID and that
+        particular previous stop as the preceding stop.
+
+        To clarify, when we attempt to figure out from the live MTA feed what
+        the stop a particular subway car is coming from, we're only guaranteed
+        the origin time of the trip, as well as the start date, route number,
+        direction, and any future stop sequences along the planned trip.
+
+        However, there are a select few cases where this is not enough
+        information. Usually this is due to alternate trip paths that depend on
+        the time of day/day of week.
+
+        This map will thus keep track of the trip paths that are a part of
+        these ambiguous cases; the values will be the set of pairs of StopIDs
+        and the previous possibility for that StopID that lies on that
+        particular trip path (we also store the previous stop to avoid an extra
+        call to generate the list of stops for that trip path), and the keys
+        are all such trip paths that do form an ambiguous scenario. This way,
+        we can work with all ambiguous cases in one pass of the trip list.
+
+        Arguments
+        ---------
+        all_prev_stops: dict[int -> Stop]
+            Map of StopID key -> Stop object (see PrevStopsBuilder)
+
+        Returns
+        -------
+        dict[int -> set[tuple[int, int]]]
+            Map of trip path -> set of pairs of StopID key + previous
+            stops that are ambiguous and are contained in that trip path
+        """
+        ambiguous_trip_paths = {}
+
+        for stop_id, stop in \
+                all_prev_stops.iteritems():
+            # If there is more than one possible previous stop,
+            # we have an ambiguous case
+            if len(stop.prev_stops) > 1:
+                for prev_stop in stop.trip_paths_by_prev_stop:
+                    for trip_path in stop.trip_paths_by_prev_stop[prev_stop]:
+                        if trip_path not in ambiguous_trip_paths:
+                            ambiguous_trip_paths[trip_path] = set()
+
+                        ambiguous_trip_paths[trip_path] \
+                            .add((stop_id, prev_stop))
+
+        return ambiguous_trip_paths
+
+    def get_prev_stop(self, vehicle):
+        """ Returns a possible previous stop for a given trip
+        and stop.
+
+        See resolve_vehicles, which is faster for many vehicles at once.
+
+        Arguments
+        ---------
+        vehicle: transit_realtime.VehiclePosition
+            GTFS realtime VehiclePosition object (protobuf)
+
+        Returns
+        -------
+        str
+            stop ID of possible previous stop, or None if there is none (or
+            the stop is not known)
+        """
+        return self.resolve_vehicles([vehicle])[0]
+
+    def resolve_feed(self, feed_message):
+        """ Returns a possible previous stop for every vehicle of a feed.
+
+        Arguments
+        ---------
+        feed_message: transit_realtime.FeedMessage
+            GTFS realtime FeedMessage object (protobuf)
+
+        Returns
+        -------
+        list[tuple[transit_realtime.VehiclePosition, str]]
+            List of pairs of each vehicle of the feed (in order) + stop ID of
+            possible previous stop of the vehicle, or None if there is none
+        """
+        vehicles = [entity.vehicle for entity in feed_message.entity
+                    if entity.HasField("vehicle")]
+        return zip(vehicles, self.resolve_vehicles(vehicles))
+
+    def resolve_vehicles(self, vehicles):
+        """ Returns a possible previous stop for each of a list of vehicles.
+
+        For each vehicle, if there is a unique previous stop for its StopID,
+        or for its StopID and stop sequence, that stop is returned.
+
+        Otherwise, given the StopID and the trip's service code and origin
+        time, we attempt to find a corresponding trip in the static data that
+        matches, or at least as closely as possible in terms of origin time.
+        The rationale for this is based off of the assumption that the
+        corresponding train on the same route and day is most likely going
+        to match with the closest scheduled train on that route and day.
+
+        There is a possibility of multiple previous stops for
+        the given information (as there may be multiple trips
+        on the same day and route starting at the same time),
+        and currently there is no real tiebreaker method, other
+        than the leftmost tied element. That's mainly because
+        given that this is only used in the last case,
+        this means that given the route, stop, stop sequence,
+        service code, and origin time (and even direction), it
+        was not enough to decide the actual previous stop. But
+        this is all of the information that is guaranteed by
+        a particular Vehicle in the feed.
+
+        One can use future stops to match with possible trips
+        or partial string matching in case an actual trip path ID
+        is given at a certain point, but not entirely sure if the
+        effort is worth it; out of the few observations of the live
+        feed so far, this case isn't encountered.
+
+        TODO: Do testing/observations to see if this edge case
+        ever occurs
+
+        The work shared between vehicles is done once per call: the service
+        code is computed once per start date, and the origin times of each
+        ambiguous StopID are read once for all of the vehicles at that
+        StopID.
+
+        Arguments
+        ---------
+        vehicles: list[transit_realtime.VehiclePosition]
+            GTFS realtime VehiclePosition objects (protobuf)
+
+        Returns
+        -------
+        list[str]
+            stop ID of possible previous stop of each vehicle, or None if
+            there is none (or the stop or trip is not known)
+        """
+        stops = self._packed.metadata["stops"]
+        service_codes = self._packed.metadata["service_codes"]
+        unique_prev_stops = self._packed.section("prev_stops")
+        sequence_offsets = self._packed.section("sequence_offsets")
+        sequences = self._packed.section("sequences")
+        sequence_prev_stops = self._packed.section("sequence_prev_stops")
+
+        prev_stops = [None] * len(vehicles)
+
+        # Map of start date -> index of its service code, or -1 if there
+        # are no trips of that service code (or the date is invalid)
+        service_code_indices = {}
+
+        # Map of StopID row * number of service codes + service code index
+        # -> list of tuples of (origin time, index of vehicle), for the
+        # vehicles whose previous stop is ambiguous
+        ambiguous_vehicles = {}
+
+        for i, vehicle in enumerate(vehicles):
+            stop = self._stop_index.get(vehicle.stop_id)
+            stop_sequence = vehicle.current_stop_sequence
+
+            # If the stop is not known, or the vehicle is at the beginning of
+            # its trip, there is obviously no previous stop
+            if stop is None or stop_sequence == 1:
+                continue
+
+            trip = vehicle.trip
+            trip_id = trip.trip_id.split("_")
+            if len(trip_id) < 2:
+                continue
+
+            row = self._find_stop(trip_id[1].split(".")[0], stop)
+            if row < 0:
+                continue
+
+            # If there is only a unique previous stop among all trip
+            # paths, simply return that stop
+            prev_stop = unique_prev_stops[row]
+
+            # Otherwise, if there is a unique previous stop corresponding
+            # also to the stop sequence number, return that previous stop
+            if prev_stop < 0:
+                start, end = sequence_offsets[row], sequence_offsets[row + 1]
+                j = bisect_left(sequences, stop_sequence, start, end)
+                if j < end and sequences[j] == stop_sequence:
+                    prev_stop = sequence_prev_stops[j]
+
+            if prev_stop >= 0:
+                prev_stops[i] = stops[prev_stop]
+                continue
+
+            # Otherwise, if the stop sequence number with the StopID does
+            # not guarantee a unique previous stop, or the stop sequence
+            # number does not match with a known number, attempt to guess a
+            # likely possibility by origin time
+            if trip.start_date not in service_code_indices:
+                try:
+                    service_code = PrevStops._get_service_code(trip)
+                except ValueError:
+                    service_code = None
+
+                service_code_indices[trip.start_date] = \
+                    service_codes.index(service_code) \
+                    if service_code in service_codes else -1
+
+            service_code_index = service_code_indices[trip.start_date]
+            if service_code_index < 0 or not trip_id[0].isdigit():
+                continue
+
+            key = row * len(service_codes) + service_code_index
+            if key not in ambiguous_vehicles:
+                ambiguous_vehicles[key] = []
+            ambiguous_vehicles[key].append((int(trip_id[0]), i))
+
+        ambiguous_keys = self._packed.section("ambiguous_keys")
+        ambiguous_offsets = self._packed.section("ambiguous_offsets")
+        j = 0
+
+        # The ambiguous keys are visited in order, so that each one is found
+        # by bisecting only past the previous one
+        for key in sorted(ambiguous_vehicles):
+            j = bisect_left(ambiguous_keys, key, j)
+            if j == len(ambiguous_keys) or ambiguous_keys[j] != key:
+                continue
+
+            start, end = ambiguous_offsets[j], ambiguous_offsets[j + 1]
+            origin_times = self._packed.section("origin_times")[start:end]
+            origin_prev_stops = \
+                self._packed.section("origin_prev_stops")[start:end]
+
+            for origin_time, i in ambiguous_vehicles[key]:
+                # We do this in case the origin time of the vehicle is later
+                # or earlier than all stored origin times for a particular
+                # stop sequence/route/service code. Instead of cycling
+                # around, we simply let left = right in these edge cases, as
+                # otherwise we would have to take into account the next day,
+                # possibly a different service code, but this then
+                # contradicts the specified start date of the vehicle.
+                right = min(bisect_left(origin_times, origin_time),
+                            len(origin_times) - 1)
+                left = max(0, right - 1)
+
+                closest_index = min([
+                    (abs(origin_time - origin_times[candidate]), candidate)
+                    for candidate in [left, right]
+                ])[1]
+
+                prev_stops[i] = stops[origin_prev_stops[closest_index]]
+
+        return prev_stops
+
+
+class StopGraph:
+    """ StopGraph class.
+
+    Used primarily to store static information concerning stops
+    in order to retrieve the sequence of points between adjacent stops
+    on a particular trip. This information is needed in order to render the
+    frames of the path of the subway car.
+
+    The edge table is stored in a packed file (graph.bin, built by a
+    StopGraphBuilder; see StopGraph.write for its layout), which is
+    memory-mapped when the object is created, so that every process serving
+    the live feed shares the same copy.
+    """
+    # Version of the format of the packed file; increment it whenever the
+    # meaning of the packed file's contents changes, so that files written by
+    # older versions are rejected instead of being misread
+    VERSION = 3
+
+    # Map of name -> typecode of the sections of the packed file
+    SCHEMA = {
+        "keys": "i",
+        "shapes": "i",
+        "start_indices": "i",
+        "end_indices": "i"
+    }
+
+    # Number of pairs of stations whose chains of segments are cached (see
+    # find_segments)
+    PATH_CACHE_SIZE = 4096
+
+    def __init__(self, path, source=None):
+        """ Constructor.
+
+        Arguments
+        ---------
+        path: str
+            Path of the packed file of the edge table
+        source: dict[str -> str]
+            Expected map of static GTFS file -> hash of the file the packed
+            file was built from (as recorded in the build manifest), or None
+            to accept any source
+
+        Raises
+        ------
+        StaleCacheError
+            If the packed file is missing, was written by another version of
+            its format, or was built from a different static feed
+        """
+        self._packed = PackedFile(path, self.VERSION, self.SCHEMA, source)
+        self._station_index = None
+        self._adjacency = None
+
+        # Map of (start station, end station) -> tuple of the segment IDs of
+        # the chain of segments between the stations, or None if there is
+        # none, for the most recently used pairs of stations
+        self._chains = LRUCache(self.PATH_CACHE_SIZE)
+
+    @staticmethod
+    def write(path, edges, stop_stations, source=None):
+        """ Writes the edge table to a packed file.
+
+        In the packed file, stations and shapes are referred to by their
+        index in the lists of the metadata. The packed file has the following
+        metadata and sections:
+
+        metadata: {
+            stations: [station IDs],
+            shapes: [shape IDs],
+            stop_stations: {stop ID: station ID, for the stops (other than
+                the stations themselves) of every station}
+        }
+        keys: start station index * number of stations + end station index
+            of each edge, sorted
+        shapes: shape index of each edge
+        start_indices: index of the start stop in the shape of each edge
+        end_indices: index of the end stop in the shape of each edge
+
+        Arguments
+        ---------
+        path: str
+            Path of the packed file to write
+        edges: dict[Segment[str, str] -> Edge(str, int, int)]
+            Map of Segment of start/stop stations -> Edge representing
+            sequence of points along Segment
+        stop_stations: dict[str -> str]
+            Map of stop ID -> station ID of the parent station of the stop,
+            for every stop with a parent station
+        source: dict[str -> str]
+            Map of static GTFS file -> hash of the file, for the files the
+            edge table was built from
+        """
+        stations = sorted(set(station for segment in edges
+                              for station in segment))
+        shapes = sorted(set(edge.shape_id for edge in edges.values()))
+        station_index = {station: i for i, station in enumerate(stations)}
+        shape_index = {shape: i for i, shape in enumerate(shapes)}
+
+        def get_key(segment):
+            return station_index[segment.start] * len(stations) + \
+                station_index[segment.end]
+
+        sections = {
+            name: array("i")
+            for name in ["keys", "shapes", "start_indices", "end_indices"]
+        }
+        for segment in sorted(edges, key=get_key):
+            edge = edges[segment]
+            sections["keys"].append(get_key(segment))
+            sections["shapes"].append(shape_index[edge.shape_id])
+            sections["start_indices"].append(edge.start_index)
+            sections["end_indices"].append(edge.end_index)
+
+        station_set = set(stations)
+        stop_stations = {
+            stop: station for stop, station in stop_stations.iteritems()
+            if station in station_set and stop != station
+        }
+
+        write_packed(path, StopGraph.VERSION,
+                     {"stations": stations, "shapes": shapes,
+                      "stop_stations": stop_stations}, sections, source)
+
+    def get_station(self, stop_id):
+        """ Returns the station of a stop, such as the stop ID of a
+        vehicle in the live feed (which is usually a platform of a station,
+        such as 118S).
+
+        Arguments
+        ---------
+        stop_id: str
+            Stop ID
+
+        Returns
+        -------
+        str
+            Station ID of the parent station of the stop (or of the stop
+            itself, if it is a station), or None if the station is not in
+            the graph
+        """
+        station = self._packed.metadata["stop_stations"].get(stop_id)
+        if station is not None:
+            return station
+
+        return stop_id if stop_id in self._get_station_index() else None
+
+    def _get_station_index(self):
+        """ Returns map of station ID -> index of the station in the
+        graph. """
+        if self._station_index is None:
+            self._station_index = {
+                station: i for i, station in
+                enumerate(self._packed.metadata["stations"])
+            }
+
+        return self._station_index
+
+    def _find_edge(self, start, end):
+        """ Returns the row of the edge from one station to another in the
+        edge table.
+
+        Arguments
+        ---------
+        start: str
+            Station ID of start stop
+        end: str
+            Station ID of end stop
+
+        Returns
+        -------
+        int
+            Row of the edge, or -1 if there is no edge stored from the start
+            station to the end station
+        """
+        station_index = self._get_station_index()
+        if start not in station_index or end not in station_index:
+            return -1
+
+        key = station_index[start] * len(station_index) + station_index[end]
+        keys = self._packed.section("keys")
+        row = bisect_left(keys, key)
+
+        return row if row < len(keys) and keys[row] == key else -1
+
+    def __len__(self):
+        """ Returns the number of segments of the graph (every edge, in
+        either direction); segment IDs range from 0 to this number. """
+        return 2 * len(self._packed.section("keys"))
+
+    def get_segments_version(self, shapes):
+        """ Returns the version of the segment IDs of the graph and their
+        paths, which changes whenever the graph or the shapes are rebuilt
+        with different contents, so that paths cached by segment ID can be
+        told apart from those of another build.
+
+        Arguments
+        ---------
+        shapes: ShapeStore
+            Store of the points of every shape
+
+        Returns
+        -------
+        str
+            Version of the segments
+        """
+        return hashlib.sha1(self._packed.digest +
+                            shapes.digest).hexdigest()[:16]
+
+    def get_segment_id(self, start, end):
+        """ Returns the ID of the segment between two stops.
+
+        Segments are numbered by the row of their edge in the edge table,
+        as 2 * row for the direction the edge is stored in, and 2 * row + 1
+        for the other. IDs are stable for as long as the graph is not
+        rebuilt, so that clients can cache the path of each segment by ID.
+
+        Arguments
+        ---------
+        start: str
+            Station ID of start stop (must be a parent station)
+        end: str
+            Station ID of end stop (must be a parent station)
+
+        Returns
+        -------
+        int
+            Segment ID
+
+        Raises
+        ------
+        KeyError
+            If the stops are not adjacent on any trip
+        """
+        row = self._find_edge(start, end)
+        if row >= 0:
+            return 2 * row
+
+        row = self._find_edge(end, start)
+        if row >= 0:
+            return 2 * row + 1
+
+        raise KeyError(Segment(start, end))
+
+    def get_path(self, start, end, shapes):
+        """ Returns sequence of points between two stops.
+
+        The two stops need to be adjacent stops on any particular
+        trip (local or express).
+
+        Arguments
+        ---------
+        start: str
+            Station ID of start stop (must be a parent station)
+        end: str
+            Station ID of end stop (must be a parent station)
+        shapes: ShapeStore
+            Store of the points of every shape
+
+        Returns
+        -------
+        ShapePath
+            View of the sequence of points; use ShapePath.tolist to get a
+            list of coordinates in the form [lon, lat]
+        """
+        return self.get_segment_path(self.get_segment_id(start, end), shapes)
+
+    def get_length(self, start, end, shapes):
+        """ Returns the length of the path between two stops.
+
+        Arguments
+        ---------
+        start: str
+            Station ID of start stop (must be a parent station)
+        end: str
+            Station ID of end stop (must be a parent station)
+        shapes: ShapeStore
+            Store of the points of every shape
+
+        Returns
+        -------
+        float
+            Length in meters, read from the distances of the ShapeStore
+            rather than by walking the path
+
+        Raises
+        ------
+        KeyError
+            If there is no segment between the stops
+        """
+        return self.get_path(start, end, shapes).get_length()
+
+    def get_point_at_distance(self, start, end, distance, shapes):
+        """ Returns the point at a distance along the path between two stops.
+
+        Arguments
+        ---------
+        start: str
+            Station ID of start stop (must be a parent station)
+        end: str
+            Station ID of end stop (must be a parent station)
+        distance: float
+            Distance in meters from the start stop (distances beyond either
+            end are taken as that end)
+        shapes: ShapeStore
+            Store of the points of every shape
+
+        Returns
+        -------
+        Coordinates
+            Point at the distance, found by bisection (see
+            ShapePath.interpolate)
+
+        Raises
+        ------
+        KeyError
+            If there is no segment between the stops
+        """
+        return self.get_path(start, end, shapes).interpolate([distance])[0]
+
+    def get_point_at_fraction(self, start, end, fraction, shapes):
+        """ Returns the point at a fraction of the path between two stops.
+
+        Arguments
+        ---------
+        start: str
+            Station ID of start stop (must be a parent station)
+        end: str
+            Station ID of end stop (must be a parent station)
+        fraction: float
+            Fraction of the length of the path from the start stop
+        shapes: ShapeStore
+            Store of the points of every shape
+
+        Returns
+        -------
+        Coordinates
+            Point at the fraction, found by bisection (see
+            ShapePath.interpolate)
+
+        Raises
+        ------
+        KeyError
+            If there is no segment between the stops
+        """
+        path = self.get_path(start, end, shapes)
+        return path.interpolate([fraction * path.get_length()])[0]
+
+    def _get_adjacency(self, shapes):
+        """ Returns the segments from each station.
+
+        Arguments
+        ---------
+        shapes: ShapeStore
+            Store of the points of every shape
+
+        Returns
+        -------
+        list[list[tuple[float, int, int]]]
+            List of (length in meters, index of end station, segment ID) of
+            the segments from each station, by index of the station
+        """
+        if self._adjacency is None:
+            num_stations = len(self._get_station_index())
+            adjacency = [[] for i in xrange(num_stations)]
+
+            for row, key in enumerate(self._packed.section("keys")):
+                start, end = divmod(key, num_stations)
+                length = self.get_segment_path(2 * row, shapes).get_length()
+                adjacency[start].append((length, end, 2 * row))
+                adjacency[end].append((length, start, 2 * row + 1))
+
+            self._adjacency = adjacency
+
+        return self._adjacency
+
+    def find_segments(self, start, end, shapes):
+        """ Returns the chain of segments between two stations.
+
+        Stations adjacent on some trip are joined by their own segment.
+        Other stations (such as the stations a train running express, or
+        rerouted, is between) are joined by the chain of segments of least
+        total length, found with Dijkstra's algorithm. Chains are cached
+        for the PATH_CACHE_SIZE most recently used pairs of stations, so
+        that finding the chain between the same stations again is a single
+        lookup.
+
+        Arguments
+        ---------
+        start: str
+            Station ID of start stop (must be a parent station)
+        end: str
+            Station ID of end stop (must be a parent station)
+        shapes: ShapeStore
+            Store of the points of every shape
+
+        Returns
+        -------
+        tuple[int]
+            Segment IDs of the chain, in order from the start station
+
+        Raises
+        ------
+        KeyError
+            If no chain of segments joins the stations
+        """
+        key = (start, end)
+        try:
+            segment_ids = self._chains[key]
+        except KeyError:
+            segment_ids = self._chains[key] = \
+                self._find_chain(start, end, shapes)
+
+        if segment_ids is None:
+            raise KeyError(Segment(start, end))
+
+        return segment_ids
+
+    def _find_chain(self, start, end, shapes):
+        """ Returns the chain of segments between two stations, without
+        caching it; see find_segments.
+
+        Arguments
+        ---------
+        start: str
+            Station ID of start stop
+        end: str
+            Station ID of end stop
+        shapes: ShapeStore
+            Store of the points of every shape
+
+        Returns
+        -------
+        tuple[int]
+            Segment IDs of the chain, or None if no chain joins the stations
+        """
+        try:
+            return (self.get_segment_id(start, end),)
+        except KeyError:
+            pass
+
+        station_index = self._get_station_index()
+        if start not in station_index or end not in station_index or \
+                start == end:
+            return None
+
+        adjacency = self._get_adjacency(shapes)
+        source = station_index[start]
+        target = station_index[end]
+
+        # Map of station index -> tuple of (distance from the start station,
+        # ID of the last segment of the shortest chain to the station, and
+        # index of the station before it) of the stations reached so far
+        reached = {source: (0.0, None, None)}
+        queue = [(0.0, source)]
+
+        while queue:
+            distance, station = heappop(queue)
+            if station == target:
+                break
+
+            # Stations are queued again whenever a shorter chain to them is
+            # found, so only their first (and shortest) entry is used
+            if distance > reached[station][0]:
+                continue
+
+            for length, next_station, segment_id in adjacency[station]:
+                next_distance = distance + length
+                if next_station not in reached or \
+                        next_distance < reached[next_station][0]:
+                    reached[next_station] = (next_distance, segment_id,
+                                             station)
+                    heappush(queue, (next_distance, next_station))
+        else:
+            return None
+
+        segment_ids = []
+        while station != source:
+            _, segment_id, station = reached[station]
+            segment_ids.append(segment_id)
+
+        return tuple(reversed(segment_ids))
+
+    def find_path(self, start, end, shapes):
+        """ Returns sequence of points between two stops, along the chain of
+        segments between them (see find_segments).
+
+        Arguments
+        ---------
+        start: str
+            Station ID of start stop (must be a parent station)
+        end: str
+            Station ID of end stop (must be a parent station)
+        shapes: ShapeStore
+            Store of the points of every shape
+
+        Returns
+        -------
+        ShapePath or PathChain
+            View of the sequence of points
+
+        Raises
+        ------
+        KeyError
+            If no chain of segments joins the stations
+        """
+        return self.get_chain_path(self.find_segments(start, end, shapes),
+                                   shapes)
+
+    def get_chain_path(self, segment_ids, shapes):
+        """ Returns sequence of points of a chain of segments.
+
+        Arguments
+        ---------
+        segment_ids: tuple[int]
+            Segment IDs of the chain, in order
+        shapes: ShapeStore
+            Store of the points of every shape
+
+        Returns
+        -------
+        ShapePath or PathChain
+            View of the sequence of points (the ShapePath of the segment,
+            for a single segment)
+
+        Raises
+        ------
+        KeyError
+            If there is no segment with one of the IDs
+        """
+        paths = [self.get_segment_path(segment_id, shapes)
+                 for segment_id in segment_ids]
+
+        return paths[0] if len(paths) == 1 else PathChain(paths)
+
+    def get_segment_path(self, segment_id, shapes):
+        """ Returns sequence of points of a segment.
+
+        Only one edge for each segment of stop endpoints is stored; thus, in
+        order to return the correct sequence of points, we must keep track of
+        two things. One, the relative orientation of the segment with the
+        edge stored, and two, the actual orientation of the stored edge with
+        the shape. In particular, the stored edge may represent a path that
+        goes northbound (since edges are represented as a start/end structure
+        and are thus "directed"), but the shape that is being used for this
+        edge may actually be southbound.
+
+        Thus, we store these orientations as +/-1, and simply compose
+        the orientations to see whether or not a reverse slice is needed.
+
+        Arguments
+        ---------
+        segment_id: int
+            Segment ID (see get_segment_id)
+        shapes: ShapeStore
+            Store of the points of every shape
+
+        Returns
+        -------
+        ShapePath
+            View of the sequence of points; use ShapePath.tolist to get a
+            list of coordinates in the form [lon, lat]
+
+        Raises
+        ------
+        KeyError
+            If there is no segment with the ID
+        """
+        if not 0 <= segment_id < len(self):
+            raise KeyError(segment_id)
+
+        row = segment_id // 2
+        relative_orientation = -1 if segment_id % 2 else 1
+
+        edge = Edge(
+            self._packed.metadata["shapes"][
+                self._packed.section("shapes")[row]],
+            self._packed.section("start_indices")[row],
+            self._packed.section("end_indices")[row]
+        )
+
+        shape_id = edge.shape_id
+        start_index, end_index = sorted((edge.start_index,
+                                        edge.end_index))
+        shape_orientation = 1 if start_index == edge.start_index else -1
+        points = shapes.get_points(shape_id)
+
+        # Regular slice suffices
+        if relative_orientation * shape_orientation == 1:
+            return points[start_index:end_index + 1]
+        # Reverse slice is needed
+        else:
+            if start_index == 0:
+                return points[end_index::-1]
+            else:
+                return points[end_index:start_index - 1:-1]